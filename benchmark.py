@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Timings for the hot paths of main.py, on made up scenes.
+
+    A gltf + bin scene is generated in a temporary folder (grid meshes, with translation / rotation / scaling keys),
+    then each stage is timed on its own, best of a few runs :
+    - load : load_models on the scene (json, bin mapping, accessors, animation tracks).
+    - make_z_up : on the loaded models.
+    - write_m2 : on the parts given by split_for_skin (the m2 and skin files go in the temporary folder).
+    write_m2 turns the model Z up itself, so its time includes a make_z_up.
+    Peak memory of each stage comes from a separate run under tracemalloc (not timed, tracing slows everything down).
+
+    Commandline :
+    - python benchmark.py [n_vertices] [--meshes N] [--keys N] [--repeat N] [--json FILE]
+    - argument 1 : number of vertices of each mesh (default 1000000).
+    - --json : also writes the results as json (- for stdout), with the git commit, to compare runs across commits.
+    Example : python benchmark.py 200000 --meshes 4 --json results.json
+
+"""
+
+import argparse
+import array
+import contextlib
+import io
+import itertools
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from main import load_models
+
+grid_columns = 256 # vertices per row of the generated meshes
+
+def _grid_mesh(n_vertices):
+    # A wavy grid of at least n_vertices vertices (whole rows) : positions, normals, uvs and triangles, as flat arrays.
+    rows = max(2, -(-n_vertices // grid_columns))
+    n_vertices = rows * grid_columns
+    columns = [i % grid_columns for i in range(0, n_vertices)]
+    lines = [i // grid_columns for i in range(0, n_vertices)]
+    heights = [math.sin(x * 0.1) * math.cos(z * 0.1) for x, z in zip(columns, lines)]
+    positions = array.array("f", itertools.chain.from_iterable(zip(columns, heights, lines)))
+    normals = array.array("f", [0.0, 1.0, 0.0]) * n_vertices
+    uvs = array.array("f", itertools.chain.from_iterable(zip([x / grid_columns for x in columns], [z / rows for z in lines])))
+    triangles = array.array("I")
+    for row in range(0, rows - 1):
+        for column in range(0, grid_columns - 1):
+            a = row * grid_columns + column
+            triangles.extend((a, a + grid_columns, a + 1, a + 1, a + grid_columns, a + grid_columns + 1))
+    return positions, normals, uvs, triangles
+
+def _keys(n_keys):
+    # timestamps (seconds, 24 fps), translations, rotations (around Y) and scalings of a looping move
+    angles = [2.0 * math.pi * i / max(n_keys - 1, 1) for i in range(0, n_keys)]
+    timestamps = array.array("f", [i / 24.0 for i in range(0, n_keys)])
+    translations = array.array("f", itertools.chain.from_iterable((math.cos(a), 0.0, math.sin(a)) for a in angles))
+    rotations = array.array("f", itertools.chain.from_iterable((0.0, math.sin(a / 2.0), 0.0, math.cos(a / 2.0)) for a in angles))
+    scalings = array.array("f", itertools.chain.from_iterable((1.0 + 0.25 * math.sin(a),) * 3 for a in angles))
+    return timestamps, translations, rotations, scalings
+
+def make_scene(folder, n_vertices, n_meshes=1, n_keys=240, name="benchmark"):
+    # Writes name.gltf + name.bin in folder : n_meshes grid meshes of about n_vertices vertices each, every one on its own
+    # animated node (n_keys keys per track, no animation when 0). Returns the gltf path.
+    positions, normals, uvs, triangles = _grid_mesh(n_vertices)
+    timestamps, translations, rotations, scalings = _keys(n_keys)
+    n_grid = len(positions) // 3
+    blobs = []
+    accessors = []
+    def add(values, component_type, accessor_type, count, extra=None):
+        accessors.append(dict(extra or {}, bufferView=len(blobs), byteOffset=0, componentType=component_type, count=count, type=accessor_type))
+        blobs.append(values.tobytes())
+        return len(accessors) - 1
+
+    meshes, nodes, channels, samplers = [], [], [], []
+    for mesh_number in range(0, n_meshes):
+        shifted = array.array("f", positions) # the meshes side by side
+        shifted[0::3] = array.array("f", [x + mesh_number * grid_columns for x in positions[0::3]])
+        bounds = { "min": [min(shifted[i::3]) for i in range(0, 3)], "max": [max(shifted[i::3]) for i in range(0, 3)] }
+        attributes = { "POSITION": add(shifted, 5126, "VEC3", n_grid, bounds), "NORMAL": add(normals, 5126, "VEC3", n_grid), "TEXCOORD_0": add(uvs, 5126, "VEC2", n_grid) }
+        meshes.append({ "name": "%s_%d" % (name, mesh_number), "primitives": [{ "attributes": attributes, "indices": add(triangles, 5125, "SCALAR", len(triangles)) }] })
+        nodes.append({ "name": "%s_%d" % (name, mesh_number), "mesh": mesh_number })
+        if n_keys > 0:
+            for path, values, accessor_type in (("translation", translations, "VEC3"), ("rotation", rotations, "VEC4"), ("scale", scalings, "VEC3")):
+                samplers.append({ "input": add(timestamps, 5126, "SCALAR", n_keys), "output": add(values, 5126, accessor_type, n_keys), "interpolation": "LINEAR" })
+                channels.append({ "sampler": len(samplers) - 1, "target": { "node": mesh_number, "path": path } })
+
+    buffer_views = []
+    offset = 0
+    for blob in blobs:
+        buffer_views.append({ "buffer": 0, "byteOffset": offset, "byteLength": len(blob) })
+        offset += len(blob)
+    gltf = { "asset": { "version": "2.0" }, "buffers": [{ "uri": name + ".bin", "byteLength": offset }], "bufferViews": buffer_views, "accessors": accessors,
+        "images": [{ "uri": name + ".png" }], "nodes": nodes, "meshes": meshes }
+    if channels:
+        gltf["animations"] = [{ "channels": channels, "samplers": samplers }]
+    with open(os.path.join(folder, name + ".bin"), "wb") as bin_file:
+        for blob in blobs:
+            bin_file.write(blob)
+    path = os.path.join(folder, name + ".gltf")
+    with open(path, "w") as gltf_file:
+        json.dump(gltf, gltf_file)
+    return path
+
+def _best_time(function, setup, repeat):
+    # Best wall time of repeat runs, setup isn't timed.
+    best = None
+    for i in range(0, repeat):
+        arg = setup()
+        start = time.perf_counter()
+        function(arg)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def _peak_memory(function, setup):
+    # Peak of the memory allocated by function (tracemalloc), what setup allocated isn't counted.
+    arg = setup()
+    tracemalloc.start()
+    try:
+        function(arg)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def _split_models(path):
+    # the models write_m2 accepts : every mesh of the scene, split under the skin limits
+    return list(itertools.chain.from_iterable(model.split_for_skin() for model in load_models(path)))
+
+def _write_models(models, folder):
+    with contextlib.redirect_stdout(io.StringIO()): # no "Files saved" lines in the timings
+        for model in models:
+            model.write_m2("world\\benchmark\\", folder=folder)
+
+def bench_stages(path, repeat=3, folder=None):
+    # Times load, make_z_up and write_m2 on the scene at path -> { stage : { "seconds", "ns_per_vertex", "peak_bytes" } }.
+    # The m2 files are written in folder (the one of the scene by default).
+    if folder is None:
+        folder = os.path.dirname(os.path.abspath(path))
+    n_vertices = sum(len(model.vertices) // 3 for model in load_models(path))
+    stages = [
+        ("load", load_models, lambda: path),
+        ("make_z_up", lambda models: [model.make_z_up() for model in models], lambda: load_models(path)),
+        ("write_m2", lambda models: _write_models(models, folder), lambda: _split_models(path)),
+    ]
+    results = {}
+    for stage, function, setup in stages:
+        elapsed = _best_time(function, setup, repeat)
+        results[stage] = { "seconds": elapsed, "ns_per_vertex": elapsed * 1e9 / n_vertices, "peak_bytes": _peak_memory(function, setup) }
+        print("%s : %d vertices in %.1f ms, %.1f ns per vertex, %.1f MB peak" % (stage, n_vertices, elapsed * 1000, results[stage]["ns_per_vertex"], results[stage]["peak_bytes"] / 1e6))
+    return n_vertices, results
+
+def _git_commit():
+    # commit of the checkout the benchmark runs from, None outside of git
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)), stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True).stdout.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(n_vertices, n_meshes=1, n_keys=240, repeat=3):
+    # Generates the scene, times every stage in a temporary folder (the m2 files go there too) -> results, ready for json.
+    with tempfile.TemporaryDirectory() as folder:
+        path = make_scene(folder, n_vertices, n_meshes, n_keys)
+        total_vertices, stages = bench_stages(path, repeat, folder)
+    return { "commit": _git_commit(), "python": platform.python_version(), "machine": platform.machine(), "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "scene": { "vertices_per_mesh": n_vertices, "meshes": n_meshes, "keys": n_keys, "vertices": total_vertices }, "repeat": repeat, "stages": stages }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Times the load, make_z_up and write_m2 stages of main.py on a generated scene.")
+    parser.add_argument("n_vertices", nargs="?", type=int, default=1000000, help="vertices of each mesh (rounded up to whole grid rows)")
+    parser.add_argument("--meshes", type=int, default=1, help="meshes in the scene")
+    parser.add_argument("--keys", type=int, default=240, help="keys per animation track (0 : not animated)")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per stage, the best one is kept")
+    parser.add_argument("--json", default=None, metavar="FILE", help="write the results as json to FILE (- for stdout)")
+    args = parser.parse_args()
+
+    with contextlib.redirect_stdout(sys.stderr if args.json == "-" else sys.stdout): # keep stdout for the json
+        results = run(args.n_vertices, args.meshes, args.keys, args.repeat)
+    if args.json == "-":
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    elif args.json is not None:
+        with open(args.json, "w") as json_file:
+            json.dump(results, json_file, indent=2)
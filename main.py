@@ -1,7 +1,7 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-""" The script should run fine in python 2. 
+""" The script runs with python 3. 
     
     The code below is released under https://www.gnu.org/licenses/gpl-3.0.txt
     Author : Mjollna (admin@mjollna.org), 2018-01
@@ -11,10 +11,40 @@
     
 """ 
 
+import argparse
+import array
+import base64
+import collections
+import concurrent.futures
+import cProfile
+import itertools
+import contextlib
+import glob
+import hashlib
+import http.server
+import io
 import struct
 import json
+import math
+import mmap
+import operator
 import os
+import shutil
+import signal
+import socketserver
+import stat
 import sys
+import threading
+import time
+import tracemalloc
+import urllib.parse
+import zipfile
+import zlib
+
+try:
+    import ijson # optional : reads big gltf files without holding the whole json text in memory
+except ImportError:
+    ijson = None
 
 """ HOW TO USE (please read, that'll save you time later ! :) ) : 
 
@@ -38,14 +68,18 @@ import sys
     - For better results, keep the same total length for t/r/s animations. (The longest one is picked up by the script to fit global_sequence field).
     - Normal scaling is 1.0, so 0.0 makes the model invisible on the axes with 0.0.
     - Adding scaling animations makes the model invisible in Noggit 3.1222 (SDL), so it might be easier to add scaling animations at the last moment on your edit. When inserting a keyframe in Blender (i), you can selest LocRot instead of LocRotScale to avoid the problem temporarily.
-    - There is a problem in make_z_up() function with quaternions, which I cannot fix because I don't understand enough maths. Since the function turns the whole model, rotations probably need to be corrected as well. I've commented my failed attempts at making this right, so rotations are not taken into account in make_z_up() for the time being.
+    - make_z_up() turns the whole model (X Y Z -> X -Z Y), and rotation keys get the same change of basis (X Y Z W -> X -Z Y W).
     
     Before exporting : 
     - For now, only one texture per mesh is ok.
+    - The m2 refers to the texture file name with a blp extension. Images embedded in a glb (or a data uri) have no file name :
+    the name of the image is used instead (or of its material, or of the mesh), wood.blp for an image named wood.
     - If you use more than a single UV island for your model, see around line 679 (texture flags) to put 3 instead of 0 for wrap_x and wrap_y. If more than one island is used, without this option UV mapping & actually the whole model have a chance to look completely scrambled ingame. Mark seam is ok though.
     - You can select smooth shading (object mode) to have nicer normals ingame.
     - Work in quads and apply a triangulate modifier just before exporting (wrench icon > modifier > triangulate > apply).
-    - Use a single mesh for now. The name of the M2 is the name given to the mesh in Blender.
+    - Every mesh of the scene is converted to its own m2 + skin. The name of the M2 is the name given to the mesh in Blender
+    (an unnamed mesh gets the name of the file and its number : murloc_mesh_0 for the first one of murloc.gltf).
+    - Big meshes are cut automatically in submeshes of 65535 vertices / indices at most (the skin format uses 16 bits). Above 65535 vertices in total, the mesh is written as several m2 (name_0, name_1...).
     
     Export options : 
     - Select your mesh in object mode.
@@ -60,12 +94,63 @@ import sys
     - export within playback range
     - keyframes start with 0
     
-    Commandline (be sure to have textures and bin files in the same folder) : 
+    Commandline (bin files are found from the gltf folder, embedded (data uri) buffers work too) : 
     - python main.py yourfile.gltf world\texturepath\
-    - argument 1 : input gltf file
+    - argument 1 : input gltf or glb file (a glb holds the json and the bin data in one file, it's read in one go)
     - argument 2 : textures path of the output m2.
     Example : python main.py murloc_01.gltf "world\murloc\\"
 
+    Many files at once : give a folder (all the gltf and glb files below it) or a glob pattern instead of the gltf file.
+    They are converted in parallel, -j sets the number of worker processes (default : one per core).
+    The m2 + skin files are all written in the current folder : a scene with two meshes of the same name, or with the name of a mesh
+    of another scene, is skipped (and counts as a failure), its files would overwrite the other ones.
+    Example : python main.py exports/ "world\murloc\\" -j 8
+
+    Files whose gltf, bin files and texture path didn't change since the last run (and whose m2 + skin are still there)
+    are skipped. What was converted is kept in gltf2m2_cache.json in the current folder, --force converts everything.
+
+    Big scenes : every node, mesh and animation of the gltf is indexed once. If the ijson module is installed (pip install ijson),
+    the gltf is read as a stream and the entries the converter doesn't use are dropped.
+
+    Options :
+    - --weld : merges the vertices Blender duplicated (same position, normal and uv), so the m2 carries less of them.
+    --weld 0.0001 also merges the vertices closer than that (snapped on a grid, so a few close pairs may stay apart).
+    - --optimize-cache : reorders triangles (and vertices) so the client transforms each vertex fewer times, prints ACMR / ATVR before and after.
+    - --lods : also writes the 01, 02 and 03 skins, simplified to 50%, 25% and 12.5% of the triangles, for the client to draw at distance.
+    --lods 0.6,0.3 gives your own ratios (up to 3). The simplified skins only use vertices of the m2, nothing is added.
+    - --collision : adds a collision mesh, the convex hull of the extreme vertices of the model (26 directions), so players can't walk through it.
+    - --minimal-spheres : the submesh spheres get Ritter's sphere when it's smaller than the one around the box center.
+    Bounding box and radius always come from the vertices, once turned Z up.
+    - --textures : converts the png / tga textures of the meshes to blp (with mipmaps), next to the m2 files under the texture uri
+    (textures/wood.png -> textures/wood.blp), the images embedded in the scene too (under their texture name). --textures dxt1, dxt3, dxt5 or palette forces the format, auto picks dxt1 when
+    the alpha is all or nothing, dxt5 otherwise. Sizes must be powers of 2. Textures are converted in the same worker pool
+    as the meshes, a picture shared by many models is encoded once, and unchanged ones are skipped (kept in the cache).
+    - --reduce-keys : removes the baked keys that linear interpolation gives back, e.g. a straight move baked at 24 fps keeps its 2 ends.
+    --reduce-keys 0.01,0.005,0.01 sets the translation (units), rotation (radians) and scaling tolerances.
+
+    As a library : import main, then main.convert("murloc.glb", "world\\murloc\\") gives back the m2 and skin files in memory
+    (file name -> memoryview), nothing is written. The source can also be the content of a gltf / glb file (bytes), the output
+    a folder, a binary stream (the files go in a zip archive) or a function(file name, data). Options are the ones of convert_scene
+    (weld=0.0, lods=[0.5, 0.25], collision=True...). A mesh that can't be converted raises a ConversionError with the report,
+    so does a broken gltf (bad json, missing entries, indices out of range).
+
+    Server : python main.py --serve keeps the converter running on 127.0.0.1:8642 (--serve host:port, or --serve /tmp/gltf2m2.sock
+    for a unix socket), with -j warm worker processes. POST /convert with a json job { "source": "murloc.glb", "texture_path": "world\\murloc\\",
+    "options": { "lods": [0.5, 0.25] }, "output": "murloc" } (or { "jobs": [...] }) : the m2 + skin files are written below the folder
+    the server was started in, the sources are read from it too (paths leading out of it are refused). A json line comes back for each
+    job as soon as it's done (files, timings, report). POST /convert-data with the content of a glb gives back a zip of the files.
+    Converted files stay in memory (--cache-size, in MB) : the same content with the same options comes back at once.
+    GET /status gives the cache and job counts. ctrl + c (or kill) stops it.
+
+    Profiling : --profile times every stage of the conversion (json parsing, buffer mapping, accessors, z up, packing, file writes...),
+    counts the bytes and elements read and written and traces the memory peak of each stage (tracemalloc, so it runs slower).
+    The summary is printed, and the report goes to gltf2m2_profile.json (or --profile report.json). --profile-dump stats.prof also runs
+    cProfile over the whole conversion, in a single process (python -m pstats stats.prof to read it). Without --profile, nothing is measured.
+
+    Checking the output : python main.py output/ --validate reads back every m2 of the folder (or glob pattern) and its skins,
+    and reports the counts / offsets pointing out of the file, indices above the number of vertices, lookups out of their tables,
+    missing skins... Only the headers and arrays are read (memory mapped), so a few thousand models take seconds. Exits with 1 on problems.
+
 """
 
 """ GENERIC STUFF 
@@ -77,19 +162,675 @@ struct_f = struct.Struct("<f")
 struct_u8 = struct.Struct("<B")
 struct_h = struct.Struct("<h") # signed short
 struct_H = struct.Struct("<H") # unsigned short
+struct_vertex = struct.Struct("<3f4B4B3f2f2f") # pos, bone weights, bone indices, normal, tex coords 0, tex coords 1
+struct_m2array = struct.Struct("<II") # count, offset
+struct_m2track = struct.Struct("<hhIIII") # interpolation, global sequence, timestamps (count, offset), values (count, offset)
+struct_anim = struct.Struct("<hhIfIhhIII7fhh")
+struct_bone = struct.Struct("<iIhHHH" + struct_m2track.format[1:] * 3 + "3f") # translation, rotation, scaling, pivot
+struct_texture = struct.Struct("<IIII") # type, flags, name (length, offset)
+struct_vertex_record = struct.Struct("32s") # pos, normal, uv : 8 floats, as raw bytes
+struct_weld_key = struct.Struct("64s") # the same 8 values, snapped to a grid (64 bits integers)
+struct_m2_header = struct.Struct("<40I14f22I") # everything up to the bounding box, the boxes and radiuses, then the n_ / ofs_ pairs
+struct_skin_header = struct.Struct("<12I") # magic, indices, triangles, properties, submeshes, texture units (count, offset), lod
+struct_submesh = struct.Struct("<10H7f") # id, level, vertices (start, count), indices (start, count), bones..., centers and radius
+struct_texture_unit = struct.Struct("<BB11h")
+struct_vector = struct.Struct("<3f")
+struct_glb_header = struct.Struct("<III") # magic, version, length
+struct_glb_chunk = struct.Struct("<II") # length, type
+
+# gltf componentType -> array / struct typecode
+component_types = { 5120: "b", 5121: "B", 5122: "h", 5123: "H", 5125: "I", 5126: "f" }
+# gltf type -> number of components per element
+type_sizes = { "SCALAR": 1, "VEC2": 2, "VEC3": 3, "VEC4": 4, "MAT2": 4, "MAT3": 9, "MAT4": 16 }
+
+glb_magic = 0x46546C67 # "glTF"
+glb_json_chunk = 0x4E4F534A # "JSON"
+glb_bin_chunk = 0x004E4942 # "BIN\0"
+
+def _read_glb(path, read_json=True):
+    # A .glb is a header, a JSON chunk and an optional BIN chunk : the file is mapped once, the json is parsed from the mapping
+    # and the BIN chunk stays a view on it (no copy). Returns the gltf (None without read_json) and that view (None without BIN chunk).
+    with open(path, "rb") as glb_file:
+        if os.fstat(glb_file.fileno()).st_size < struct_glb_header.size + struct_glb_chunk.size:
+            raise ConversionError(path + " is too small to be a glb file.")
+        mapping = mmap.mmap(glb_file.fileno(), 0, access=mmap.ACCESS_READ)
+    return _parse_glb(mapping, path, read_json)
+
+def _parse_glb(mapping, label, read_json=True):
+    # The chunks of a glb already in memory (a mapped file, or bytes), closed on errors when it's a mapping.
+    if len(mapping) < struct_glb_header.size + struct_glb_chunk.size:
+        _close_buffers([mapping])
+        raise ConversionError(label + " is too small to be a glb file.")
+    magic, version, length = struct_glb_header.unpack_from(mapping, 0)
+    if magic != glb_magic or version != 2:
+        _close_buffers([mapping])
+        raise ConversionError(label + " is not a glb 2.0 file.")
+    chunks = {}
+    offset = struct_glb_header.size
+    while offset + struct_glb_chunk.size <= min(length, len(mapping)):
+        chunk_length, chunk_type = struct_glb_chunk.unpack_from(mapping, offset)
+        offset += struct_glb_chunk.size
+        chunks.setdefault(chunk_type, (offset, offset + chunk_length)) # the first chunk of each type, as the spec says
+        offset += (chunk_length + 3) & ~3 # chunks are 4 bytes aligned
+    if glb_json_chunk not in chunks:
+        _close_buffers([mapping])
+        raise ConversionError(label + " has no JSON chunk.")
+    gltf = json.loads(bytes(mapping[slice(*chunks[glb_json_chunk])])) if read_json else None
+    if glb_bin_chunk not in chunks:
+        _close_buffers([mapping])
+        return gltf, None
+    return gltf, memoryview(mapping)[slice(*chunks[glb_bin_chunk])]
+
+def _close_buffers(buffers):
+    # Mapped bin files get closed, the glb BIN view is released and then its mapping, decoded data uris are just bytes.
+    for buffer in buffers:
+        if isinstance(buffer, memoryview):
+            mapping = buffer.obj
+            buffer.release()
+            buffer = mapping
+        if isinstance(buffer, mmap.mmap):
+            buffer.close()
+
+def _map_buffers(gltf, gltf_path, glb_bin=None):
+    # Memory-maps every bin file of the scene (read only), paths are relative to the gltf file.
+    # The buffer without uri is the BIN chunk of a glb, data uris (base64) are decoded.
+    # gltf_path is None for a gltf given as bytes without folder : it can only have embedded buffers.
+    buffers = []
+    for buffer in gltf.get("buffers", []):
+        uri = buffer.get("uri")
+        if uri is None:
+            if glb_bin is None:
+                _close_buffers(buffers)
+                raise ConversionError("A buffer has no uri, and there's no glb BIN chunk for it.")
+            buffers.append(glb_bin)
+            continue
+        if uri.startswith("data:"):
+            buffers.append(base64.b64decode(uri.split(",", 1)[1]))
+            continue
+        if gltf_path is None:
+            _close_buffers(buffers)
+            raise ConversionError("The buffer " + uri + " is a file, but the gltf was given without its folder.")
+        with open(os.path.join(os.path.dirname(gltf_path), urllib.parse.unquote(uri)), "rb") as bin_file:
+            if os.fstat(bin_file.fileno()).st_size == 0: # can't map an empty file
+                buffers.append(mmap.mmap(-1, 1))
+            else:
+                buffers.append(mmap.mmap(bin_file.fileno(), 0, access=mmap.ACCESS_READ))
+    return buffers
+
+def _get_accessor(gltf, buffers, accessor_index):
+    # Copies a whole accessor at once out of its mapped buffer, returns a flat array (count * components values).
+    accessor = gltf["accessors"][accessor_index]
+    buffer_view = gltf["bufferViews"][accessor["bufferView"]]
+    typecode = component_types[accessor["componentType"]]
+    count = accessor["count"]
+    n_components = type_sizes[accessor["type"]]
+
+    values = array.array(typecode)
+    element_size = values.itemsize * n_components
+    stride = buffer_view.get("byteStride", element_size)
+    if count == 0:
+        return values
+
+    data = memoryview(buffers[buffer_view["buffer"]]) # no copy, just a view on the mapped file
+    start = buffer_view.get("byteOffset", 0) + accessor.get("byteOffset", 0)
+    end = start + stride * (count - 1) + element_size
+    if stride == element_size:
+        values.frombytes(data[start:end])
+    else: # interleaved : only keep the bytes of our elements
+        values.frombytes(b"".join([data[i:i + element_size] for i in range(start, end, stride)]))
+    data.release()
+    if sys.byteorder == "big": # gltf is always little endian
+        values.byteswap()
+    _count("accessor_bytes", len(values) * values.itemsize)
+    _count("accessor_elements", count)
+    return values
+
+# integer componentType -> largest value, for the normalized accessors (signed ones are clamped to -1.0)
+normalized_scales = { "b": 127.0, "B": 255.0, "h": 32767.0, "H": 65535.0 }
+
+def _get_float_accessor(gltf, buffers, accessor_index):
+    # _get_accessor for the vertex attributes and keyframe values, always floats : gltf allows integers there
+    # (normalized uvs, quantized positions...), the m2 records and tracks only take floats.
+    values = _get_accessor(gltf, buffers, accessor_index)
+    if values.typecode == "f":
+        return values
+    if values.typecode not in normalized_scales:
+        raise ConversionError("Accessor " + str(accessor_index) + " has a component type the converter can't read as floats.")
+    if not gltf["accessors"][accessor_index].get("normalized", False):
+        return array.array("f", values)
+    scale = normalized_scales[values.typecode]
+    return array.array("f", [max(value / scale, -1.0) for value in values])
+
+def _get_timestamps(gltf, buffers, accessor_index):
+    # gltf keyframe times are float seconds, m2 wants u32 milliseconds, rounded : 0.7 s is 699.99994 ms as a float.
+    return array.array("I", [round(t * 1000) for t in _get_accessor(gltf, buffers, accessor_index)])
+
+def _array_to_bytes(values):
+    # m2 is little endian, like the arrays on pretty much every machine this runs on.
+    if sys.byteorder == "big":
+        values = array.array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+sign_flip_table = bytes(bytearray(i ^ 0x80 for i in range(256))) # for bytes.translate, flips the top bit
+
+def _y_up_to_z_up(values, n_components, negate=True):
+    # X Y Z (W) -> X -Z Y (W) on a flat float array, in place.
+    if len(values) == 0:
+        return
+    ys = values[1::n_components]
+    values[1::n_components] = values[2::n_components]
+    values[2::n_components] = ys
+    if negate: # -Z is just the sign bit flipped, so do it on the raw bytes of the new Y column
+        sign_byte = values.itemsize - 1 if sys.byteorder == "little" else 0
+        with memoryview(values).cast("B") as raw:
+            with raw[values.itemsize + sign_byte::values.itemsize * n_components] as column:
+                column[:] = column.tobytes().translate(sign_flip_table)
+
+def _pack_vertices(vertices, normals, texture_coords_0):
+    # Builds all the 48 bytes vertex records at once : every record is 12 words of 4 bytes,
+    # so each field is a strided column of a float array, filled with a single slice copy.
+    n_vertices = len(vertices) // 3
+    words = struct_vertex.size // 4
+    records = array.array("f", bytes(struct_vertex.size * n_vertices))
+    for i in range(0, 3):
+        records[i::words] = vertices[i::3] # pos
+        records[5 + i::words] = normals[i::3] # normals (normalize them ?)
+    bone_weights = array.array("f", struct_f.unpack(struct_u32.pack(255))) # 255 0 0 0 : full weight on bone 0, stored bit for bit
+    records[3::words] = bone_weights * n_vertices
+    # bone indices (words 4) are all 0
+    records[8::words] = texture_coords_0[0::2] # tex coords 0
+    records[9::words] = texture_coords_0[1::2]
+    # tex coords 1 (words 10 and 11) are all 0.0
+    return _array_to_bytes(records)
+
+def _compress_rotations(values):
+    # float quaternions -> m2 compressed shorts, the client reads them back as (s + 32768) / 32767 for s < 0, (s - 32767) / 32767 otherwise.
+    # So a float with the sign bit clear (+0.0 included) goes to round(f * 32767) - 32768, one with it set (-0.0 included) to round(f * 32767) + 32767.
+    # The sign bits are read from the raw floats, and everything goes through C level maps.
+    # Components are clamped to [-1, 1] first : a slightly unnormalized 1.00002 would go past 32767 and come back as -1.0.
+    bits = array.array("I")
+    bits.frombytes(values.tobytes())
+    offsets = map(operator.add, map(operator.mul, map(operator.rshift, bits, itertools.repeat(31)), itertools.repeat(65535)), itertools.repeat(-32768))
+    clamped = map(min, map(max, values, itertools.repeat(-1.0)), itertools.repeat(1.0))
+    return array.array("h", map(operator.add, map(round, map(operator.mul, clamped, itertools.repeat(32767.0))), offsets))
+
+""" PROFILING
+"""
+
+class Profiler(object):
+    # Stage timers, counters and memory peaks of the conversions (--profile) : stage name -> calls, seconds, peak bytes
+    # (memory the stage allocated above what was there when it started, tracemalloc), counter name -> total.
+    # Only the active profiler measures anything : without one, _stage() and _count() are a global lookup and a test.
+    def __init__(self, trace_memory=True):
+        self.trace_memory = trace_memory
+        self.stages = {}
+        self.counters = collections.Counter()
+        self._memory = [] # [memory at start, peak of the finished inner stages] of the stages being timed
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        if self.trace_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            if self._memory: # reset_peak forgets the peak the enclosing stage has reached so far
+                self._memory[-1][1] = max(self._memory[-1][1], peak)
+            tracemalloc.reset_peak()
+            self._memory.append([current, 0])
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            peak = 0
+            if self.trace_memory:
+                start_memory, inner_peak = self._memory.pop()
+                peak = max(tracemalloc.get_traced_memory()[1], inner_peak)
+                if self._memory:
+                    self._memory[-1][1] = max(self._memory[-1][1], peak)
+                peak -= start_memory
+            self.add_stage(name, elapsed, peak)
+
+    def add_stage(self, name, seconds, peak_bytes=0, calls=1):
+        stats = self.stages.setdefault(name, [0, 0.0, 0])
+        stats[0] += calls
+        stats[1] += seconds
+        stats[2] = max(stats[2], peak_bytes)
+
+    def report(self):
+        # json ready
+        return { "stages": dict((name, { "calls": calls, "seconds": seconds, "peak_bytes": peak }) for name, (calls, seconds, peak) in self.stages.items()),
+            "counters": dict(self.counters) }
+
+    def add_report(self, report):
+        # Adds the report of another profiler (a worker process) : times, calls and counters add up, the peaks are the highest.
+        for name, stats in report["stages"].items():
+            self.add_stage(name, stats["seconds"], stats["peak_bytes"], stats["calls"])
+        self.counters.update(report["counters"])
+
+    def print_summary(self):
+        print("Profile (total time of each stage, nested stages are counted in their parents too) :")
+        for name, (calls, seconds, peak) in sorted(self.stages.items(), key=lambda item: -item[1][1]):
+            print("    %-24s %8d call(s) %10.1f ms %10.1f MB peak" % (name, calls, seconds * 1000, peak / 1e6))
+        for name, total in sorted(self.counters.items()):
+            print("    %-24s %d" % (name, total))
+
+profiler = None # the active Profiler, see start_profiling
+
+def start_profiling(trace_memory=True):
+    # Makes a new Profiler the active one (tracemalloc slows everything down a lot, trace_memory=False for timings only).
+    global profiler
+    profiler = Profiler(trace_memory)
+    if trace_memory:
+        tracemalloc.start()
+    return profiler
+
+def stop_profiling():
+    # Stops the active Profiler, returns its report.
+    global profiler
+    report = profiler.report()
+    if profiler.trace_memory:
+        tracemalloc.stop()
+    profiler = None
+    return report
+
+_no_stage = contextlib.nullcontext()
+
+def _stage(name):
+    # with _stage("write_m2"): ... times the block when profiling, does nothing otherwise.
+    return profiler.stage(name) if profiler is not None else _no_stage
+
+def _count(name, n=1):
+    if profiler is not None:
+        profiler.counters[name] += n
+
+""" VERTEX CACHE
+"""
+
+vertex_cache_size = 16 # post-transform cache entries assumed for the 3.3.5 era cards
+max_skin_vertices = 65535 # skin vertex lookup and triangles are u16
+max_submesh_indices = 65535 # submesh index count is u16 (index start can go further, with the level field)
+
+def vertex_cache_stats(triangles, cache_size=vertex_cache_size):
+    # Simulates a FIFO post-transform cache : returns ACMR (misses per triangle) and ATVR (misses per used vertex, 1.0 is perfect).
+    if len(triangles) == 0:
+        return 0.0, 0.0
+    cache = collections.deque()
+    cached = set()
+    misses = 0
+    for v in triangles:
+        if v not in cached:
+            misses += 1
+            cache.append(v)
+            cached.add(v)
+            if len(cache) > cache_size:
+                cached.discard(cache.popleft())
+    return misses / (len(triangles) // 3), misses / len(set(triangles))
+
+def _tipsify(triangles, n_vertices, cache_size):
+    # Sander, Nehab & Barczak, "Fast Triangle Reordering for Vertex Locality and Reduced Overdraw" : walks the mesh
+    # fanning around a vertex still in the cache, O(triangles). Returns the new index list.
+    n_triangles = len(triangles) // 3
+    live = array.array("I", bytes(4 * n_vertices)) # triangles not emitted yet, per vertex
+    for v in triangles:
+        live[v] += 1
+    start = array.array("I", bytes(4 * (n_vertices + 1))) # vertex -> its triangles, compact (start[v] to start[v + 1])
+    for v in range(0, n_vertices):
+        start[v + 1] = start[v] + live[v]
+    adjacency = array.array("I", bytes(4 * len(triangles)))
+    filled = array.array("I", start[:n_vertices])
+    for i, v in enumerate(triangles):
+        adjacency[filled[v]] = i // 3
+        filled[v] += 1
+
+    timestamps = array.array("q", bytes(8 * n_vertices))
+    emitted = bytearray(n_triangles)
+    dead_ends = []
+    output = array.array(triangles.typecode)
+    time_now = cache_size + 1
+    cursor = 0
+    fan = 0
+    while fan >= 0:
+        candidates = []
+        for t in adjacency[start[fan]:start[fan + 1]]:
+            if not emitted[t]:
+                emitted[t] = 1
+                for v in triangles[t * 3:t * 3 + 3]:
+                    output.append(v)
+                    dead_ends.append(v)
+                    candidates.append(v)
+                    live[v] -= 1
+                    if time_now - timestamps[v] > cache_size:
+                        timestamps[v] = time_now
+                        time_now += 1
+
+        # next fan : the candidate that will still be in the cache when its remaining triangles are done, and is the oldest there
+        fan = -1
+        best = -1
+        for v in candidates:
+            if live[v] > 0:
+                priority = 0
+                if time_now - timestamps[v] + 2 * live[v] <= cache_size:
+                    priority = time_now - timestamps[v]
+                if priority > best:
+                    best = priority
+                    fan = v
+        if fan == -1: # dead end : go back to a recent vertex, or the next one with triangles left
+            while dead_ends and fan == -1:
+                v = dead_ends.pop()
+                if live[v] > 0:
+                    fan = v
+            while fan == -1 and cursor < n_vertices:
+                if live[cursor] > 0:
+                    fan = cursor
+                cursor += 1
+    return output
+
+""" LEVELS OF DETAIL
+"""
+
+lod_ratios = [0.5, 0.25, 0.125] # triangles kept in the 01, 02 and 03 skins, from the full mesh
+max_lods = 3 # skins 01 to 03, 00 is the full mesh
+lod_tolerance = 0.1 # the cell size search stops within 10% of the target triangle count (or when the cell size can't change any more)
+
+def _group_slices(keys):
+    # Sorts equal keys together : returns that order, the keys in it and the slice of the order holding each key.
+    order = sorted(range(0, len(keys)), key=keys.__getitem__)
+    grouped = list(map(keys.__getitem__, order))
+    starts = [0] + list(itertools.compress(range(1, len(grouped)), map(operator.ne, grouped[1:], grouped[:-1]))) # where the key changes
+    return order, list(map(grouped.__getitem__, starts)), list(map(slice, starts, starts[1:] + [len(keys)]))
+
+def _group_sums(values, order, slices):
+    # Sum of the values of every group of _group_slices, all at C level.
+    ordered = list(map(values.__getitem__, order))
+    return list(map(math.fsum, map(ordered.__getitem__, slices)))
+
+def _vertex_quadrics(vertices, triangles):
+    # Garland & Heckbert error quadrics : every vertex gets the sum of the planes of its triangles, weighted by their area.
+    # Returns 10 dicts (aa, ab, ac, ad, bb, bc, bd, cc, cd, dd), vertex -> value, for the vertices used by the triangles.
+    mul = operator.mul
+    sub = operator.sub
+    corners = [triangles[0::3].tolist(), triangles[1::3].tolist(), triangles[2::3].tolist()]
+    positions = [[list(map(vertices[axis::3].__getitem__, corner)) for axis in range(0, 3)] for corner in corners] # corner -> x, y, z lists
+    (x0, y0, z0), (x1, y1, z1), (x2, y2, z2) = positions
+    ux, uy, uz = list(map(sub, x1, x0)), list(map(sub, y1, y0)), list(map(sub, z1, z0))
+    vx, vy, vz = list(map(sub, x2, x0)), list(map(sub, y2, y0)), list(map(sub, z2, z0))
+    a = list(map(sub, map(mul, uy, vz), map(mul, uz, vy)))
+    b = list(map(sub, map(mul, uz, vx), map(mul, ux, vz)))
+    c = list(map(sub, map(mul, ux, vy), map(mul, uy, vx)))
+    d = list(map(operator.neg, map(operator.add, map(operator.add, map(mul, a, x0), map(mul, b, y0)), map(mul, c, z0))))
+    w = [0.5 / length if length > 0.0 else 0.0 for length in map(math.hypot, a, b, c)] # hypot is twice the area : unit plane times area
+    aw, bw, cw, dw = list(map(mul, a, w)), list(map(mul, b, w)), list(map(mul, c, w)), list(map(mul, d, w))
+    faces = [(a, aw), (a, bw), (a, cw), (a, dw), (b, bw), (b, cw), (b, dw), (c, cw), (c, dw), (d, dw)]
+
+    # every vertex sums the quadrics of the triangles it is a corner of
+    order, used, slices = _group_slices(corners[0] + corners[1] + corners[2])
+    return [dict(zip(used, _group_sums(list(map(mul, left, right)) * 3, order, slices))) for left, right in faces]
+
+def _cluster_cells(vertices, used, cell_size):
+    # Grid cell of every used vertex, as a dict vertex -> (x, y, z) cell.
+    scale = 1.0 / cell_size
+    return dict(zip(used, zip(*[list(map(math.floor, map(operator.mul, map(vertices[axis::3].__getitem__, used), itertools.repeat(scale)))) for axis in range(0, 3)])))
+
+def _count_clustered(triangles, cells):
+    # Triangles left when every vertex moves to its cell (the ones with 2 corners in the same cell are gone).
+    corners = list(map(cells.__getitem__, triangles))
+    return sum(1 for a, b, c in zip(corners[0::3], corners[1::3], corners[2::3]) if a != b and b != c and a != c)
+
+def _simplify(vertices, quadrics, triangles, target):
+    # Vertex clustering with quadrics (Lindstrom, "Out-of-Core Simplification of Large Polygonal Models") : the vertices of a grid cell
+    # all become the one with the smallest error for the quadric of the whole cell, so the lod only uses vertices of the m2.
+    # The cell size is searched to get about target triangles. Returns the new triangle list (same vertex numbers).
+    n_triangles = len(triangles) // 3
+    used = list(dict.fromkeys(triangles))
+    if n_triangles <= 1 or target >= n_triangles:
+        return list(triangles)
+    extent = max(max(map(vertices[axis::3].__getitem__, used)) - min(map(vertices[axis::3].__getitem__, used)) for axis in range(0, 3))
+    if extent == 0.0:
+        return list(triangles)
+
+    # a flat square of side extent gives about 2 * (extent / cell size)^2 triangles, the next tries correct for the real shape
+    # until a size too small and one too large are known, then the search bisects between them
+    cell_size = extent * math.sqrt(2.0 / target)
+    smaller = 0.0 # largest cell size known to leave too many triangles
+    larger = None # smallest cell size known to leave too few
+    best = None
+    while True:
+        cells = _cluster_cells(vertices, used, cell_size)
+        count = _count_clustered(triangles, cells)
+        if count > 0 and (best is None or abs(count - target) < abs(best[1] - target)):
+            best = (cells, count)
+        if count > 0 and abs(count - target) <= target * lod_tolerance:
+            break
+        if count > target:
+            smaller = max(smaller, cell_size)
+        else:
+            larger = cell_size if larger is None else min(larger, cell_size)
+        if larger is None:
+            cell_size *= math.sqrt(count / target)
+        elif larger - smaller <= larger * 1e-4: # the count jumps over the target, keep the closest one
+            break
+        else:
+            cell_size = (smaller + larger) / 2.0
+    if best is None:
+        return list(triangles)
+    cells = best[0]
+
+    # quadric of every cell, then the vertex of the cell with the smallest error
+    keys = list(map(cells.__getitem__, used))
+    order, cell_keys, slices = _group_slices(keys)
+    cell_quadrics = dict(zip(cell_keys, zip(*[_group_sums(list(map(coefficient.__getitem__, used)), order, slices) for coefficient in quadrics])))
+    errors = []
+    for x, y, z, key in zip(*[list(map(vertices[axis::3].__getitem__, used)) for axis in range(0, 3)], keys):
+        aa, ab, ac, ad, bb, bc, bd, cc, cd, dd = cell_quadrics[key]
+        errors.append(x * (aa * x + 2.0 * (ab * y + ac * z + ad)) + y * (bb * y + 2.0 * (bc * z + bd)) + z * (cc * z + 2.0 * cd) + dd)
+    order = sorted(range(0, len(used)), key=errors.__getitem__, reverse=True)
+    chosen = dict(zip(map(keys.__getitem__, order), map(used.__getitem__, order))) # the smallest error comes last and stays
+    remap = dict(zip(used, map(chosen.__getitem__, keys)))
+
+    corners = list(map(remap.__getitem__, triangles))
+    output = []
+    kept = set()
+    for a, b, c in zip(corners[0::3], corners[1::3], corners[2::3]):
+        if a != b and b != c and a != c:
+            key = min((a, b, c), (b, c, a), (c, a, b)) # the same triangle, whatever the first corner
+            if key not in kept:
+                kept.add(key)
+                output += key
+    return output
+
+""" KEYFRAMES
+"""
 
-def _get_u32(f): return struct_u32.unpack(f.read(4))[0]
-def _get_f(f): return struct_f.unpack(f.read(4))[0]
+key_tolerances = [0.001, 0.001, 0.001] # translation (units), rotation (radians), scaling (ratio)
+
+def _lerp_error(values, a, b, k, t):
+    # Distance between key k and the linear interpolation of keys a and b at t (values : flat list, 3 per key).
+    return math.sqrt(sum((values[3 * a + i] + (values[3 * b + i] - values[3 * a + i]) * t - values[3 * k + i]) ** 2 for i in range(0, 3)))
+
+def _nlerp_error(values, a, b, k, t):
+    # Angle between key k and the normalized linear interpolation of the quaternions a and b (how the client plays them).
+    q = [values[4 * a + i] + (values[4 * b + i] - values[4 * a + i]) * t for i in range(0, 4)]
+    length = math.sqrt(sum(map(operator.mul, q, q)))
+    key = values[4 * k:4 * k + 4]
+    key_length = math.sqrt(sum(map(operator.mul, key, key)))
+    if length == 0.0 or key_length == 0.0:
+        return math.pi
+    dot = abs(sum(map(operator.mul, q, key))) / (length * key_length) # q and -q are the same rotation
+    return 2.0 * math.acos(min(dot, 1.0))
+
+def _reduce_track(timestamps, values, n_components, tolerance):
+    # Ramer-Douglas-Peucker on the keys : the first and last keys stay, a key is kept only when the interpolation of its neighbours
+    # (after reduction) misses it by more than tolerance. Returns the new timestamps and values.
+    n_keys = len(timestamps)
+    if n_keys <= 2:
+        return timestamps, values
+    error = _lerp_error if n_components == 3 else _nlerp_error
+    times = timestamps.tolist()
+    flat = values.tolist()
+    kept = bytearray(n_keys)
+    kept[0] = kept[-1] = 1
+    segments = [(0, n_keys - 1)]
+    while segments:
+        a, b = segments.pop()
+        worst = None
+        worst_error = tolerance
+        duration = times[b] - times[a]
+        for k in range(a + 1, b):
+            key_error = error(flat, a, b, k, (times[k] - times[a]) / duration if duration else 0.0)
+            if key_error > worst_error:
+                worst = k
+                worst_error = key_error
+        if worst is not None:
+            kept[worst] = 1
+            segments.append((a, worst))
+            segments.append((worst, b))
+    keys = [k for k in range(0, n_keys) if kept[k]]
+    new_values = array.array("f")
+    for k in keys:
+        new_values.extend(values[n_components * k:n_components * k + n_components])
+    return array.array(timestamps.typecode, map(times.__getitem__, keys)), new_values
+
+""" BOUNDS
+"""
+
+# k-DOP axes (faces, edges and corners of a cube) : the extreme vertices along them are the points of the collision hull
+collision_directions = [(1.0, 0.0, 0.0), (0.0, 1.0, 0.0), (0.0, 0.0, 1.0), (1.0, 1.0, 0.0), (1.0, -1.0, 0.0), (1.0, 0.0, 1.0), (1.0, 0.0, -1.0),
+    (0.0, 1.0, 1.0), (0.0, 1.0, -1.0), (1.0, 1.0, 1.0), (1.0, 1.0, -1.0), (1.0, -1.0, 1.0), (1.0, -1.0, -1.0)]
+
+def _squared_distances(points, center):
+    # points : x, y and z lists -> squared distance of every point to center, at C level.
+    dx, dy, dz = [list(map(operator.sub, values, itertools.repeat(c))) for values, c in zip(points, center)]
+    return list(map(operator.add, map(operator.add, map(operator.mul, dx, dx), map(operator.mul, dy, dy)), map(operator.mul, dz, dz)))
+
+def _bounding_box(points):
+    if len(points[0]) == 0:
+        return [0.0, 0.0, 0.0], [0.0, 0.0, 0.0]
+    return [min(values) for values in points], [max(values) for values in points]
+
+def _ritter_sphere(points):
+    # Ritter, "An Efficient Bounding Sphere" : a sphere on two far apart points, moved and grown until every point is inside.
+    # A few percents above the minimal sphere, often much smaller than the one around the box center.
+    distances = _squared_distances(points, [values[0] for values in points])
+    first = [values[distances.index(max(distances))] for values in points]
+    distances = _squared_distances(points, first)
+    second = [values[distances.index(max(distances))] for values in points]
+    center = [(a + b) * 0.5 for a, b in zip(first, second)]
+    radius = math.sqrt(max(distances)) * 0.5
+    for attempt in range(0, 64):
+        distances = _squared_distances(points, center)
+        farthest = max(distances)
+        if farthest <= radius * radius:
+            break
+        distance = math.sqrt(farthest)
+        point = [values[distances.index(farthest)] for values in points]
+        new_radius = (radius + distance) * 0.5
+        center = [c + (p - c) * (new_radius - radius) / distance for c, p in zip(center, point)]
+        radius = new_radius
+    return center, max(radius, math.sqrt(max(_squared_distances(points, center))))
+
+def _bounding_sphere(points, minimal=False):
+    # Center and radius holding all the points : around the box center (what the m2 header radius is about),
+    # or with minimal, the smaller of that one and Ritter's sphere.
+    if len(points[0]) == 0:
+        return [0.0, 0.0, 0.0], 0.0
+    lower, upper = _bounding_box(points)
+    center = [(a + b) * 0.5 for a, b in zip(lower, upper)]
+    sphere = (center, math.sqrt(max(_squared_distances(points, center))))
+    if minimal:
+        sphere = min(sphere, _ritter_sphere(points), key=operator.itemgetter(1))
+    return sphere
+
+def _convex_hull(points):
+    # Incremental convex hull, for a few points only (O(n^2)). Returns the triangles (outward winding), none if the points are flat.
+    def plane(a, b, c): # unit normal and distance to the origin, or None for a flat triangle
+        u = [q - p for p, q in zip(points[a], points[b])]
+        v = [q - p for p, q in zip(points[a], points[c])]
+        normal = [u[1] * v[2] - u[2] * v[1], u[2] * v[0] - u[0] * v[2], u[0] * v[1] - u[1] * v[0]]
+        length = math.sqrt(sum(map(operator.mul, normal, normal)))
+        if length <= epsilon * extent:
+            return None
+        normal = [value / length for value in normal]
+        return normal, -sum(map(operator.mul, normal, points[a]))
+    def distance(face, p):
+        normal, d = planes[face]
+        return sum(map(operator.mul, normal, points[p])) + d
+
+    n_points = len(points)
+    extent = max([max(values) - min(values) for values in zip(*points)] + [0.0])
+    epsilon = extent * 1e-6
+    if n_points < 4 or extent == 0.0:
+        return []
+    # starting tetrahedron : a point, the farthest from it, the farthest from their line, the farthest from their plane
+    a = 0
+    b = max(range(0, n_points), key=lambda p: sum((x - y) ** 2 for x, y in zip(points[p], points[a])))
+    c = max(range(0, n_points), key=lambda p: math.sqrt(sum((x - y) ** 2 for x, y in zip(points[p], points[a]))) + math.sqrt(sum((x - y) ** 2 for x, y in zip(points[p], points[b]))))
+    base = plane(a, b, c)
+    if base is None:
+        return []
+    planes = { (a, b, c): base }
+    e = max(range(0, n_points), key=lambda p: abs(distance((a, b, c), p)))
+    if abs(distance((a, b, c), e)) <= epsilon:
+        return []
+    if distance((a, b, c), e) > 0.0:
+        b, c = c, b # e must be behind abc
+    faces = [(a, b, c), (a, c, e), (a, e, b), (b, e, c)]
+    planes = dict((face, plane(*face)) for face in faces)
+
+    for p in range(0, n_points):
+        visible = set(face for face in faces if distance(face, p) > epsilon)
+        if not visible:
+            continue
+        edges = set()
+        for f in visible:
+            edges.update(((f[0], f[1]), (f[1], f[2]), (f[2], f[0])))
+        horizon = [edge for edge in edges if (edge[1], edge[0]) not in edges] # edges between a visible face and a hidden one
+        faces = [face for face in faces if face not in visible]
+        for i, j in horizon:
+            face_plane = plane(i, j, p)
+            if face_plane is not None:
+                faces.append((i, j, p))
+                planes[(i, j, p)] = face_plane
+    return faces
+
+def _collision_hull(points):
+    # Simplified convex hull of the model : the hull of its extreme vertices along the k-DOP axes.
+    # Returns the hull vertices, triangles and unit face normals (empty for flat models).
+    if len(points[0]) == 0:
+        return [], [], []
+    support = []
+    for direction in collision_directions:
+        projections = list(map(operator.add, map(operator.add, map(operator.mul, points[0], itertools.repeat(direction[0])),
+            map(operator.mul, points[1], itertools.repeat(direction[1]))), map(operator.mul, points[2], itertools.repeat(direction[2]))))
+        support.append(projections.index(max(projections)))
+        support.append(projections.index(min(projections)))
+    support = list(dict.fromkeys(support))
+    hull_points = [[values[i] for values in points] for i in support]
+    faces = _convex_hull(hull_points)
+    used = list(dict.fromkeys(itertools.chain.from_iterable(faces))) # the inner support points go away
+    new_index = dict(zip(used, range(0, len(used))))
+    triangles = [new_index[i] for i in itertools.chain.from_iterable(faces)]
+    normals = []
+    for a, b, c in faces:
+        u = [q - p for p, q in zip(hull_points[a], hull_points[b])]
+        v = [q - p for p, q in zip(hull_points[a], hull_points[c])]
+        normal = [u[1] * v[2] - u[2] * v[1], u[2] * v[0] - u[0] * v[2], u[0] * v[1] - u[1] * v[0]]
+        length = math.sqrt(sum(map(operator.mul, normal, normal)))
+        normals.append([value / length for value in normal])
+    return [hull_points[i] for i in used], triangles, normals
+
+""" FILE LAYOUT
+"""
 
-def _quat_float_to_short(f):
-    value = f
-    if (value > 0):
-      value = value * 32767.0 - 32768.0
-    else: 
-      value = value * 32767.0 + 32768.0
-    #value = round(value)
-    #if value == 32768.0: value = 32767.0 # sometimes rounding messes the values up a little
-    return value
+class Layout(object):
+    # Puts the sections of a file one after the other : offsets come from the sizes, never from hand written sums.
+    def __init__(self, start):
+        self.size = start
+
+    def add(self, size):
+        # Reserves size bytes at the end of the file, returns their offset.
+        offset = self.size
+        self.size += size
+        return offset
 
 """ MODEL CLASS
 """
@@ -99,18 +840,21 @@ class Model(object):
         if name is None:
             self.name = "default_name"
             self.texture = ""
-            self.vertices = []
-            self.normals = []
-            self.triangles = []
-            self.texture_coords_0 = []
-            self.min_bounds = []
-            self.max_bounds = []
-            self.translation_ts = []
-            self.translation_values = []
-            self.rotation_ts = []
-            self.rotation_values = []
-            self.scaling_ts = []
-            self.scaling_values = []            
+            # Everything is stored in flat typed arrays : x y z x y z... for vertices, etc.
+            self.vertices = array.array("f")
+            self.normals = array.array("f")
+            self.triangles = array.array("H")
+            self.texture_coords_0 = array.array("f")
+            self.min_bounds = [0.0, 0.0, 0.0]
+            self.max_bounds = [0.0, 0.0, 0.0]
+            self.translation_ts = array.array("I")
+            self.translation_values = array.array("f")
+            self.rotation_ts = array.array("I")
+            self.rotation_values = array.array("f")
+            self.scaling_ts = array.array("I")
+            self.scaling_values = array.array("f")
+            self.submeshes = None
+            self.lods = []
         else:
             self.load_mesh(name, texture, vertices, normals, triangles, texture_coords_0, mesh_min_bounds, mesh_max_bounds, translation_ts, translation_values, rotation_ts, rotation_values, scaling_ts, scaling_values)
       
@@ -123,152 +867,235 @@ class Model(object):
         self.texture_coords_0 = texture_coords_0
         self.min_bounds = mesh_min_bounds
         self.max_bounds = mesh_max_bounds
+        if self.min_bounds is None or self.max_bounds is None: # min / max are optional in gltf
+            self.compute_bounds()
         self.translation_ts = translation_ts
         self.translation_values = translation_values
         self.rotation_ts = rotation_ts
         self.rotation_values = rotation_values
         self.scaling_ts = scaling_ts
         self.scaling_values = scaling_values
+        self.submeshes = None # (vertex start, vertex count, index start, index count), set by split_for_skin
+        self.lods = [] # (vertex lookup, triangles, submeshes) of the 01, 02... skins, set by make_lods
 
-    def make_z_up(self): # idk if I have to move normals too... Do I ?
-        # X Y Z -> X -Z Y    
-      
-        all_x = []
-        all_y = []
-        all_z = []
-        new_vertices_order = []
-        
-        for v in range (0, len(self.vertices) / 3):
-            all_x.append(self.vertices[v * 3])
-            all_y.append(self.vertices[v * 3 + 1])
-            all_z.append(self.vertices[v * 3 + 2])
-
-        for v in range (0, len(self.vertices) / 3):
-            new_vertices_order.append(all_x[v])
-            new_vertices_order.append(all_z[v] * -1)
-            new_vertices_order.append(all_y[v])
-        
-        self.vertices = new_vertices_order
-        
-        y_min_bound = self.min_bounds[1]
-        z_min_bound = self.min_bounds[2]
-        
-        self.min_bounds[1] = z_min_bound * -1
-        self.min_bounds[2] = y_min_bound
-
-        y_max_bound = self.max_bounds[1]
-        z_max_bound = self.max_bounds[2]
-        
-        self.max_bounds[1] = z_max_bound * -1
-        self.max_bounds[2] = y_max_bound
-
-        all_tr_x = []
-        all_tr_y = []
-        all_tr_z = []
-        new_tr_order = []
-        
-        for v in range (0, len(self.translation_values)):
-            all_tr_x.append(self.translation_values[v][0])
-            all_tr_y.append(self.translation_values[v][1])
-            all_tr_z.append(self.translation_values[v][2])
-
-        for v in range (0, len(self.translation_values)):
-            new_tr_order.append( [] )
-            new_tr_order[v].append(all_tr_x[v])
-            new_tr_order[v].append(all_tr_z[v] * -1)
-            new_tr_order[v].append(all_tr_y[v])
-        
-        self.translation_values = new_tr_order
-        
-        # TODO : for rotations, swapping Y Z > -Z Y has a huge probability to make the animation directions go wild. *sigh* Quaternions...
-        
-        '''
-
-        all_ro_x = []
-        all_ro_y = []
-        all_ro_z = []
-        all_ro_w = []
-        new_ro_order = []
-        
-        for v in range (0, len(self.rotation_values)):
-            all_ro_x.append(self.rotation_values[v][0])
-            all_ro_y.append(self.rotation_values[v][1])
-            all_ro_z.append(self.rotation_values[v][2])
-            all_ro_w.append(self.rotation_values[v][3])
-
-        for v in range (0, len(self.rotation_values)):
-            new_ro_order.append( [] )
-            new_ro_order[v].append(all_ro_x[v])
-            new_ro_order[v].append(all_ro_z[v] * -1)
-            new_ro_order[v].append(all_ro_y[v])
-            new_ro_order[v].append(all_ro_w[v])
-        
-        
-        for v in range (0, len(new_ro_order)):
-            for j in range (0, 4):
-                if new_ro_order[v][j] == 32768.0: new_ro_order[v][j] = 32767.0
-                if new_ro_order[v][j] == -32767.0: new_ro_order[v][j] = -32768.0
-        
-        # We make sure to keep the first and last value fixed, to make sure the animation loops right.
-        new_ro_order[0] = [32767, 32767, 32767, -1]
-        new_ro_order[ len(new_ro_order) - 1 ] = [-32768, -32768, -32768, 0]
-        
-        print(self.rotation_values)
-        
-        self.rotation_values = new_ro_order
-
-        print(self.rotation_values)
-        
-        '''
-
-        all_sc_x = []
-        all_sc_y = []
-        all_sc_z = []
-        new_sc_order = []
-        
-        for v in range (0, len(self.scaling_values)):
-            all_sc_x.append(self.scaling_values[v][0])
-            all_sc_y.append(self.scaling_values[v][1])
-            all_sc_z.append(self.scaling_values[v][2])
-
-        for v in range (0, len(self.scaling_values)):
-            new_sc_order.append( [] )
-            new_sc_order[v].append(all_sc_x[v])
-            new_sc_order[v].append(all_sc_z[v]) # scaling can't be * -1, I guess
-            new_sc_order[v].append(all_sc_y[v])
-        
-        self.scaling_values = new_sc_order
-
-    def write_m2(self, texture_path):
+    def compute_bounds(self):
+        if len(self.vertices) == 0:
+            self.min_bounds = [0.0, 0.0, 0.0]
+            self.max_bounds = [0.0, 0.0, 0.0]
+        else:
+            self.min_bounds = [min(self.vertices[i::3]) for i in range(0, 3)]
+            self.max_bounds = [max(self.vertices[i::3]) for i in range(0, 3)]
+
+    def _vertex_records(self):
+        # Position, normal and uv of every vertex as one 32 bytes record (8 floats), to move whole vertices around at once.
+        n_vertices = len(self.vertices) // 3
+        records = array.array("f", bytes(struct_vertex_record.size * n_vertices))
+        for i in range(0, 3):
+            records[i::8] = self.vertices[i::3]
+            records[3 + i::8] = self.normals[i::3]
+        records[6::8] = self.texture_coords_0[0::2]
+        records[7::8] = self.texture_coords_0[1::2]
+        return records
+
+    def _set_vertex_records(self, records):
+        # The other way around : a float array of 8 floats per vertex back into the vertex attributes.
+        n_vertices = len(records) // 8
+        self.vertices = array.array("f", bytes(12 * n_vertices))
+        self.normals = array.array("f", bytes(12 * n_vertices))
+        self.texture_coords_0 = array.array("f", bytes(8 * n_vertices))
+        for i in range(0, 3):
+            self.vertices[i::3] = records[i::8]
+            self.normals[i::3] = records[3 + i::8]
+        self.texture_coords_0[0::2] = records[6::8]
+        self.texture_coords_0[1::2] = records[7::8]
+
+    def weld_vertices(self, epsilon=0.0):
+        # Merges the vertices sharing position, normal and uv (bit for bit, or on a grid of epsilon), and remaps the triangles.
+        # Everything goes through dicts and C level maps, there is no python loop per vertex. Returns the number of vertices removed.
+        n_vertices = len(self.vertices) // 3
+        if n_vertices == 0:
+            return 0
+        records = self._vertex_records()
+        raw = [record for (record,) in struct_vertex_record.iter_unpack(records)]
+        if epsilon > 0.0: # close enough vertices fall in the same grid cell
+            cells = array.array("q", map(round, map(operator.mul, records, itertools.repeat(1.0 / epsilon))))
+            keys = [key for (key,) in struct_weld_key.iter_unpack(cells)]
+        else:
+            keys = raw
+
+        first = dict(zip(reversed(keys), range(n_vertices - 1, -1, -1))) # key -> first vertex using it
+        if len(first) == n_vertices:
+            return 0
+        kept = sorted(first.values())
+        new_index = dict(zip(map(keys.__getitem__, kept), range(0, len(kept))))
+        remap = array.array("I", map(new_index.__getitem__, keys))
+        self.triangles = array.array(self.triangles.typecode, map(remap.__getitem__, self.triangles))
+        self._set_vertex_records(array.array("f", b"".join(map(raw.__getitem__, kept))))
+        return n_vertices - len(kept)
+
+    def optimize_vertex_cache(self, cache_size=vertex_cache_size):
+        # Reorders the triangles for the post-transform vertex cache (tipsify, linear time), then the vertices in order of first use.
+        # Returns the (acmr, atvr) before and after.
+        before = vertex_cache_stats(self.triangles, cache_size)
+        self.triangles = array.array(self.triangles.typecode, _tipsify(self.triangles, len(self.vertices) // 3, cache_size))
+
+        n_vertices = len(self.vertices) // 3
+        order = list(dict.fromkeys(itertools.chain(self.triangles, range(0, n_vertices)))) # first use, unused vertices last
+        new_index = array.array("I", bytes(4 * n_vertices))
+        for new, old in enumerate(order):
+            new_index[old] = new
+        self.triangles = array.array(self.triangles.typecode, map(new_index.__getitem__, self.triangles))
+        raw = [record for (record,) in struct_vertex_record.iter_unpack(self._vertex_records())]
+        self._set_vertex_records(array.array("f", b"".join(map(raw.__getitem__, order))))
+        return before, vertex_cache_stats(self.triangles, cache_size)
+
+    def split_for_skin(self):
+        # The skin format counts everything with u16 : a submesh holds up to 65535 vertices and 65535 indices, an m2 up to 65535 vertices.
+        # Cuts the mesh in spatially coherent submeshes (halves along the longest axis until they fit), each with its own block of vertices,
+        # and puts as many of them as possible in each m2. Returns the models to write (just this one for small meshes), submeshes set.
+        n_vertices = len(self.vertices) // 3
+        n_triangles = len(self.triangles) // 3
+        if n_vertices <= max_skin_vertices and len(self.triangles) <= max_submesh_indices:
+            self.submeshes = [(0, n_vertices, 0, len(self.triangles))]
+            return [self]
+
+        corners = list(zip(self.triangles[0::3], self.triangles[1::3], self.triangles[2::3]))
+        centroids = [] # x + y + z of the 3 corners, per axis : good enough to sort
+        for axis in range(0, 3):
+            values = self.vertices[axis::3]
+            centroids.append(list(map(operator.add, map(operator.add, map(values.__getitem__, self.triangles[0::3]), map(values.__getitem__, self.triangles[1::3])), map(values.__getitem__, self.triangles[2::3]))))
+
+        parts = []
+        todo = [list(range(0, n_triangles))]
+        while todo:
+            ids = todo.pop()
+            if len(ids) * 3 <= max_submesh_indices and len(set(itertools.chain.from_iterable(map(corners.__getitem__, ids)))) <= max_skin_vertices:
+                ids.sort() # back to the original order (the vertex cache order, if it was optimized)
+                parts.append(ids)
+                continue
+            extents = [max(map(centroids[axis].__getitem__, ids)) - min(map(centroids[axis].__getitem__, ids)) for axis in range(0, 3)]
+            ids.sort(key=centroids[extents.index(max(extents))].__getitem__)
+            todo.append(ids[len(ids) // 2:])
+            todo.append(ids[:len(ids) // 2]) # first half popped first : neighbour parts stay next to each other
+
+        raw = [record for (record,) in struct_vertex_record.iter_unpack(self._vertex_records())]
+        models = []
+        groups = [[]]
+        group_vertices = 0
+        for ids in parts:
+            order = list(dict.fromkeys(itertools.chain.from_iterable(map(corners.__getitem__, ids)))) # first use, vertices shared with other parts are duplicated
+            if group_vertices + len(order) > max_skin_vertices:
+                groups.append([])
+                group_vertices = 0
+            groups[-1].append((ids, order))
+            group_vertices += len(order)
+
+        for number, group in enumerate(groups):
+            name = self.name if len(groups) == 1 else self.name + "_" + str(number)
+            model = Model(name, self.texture, array.array("f"), array.array("f"), array.array(self.triangles.typecode), array.array("f"), None, None,
+                array.array("I", self.translation_ts), array.array("f", self.translation_values), array.array("I", self.rotation_ts), array.array("f", self.rotation_values),
+                array.array("I", self.scaling_ts), array.array("f", self.scaling_values))
+            model.submeshes = []
+            records = []
+            for ids, order in group:
+                vertex_start = len(records)
+                local = dict(zip(order, range(vertex_start, vertex_start + len(order))))
+                index_start = len(model.triangles)
+                model.triangles.extend(map(local.__getitem__, itertools.chain.from_iterable(map(corners.__getitem__, ids))))
+                records += map(raw.__getitem__, order)
+                model.submeshes.append((vertex_start, len(order), index_start, len(ids) * 3))
+            model._set_vertex_records(array.array("f", b"".join(records)))
+            model.compute_bounds()
+            models.append(model)
+        return models
+
+    def make_lods(self, ratios=lod_ratios):
+        # Simplified meshes for the 01, 02... skins, ratio = triangles kept. Each submesh is simplified on its own, with the vertices
+        # of its block only. Sets self.lods and returns the number of triangles of every level.
+        n_vertices = len(self.vertices) // 3
+        submeshes = self.submeshes if self.submeshes is not None else [(0, n_vertices, 0, len(self.triangles))]
+        quadrics = _vertex_quadrics(self.vertices, self.triangles)
+        self.lods = []
+        sources = [self.triangles[index_start:index_start + index_count] for vertex_start, vertex_count, index_start, index_count in submeshes]
+        for ratio in ratios[0:max_lods]:
+            lookup = array.array("H")
+            triangles = array.array("H")
+            lod_submeshes = []
+            for number, (vertex_start, vertex_count, index_start, index_count) in enumerate(submeshes):
+                # each level starts from the previous one (cheaper), the quadrics still come from the full mesh
+                simplified = _simplify(self.vertices, quadrics, sources[number], max(1, int(index_count // 3 * ratio)))
+                sources[number] = simplified
+                order = list(dict.fromkeys(simplified)) # first use, like the vertex cache wants them
+                local = dict(zip(order, range(len(lookup), len(lookup) + len(order))))
+                lod_submeshes.append((len(lookup), len(order), len(triangles), len(simplified)))
+                triangles.extend(map(local.__getitem__, simplified))
+                lookup.extend(order)
+            self.lods.append((lookup, triangles, lod_submeshes))
+        return [len(triangles) // 3 for lookup, triangles, lod_submeshes in self.lods]
+
+    def reduce_keyframes(self, tolerances=key_tolerances):
+        # Drops the keys that linear interpolation gives back (lerp for translation and scaling, nlerp for rotation) within
+        # the translation, rotation (radians) and scaling tolerances. Returns the number of keys removed.
+        n_keys = len(self.translation_ts) + len(self.rotation_ts) + len(self.scaling_ts)
+        translation_tolerance, rotation_tolerance, scaling_tolerance = tolerances
+        self.translation_ts, self.translation_values = _reduce_track(self.translation_ts, self.translation_values, 3, translation_tolerance)
+        self.rotation_ts, self.rotation_values = _reduce_track(self.rotation_ts, self.rotation_values, 4, rotation_tolerance)
+        self.scaling_ts, self.scaling_values = _reduce_track(self.scaling_ts, self.scaling_values, 3, scaling_tolerance)
+        return n_keys - len(self.translation_ts) - len(self.rotation_ts) - len(self.scaling_ts)
+
+    def make_z_up(self):
+        # X Y Z -> X -Z Y, done in place on every attribute.
+        _y_up_to_z_up(self.vertices, 3)
+        _y_up_to_z_up(self.normals, 3)
+        _y_up_to_z_up(self.translation_values, 3)
+        _y_up_to_z_up(self.rotation_values, 4) # quaternion X Y Z W -> X -Z Y W, same change of basis
+        _y_up_to_z_up(self.scaling_values, 3, negate=False) # scaling can't be * -1
+
+        # the box gets flipped too : the new min y is the old max z
+        min_y, min_z = self.min_bounds[1], self.min_bounds[2]
+        max_y, max_z = self.max_bounds[1], self.max_bounds[2]
+        self.min_bounds[1], self.min_bounds[2] = -max_z, min_y
+        self.max_bounds[1], self.max_bounds[2] = -min_z, max_y
+
+    def write_m2(self, texture_path, collision=False, minimal_spheres=False, folder=None):
+        # Writes the m2 and skin files in folder (the current one by default), returns their names.
+        files = self.build_m2(texture_path, collision, minimal_spheres)
+        for file_name, data in files:
+            with _stage("write_files"):
+                with open(os.path.join(folder, file_name) if folder is not None else file_name, "wb") as out_file:
+                    out_file.write(data)
+        print("Files " + " and ".join([files[0][0], " ".join(file_name for file_name, data in files[1:])]) + " saved")
+        return [file_name for file_name, data in files]
+
+    def build_m2(self, texture_path, collision=False, minimal_spheres=False):
+        # The m2 file and its skins, in memory : a list of (file name, bytearray), the m2 first.
+        # collision : a convex hull of the model as collision mesh (none by default, the model can be walked through).
+        # minimal_spheres : tighter submesh spheres (Ritter), a bit slower.
       
-        self.make_z_up() # TODO : for now, if you have a model that rotates, just comment the function to avoid quaternions mess.
+        with _stage("make_z_up"):
+            self.make_z_up()
+        with _stage("bounds"):
+            self.compute_bounds() # exact box of the turned vertices, the gltf one may be loose
+            points = [self.vertices[i::3].tolist() for i in range(0, 3)]
+            bounding_radius = _bounding_sphere(points)[1] # around the box center, the header has no sphere center
+        if collision:
+            with _stage("collision_hull"):
+                collision_vertices, collision_triangles, collision_normals = _collision_hull(points)
+        else:
+            collision_vertices, collision_triangles, collision_normals = [], [], []
       
         # Compute the values to be written
         
-        transparency_block_size = 20
-        timestamp_block_size = 8
-        subanim_block_size = 8
-        fake_timestamp_size = 4
-        
-        # TODO : change these ?
-        anim_lower_x = 0.0
-        anim_lower_y = 0.0
-        anim_lower_z = 0.0
-        anim_upper_x = 0.0
-        anim_upper_y = 0.0
-        anim_upper_z = 0.0
-        anim_radius = 0.0
+        # the model only moves through its bone : the animation bounds are the model ones
+        anim_lower_x, anim_lower_y, anim_lower_z = self.min_bounds
+        anim_upper_x, anim_upper_y, anim_upper_z = self.max_bounds
+        anim_radius = bounding_radius
         
         fake_anim_block = [0, 0, 3333, 0.0, 32, 32767, 0, 0, 0, 150, anim_lower_x, anim_lower_y, anim_lower_z, anim_upper_x, anim_upper_y, anim_upper_z, anim_radius, -1, 0]
-        anim_block_size = 64
-        
-        fake_bone_block = [-1, 0, -1, 0, 0, 0, 0, -1, 0, 0, 0, 0, 0, -1, 0, 0, 0, 0, 0, -1, 0, 0, 0, 0, 0.0, 0.0 , 0.0]
-        bone_block_size = 88 # TODO : * n_bones ?
-
-        ofs_temp = 0 # temp value
 
-        texture_full_name = texture_path + self.texture[0:-3] + "blp"
-        texture_length = int(len(texture_full_name))
+        texture_full_name = (texture_path + self.texture[0:-3] + "blp").encode("utf-8")
+        texture_length = len(texture_full_name)
+        name = self.name.encode("utf-8")
         
         keybone_lookup = -1
         
@@ -279,18 +1106,33 @@ class Model(object):
         time_sc = 0
         if ( len(self.scaling_ts) > 0): time_sc = max(self.scaling_ts)
         global_seq = max( time_tr, time_ro, time_sc )
+
+        with _stage("pack_keys"):
+            t1_1 = _array_to_bytes(self.translation_ts)
+            t2_1 = _array_to_bytes(self.translation_values)
+            r1_1 = _array_to_bytes(self.rotation_ts)
+            r2_1 = _array_to_bytes(_compress_rotations(self.rotation_values))
+            s1_1 = _array_to_bytes(self.scaling_ts)
+            s2_1 = _array_to_bytes(self.scaling_values)
+        _count("keys_written", len(self.translation_ts) + len(self.rotation_ts) + len(self.scaling_ts))
+        with _stage("pack_vertices"):
+            vertices = _pack_vertices(self.vertices, self.normals, self.texture_coords_0)
+
+        # Every section goes right after the previous one, the layout gives the offsets.
+
+        layout = Layout(struct_m2_header.size)
         
-        n_name = len(self.name)
-        ofs_name = 304 # start at header size
+        n_name = len(name)
+        ofs_name = layout.add(n_name + 1) # string null terminated
         global_flags = 0
         n_global_seq = 1 # TODO : get real number of sequences (it's ok to have a sequence leading to an empty offset if there's no animation)
-        ofs_global_seq = ofs_name + n_name + 1 # string null terminated
+        ofs_global_seq = layout.add(struct_u32.size * n_global_seq)
         n_anims = 1
-        ofs_anims = ofs_global_seq + 4
+        ofs_anims = layout.add(struct_anim.size * n_anims)
         n_anim_lookup = 0
         ofs_anim_lookup = 0
         n_bones = 1
-        ofs_bones = ofs_anims + anim_block_size * n_anims
+        ofs_bones = layout.add(struct_bone.size * n_bones)
         
         # bone start
         keybone_id = -1
@@ -301,36 +1143,19 @@ class Model(object):
         bone_unk3 = 58916
 
         # for no animations, 0 in first slot is sufficient, the rest of the animation can stay. Ugly but handy.
-        t1 = [len(self.translation_ts), 0] 
-        t2 = [len(self.translation_values), 0]
-        r1 = [len(self.rotation_ts), 0]
-        r2 = [len(self.rotation_values), 0]
-        s1 = [len(self.scaling_ts), 0]
-        s2 = [len(self.scaling_values), 0]
-        
-        ofs_t1 = ofs_bones + bone_block_size # start after bone block
-        ofs_t2 = ofs_t1 + (len(t1) * 4)
-        ofs_r1 = ofs_t2 + (len(t2) * 4)
-        ofs_r2 = ofs_r1 + len(r1) * 4
-
-        ofs_s1 = ofs_r2 + len(r2) * 4
-        ofs_s2 = ofs_s1 + len(s1) * 4
-
-        t1_1 = self.translation_ts
-        t2_1 = self.translation_values
-
-        r1_1 = self.rotation_ts
-        r2_1 = self.rotation_values
-        
-        s1_1 = self.scaling_ts
-        s2_1 = self.scaling_values
-        
-        t1[1] = ofs_s2 + len(s2) * 4
-        t2[1] = t1[1] + len(t1_1) * 4
-        r1[1] = t2[1] + len(t2_1) * 3 * 4
-        r2[1] = r1[1] + len(r1_1) * 4
-        s1[1] = r2[1] + len(r2_1) * 4 * 2
-        s2[1] = s1[1] + len(s1_1) * 4
+        ofs_t1 = layout.add(struct_m2array.size)
+        ofs_t2 = layout.add(struct_m2array.size)
+        ofs_r1 = layout.add(struct_m2array.size)
+        ofs_r2 = layout.add(struct_m2array.size)
+        ofs_s1 = layout.add(struct_m2array.size)
+        ofs_s2 = layout.add(struct_m2array.size)
+
+        t1 = [len(self.translation_ts), layout.add(len(t1_1))]
+        t2 = [len(self.translation_values) // 3, layout.add(len(t2_1))]
+        r1 = [len(self.rotation_ts), layout.add(len(r1_1))]
+        r2 = [len(self.rotation_values) // 4, layout.add(len(r2_1))]
+        s1 = [len(self.scaling_ts), layout.add(len(s1_1))]
+        s2 = [len(self.scaling_values) // 3, layout.add(len(s2_1))]
         
         global_seq_id = 0 # all the anims must have the same ID to be combined
         
@@ -349,73 +1174,58 @@ class Model(object):
         bone_vector_pivot = [0.0, 0.0, 0.0]
         
         n_keybone_lookup = 1
-        ofs_keybone_lookup = s2[1] + len(s2_1) * 4 * 3
-        n_vertices = (len(self.vertices) / 3)
-        ofs_vertices = ofs_keybone_lookup + 2 # because keybone_lookup is h
-        n_views = 1
+        ofs_keybone_lookup = layout.add(struct_h.size * n_keybone_lookup)
+        n_vertices = len(self.vertices) // 3
+        ofs_vertices = layout.add(len(vertices))
+        n_views = 1 + len(self.lods) # 00 skin, then the simplified ones
         n_colors = 0
         ofs_colors = 0
         n_textures = 1
-        ofs_textures = ofs_vertices + 48 * n_vertices
+        ofs_textures = layout.add(struct_texture.size * n_textures)
+        ofs_texture_name = layout.add(texture_length + 1) # string null terminated
         n_transparency = 1
-        ofs_transparency = ofs_textures + 16 + len(texture_full_name) + 1 # string null terminated
+        ofs_transparency = layout.add(struct_m2track.size)
+        ofs_transparency_timestamps = layout.add(struct_m2array.size)
+        ofs_transparency_values = layout.add(struct_m2array.size)
+        ofs_fake_timestamp = layout.add(struct_u32.size)
+        ofs_fake_subanim = layout.add(struct_h.size)
         n_texture_animations = 0
         ofs_texture_animations = 0
         n_tex_replace = 1
-        ofs_tex_replace = ofs_transparency + transparency_block_size + timestamp_block_size + subanim_block_size + fake_timestamp_size + 2
+        ofs_tex_replace = layout.add(struct_h.size * n_tex_replace)
         n_render_flags = 1
-        ofs_render_flags = ofs_tex_replace + 2
+        ofs_render_flags = layout.add(struct_h.size * 2 * n_render_flags) # flags, blending mode
         n_bone_lookup_table = 4
-        ofs_bone_lookup_table = ofs_render_flags + 4
+        ofs_bone_lookup_table = layout.add(struct_h.size * n_bone_lookup_table)
         n_tex_lookup = 1
-        ofs_tex_lookup = ofs_bone_lookup_table + n_bone_lookup_table * 2
+        ofs_tex_lookup = layout.add(struct_h.size * n_tex_lookup)
         n_tex_units = 1
-        ofs_tex_units = ofs_tex_lookup + 2
+        ofs_tex_units = layout.add(struct_h.size * n_tex_units)
         n_trans_lookup = 1
-        ofs_trans_lookup = ofs_tex_units + 2
+        ofs_trans_lookup = layout.add(struct_h.size * n_trans_lookup)
         n_tex_anim_lookup = 1
-        ofs_tex_anim_lookup = ofs_trans_lookup + 2
+        ofs_tex_anim_lookup = layout.add(struct_h.size * n_tex_anim_lookup)
         bounding_lower_x = self.min_bounds[0]
         bounding_lower_y = self.min_bounds[1]
         bounding_lower_z = self.min_bounds[2]
         bounding_upper_x = self.max_bounds[0]
         bounding_upper_y = self.max_bounds[1]
         bounding_upper_z = self.max_bounds[2]
-        bounding_radius = 3.0 # TODO : get bounds
-        collisions_lower_x = self.min_bounds[0] # TODO
-        collisions_lower_y = self.min_bounds[1] # TODO
-        collisions_lower_z = self.min_bounds[2] # TODO
-        collisions_upper_x = self.max_bounds[0] # TODO
-        collisions_upper_y = self.max_bounds[1] # TODO
-        collisions_upper_z = self.max_bounds[2] # TODO
-        collisions_radius = bounding_radius # TODO
-
-        """ TODO : Let's see that later, vertices order is totally wrong
-        # collisions : instead of a generic cube around the model, it would be better to import a custom bounding box.
-
-        collisions_triangles = [ [0, 1, 2], [2, 3, 0], [4, 5, 6], [6, 7, 4], [0, 3, 5], [5, 4, 0], [3, 2, 6], [6, 5, 3], [2, 1, 7], [7, 6, 2], [1, 0, 4], [4, 7, 1] ]
-        
-        collisions_vertices = [
-            [-1 * collisions_lower_x, collisions_lower_y, -1 * collisions_lower_z], # REF LOWER
-            [collisions_lower_x, collisions_lower_y, -1 * collisions_lower_z],
-            [-1 * collisions_lower_x, collisions_lower_y, collisions_lower_z],
-            [-1 * collisions_lower_x, -1 * collisions_lower_y, collisions_lower_z],
-
-            [collisions_upper_x, -1 * collisions_upper_y, -1 * collisions_upper_z],
-            [-1 * collisions_upper_x, -1 * collisions_upper_y, -1 * collisions_upper_z],
-            [collisions_upper_x, -1 * collisions_upper_y, collisions_upper_z], # REF UPPER
-            [collisions_upper_x, collisions_upper_y,  collisions_upper_z]
-        ]
-
-        collisions_normals = [ [0, 0, -1], [0, 0, -1], [0, 0, 1], [0, 0, 1], [1, 0, 0], [1, 0, 0], [0, 1, 0], [0, 1, 0], [-1, 0, 0], [-1, 0, 0], [0, -1, 0], [0, -1, 0] ]
-        """
-
-        n_bounding_triangles = 0 # len(collisions_triangles)
-        ofs_bounding_triangles = 0 # ofs_tex_anim_lookup + 2
-        n_bounding_vertices = 0 # len(collisions_vertices)
-        ofs_bounding_vertices = 0 # ofs_bounding_triangles + n_bounding_triangles * 2 * 3
-        n_bounding_normals = 0 # len(collisions_normals)
-        ofs_bounding_normals = 0 # ofs_bounding_vertices + n_bounding_vertices * 3 * 4
+        if collision_vertices:
+            collision_points = list(zip(*collision_vertices))
+            (collisions_lower_x, collisions_lower_y, collisions_lower_z), (collisions_upper_x, collisions_upper_y, collisions_upper_z) = _bounding_box(collision_points)
+            collisions_radius = _bounding_sphere(collision_points)[1]
+        else: # no collision mesh, the box is still the model one
+            collisions_lower_x, collisions_lower_y, collisions_lower_z = self.min_bounds
+            collisions_upper_x, collisions_upper_y, collisions_upper_z = self.max_bounds
+            collisions_radius = bounding_radius
+
+        n_bounding_triangles = len(collision_triangles)
+        ofs_bounding_triangles = layout.add(struct_H.size * n_bounding_triangles) if n_bounding_triangles else 0
+        n_bounding_vertices = len(collision_vertices)
+        ofs_bounding_vertices = layout.add(struct_vector.size * n_bounding_vertices) if n_bounding_vertices else 0
+        n_bounding_normals = len(collision_normals)
+        ofs_bounding_normals = layout.add(struct_vector.size * n_bounding_normals) if n_bounding_normals else 0
         n_attachments = 0
         ofs_attachments = 0
         n_attach_lookup = 0
@@ -433,572 +1243,1676 @@ class Model(object):
         n_particle_emitters = 0
         ofs_particle_emitters = 0    
         
-        transparency_block = [0, -1, 1, ofs_transparency + transparency_block_size, 1, ofs_transparency + transparency_block_size + timestamp_block_size]
-        timestamp_block = [1, ofs_transparency + transparency_block_size + timestamp_block_size + subanim_block_size]
-        subanim_block = [1, ofs_transparency + transparency_block_size + timestamp_block_size + subanim_block_size + fake_timestamp_size]
+        transparency_block = [0, -1, 1, ofs_transparency_timestamps, 1, ofs_transparency_values]
+        timestamp_block = [1, ofs_fake_timestamp]
+        subanim_block = [1, ofs_fake_subanim]
 
         fake_timestamp_value = 0
         fake_subanim_value = 32767
-        
-        filename = self.name + ".m2"
-        with open(filename, "wb") as out_file:
-          
-            # The header
-            
-            out_file.write(struct_u32.pack(808600653))
-            out_file.write(struct_u32.pack(264))
-            
-            out_file.write(struct_u32.pack(n_name))
-            out_file.write(struct_u32.pack(ofs_name))
-            
-            out_file.write(struct_u32.pack(global_flags))
-            
-            out_file.write(struct_u32.pack(n_global_seq))
-            out_file.write(struct_u32.pack(ofs_global_seq))
-            
-            out_file.write(struct_u32.pack(n_anims))
-            out_file.write(struct_u32.pack(ofs_anims))
-
-            out_file.write(struct_u32.pack(n_anim_lookup))
-            if n_anim_lookup == 0:      
-                out_file.write(struct_u32.pack(ofs_anim_lookup))
-            else:
-                out_file.write(struct_u32.pack(ofs_anim_lookup))        
 
-            out_file.write(struct_u32.pack(n_bones))
-            out_file.write(struct_u32.pack(ofs_bones))
-
-            out_file.write(struct_u32.pack(n_keybone_lookup))
-            out_file.write(struct_u32.pack(ofs_keybone_lookup))
-            
-            out_file.write(struct_u32.pack(n_vertices))
-            out_file.write(struct_u32.pack(ofs_vertices))      
+        # Fill the whole file in memory, then write it at once.
+
+        m2 = bytearray(layout.size)
+
+        struct_m2_header.pack_into(m2, 0, 
+            808600653, 264, n_name, ofs_name, global_flags, n_global_seq, ofs_global_seq, n_anims, ofs_anims, n_anim_lookup, ofs_anim_lookup,
+            n_bones, ofs_bones, n_keybone_lookup, ofs_keybone_lookup, n_vertices, ofs_vertices, n_views, n_colors, ofs_colors,
+            n_textures, ofs_textures, n_transparency, ofs_transparency, n_texture_animations, ofs_texture_animations, n_tex_replace, ofs_tex_replace,
+            n_render_flags, ofs_render_flags, n_bone_lookup_table, ofs_bone_lookup_table, n_tex_lookup, ofs_tex_lookup, n_tex_units, ofs_tex_units,
+            n_trans_lookup, ofs_trans_lookup, n_tex_anim_lookup, ofs_tex_anim_lookup,
+            bounding_lower_x, bounding_lower_y, bounding_lower_z, bounding_upper_x, bounding_upper_y, bounding_upper_z, bounding_radius,
+            collisions_lower_x, collisions_lower_y, collisions_lower_z, collisions_upper_x, collisions_upper_y, collisions_upper_z, collisions_radius,
+            n_bounding_triangles, ofs_bounding_triangles, n_bounding_vertices, ofs_bounding_vertices, n_bounding_normals, ofs_bounding_normals,
+            n_attachments, ofs_attachments, n_attach_lookup, ofs_attach_lookup, n_events, ofs_events, n_lights, ofs_lights,
+            n_cameras, ofs_cameras, n_camera_lookup, ofs_camera_lookup, n_ribbon_emitters, ofs_ribbon_emitters, n_particle_emitters, ofs_particle_emitters)
+        
+        m2[ofs_name:ofs_name + n_name] = name # the null terminator is already there
+        struct_u32.pack_into(m2, ofs_global_seq, global_seq)
+        struct_anim.pack_into(m2, ofs_anims, *fake_anim_block)
+        struct_bone.pack_into(m2, ofs_bones, keybone_id, bone_flags, parent_bone, bone_unk1, bone_unk2, bone_unk3, *(tr_block + ro_block + sc_block + bone_vector_pivot))
 
-            out_file.write(struct_u32.pack(n_views))
+        for ofs, m2array, data in ((ofs_t1, t1, t1_1), (ofs_t2, t2, t2_1), (ofs_r1, r1, r1_1), (ofs_r2, r2, r2_1), (ofs_s1, s1, s1_1), (ofs_s2, s2, s2_1)):
+            struct_m2array.pack_into(m2, ofs, *m2array)
+            m2[m2array[1]:m2array[1] + len(data)] = data
 
-            out_file.write(struct_u32.pack(n_colors))
-            out_file.write(struct_u32.pack(ofs_colors))
+        struct_h.pack_into(m2, ofs_keybone_lookup, keybone_lookup)
+        m2[ofs_vertices:ofs_vertices + len(vertices)] = vertices
+        
+        # texture type 0, texture flags : put 3 to wrap_x and wrap_y if you have multiple UV islands
+        struct_texture.pack_into(m2, ofs_textures, 0, 3, texture_length, ofs_texture_name)
+        m2[ofs_texture_name:ofs_texture_name + texture_length] = texture_full_name
+
+        struct_m2track.pack_into(m2, ofs_transparency, *transparency_block)
+        struct_m2array.pack_into(m2, ofs_transparency_timestamps, *timestamp_block)
+        struct_m2array.pack_into(m2, ofs_transparency_values, *subanim_block)
+        struct_u32.pack_into(m2, ofs_fake_timestamp, fake_timestamp_value)
+        struct_h.pack_into(m2, ofs_fake_subanim, fake_subanim_value)
+
+        # texreplace, renderflags, blending mode, bone lookup table and texlookuptable, texunitlookuptable, translookuptable are all 0
+        struct_h.pack_into(m2, ofs_tex_anim_lookup, -1) # texanimlookuptable -1
+
+        for i, index in enumerate(collision_triangles):
+            struct_H.pack_into(m2, ofs_bounding_triangles + i * struct_H.size, index)
+        for i, vector in enumerate(collision_vertices):
+            struct_vector.pack_into(m2, ofs_bounding_vertices + i * struct_vector.size, *vector)
+        for i, vector in enumerate(collision_normals):
+            struct_vector.pack_into(m2, ofs_bounding_normals + i * struct_vector.size, *vector)
+
+        files = [(self.name + ".m2", m2)]
+        _count("m2_bytes", len(m2))
+        _count("vertices_written", n_vertices)
+
+        submeshes = self.submeshes
+        if submeshes is None:
+            models = self.split_for_skin()
+            if len(models) > 1:
+                raise ConversionError("Too many vertices for a single m2, write the models given by split_for_skin() instead.")
+            submeshes = self.submeshes
+
+        indices = array.array("H", range(0, len(self.vertices) // 3))
+        triangles = self.triangles if self.triangles.typecode == "H" else array.array("H", self.triangles)
+
+        for lod, (lod_indices, lod_triangles, lod_submeshes) in enumerate([(indices, triangles, submeshes)] + self.lods):
+            with _stage("pack_skin"):
+                files.append((self.name + "%02d.skin" % lod, self._skin_bytes(lod, lod_indices, lod_triangles, lod_submeshes, n_bones, points, minimal_spheres)))
+            _count("skin_bytes", len(files[-1][1]))
+            _count("triangles_written", len(lod_triangles) // 3)
+        return files
+
+    def _skin_bytes(self, lod, indices, triangles, submeshes, n_bones, points, minimal_spheres):
+        # One skin file : vertex lookup (m2 vertex of every skin vertex), triangles on the lookup, one submesh + texture unit per submesh.
+        # points are the x, y, z lists of the m2 vertices, for the centers and spheres of the submeshes.
+        n_indices = len(indices)
+        skin_layout = Layout(struct_skin_header.size)
+        ofs_indices = skin_layout.add(struct_H.size * n_indices)
+        n_triangles = len(triangles)
+        ofs_triangles = skin_layout.add(struct_H.size * n_triangles)
+        n_properties = n_indices
+        ofs_properties = skin_layout.add(4 * n_properties) # 4 bone indices per vertex, all 0
+        n_submeshes = len(submeshes)
+        ofs_submeshes = skin_layout.add(struct_submesh.size * n_submeshes)
+        n_texture_units = n_submeshes # one per submesh, all with the same texture
+        ofs_texture_units = skin_layout.add(struct_texture_unit.size * n_texture_units)
+
+        skin = bytearray(skin_layout.size)
+        struct_skin_header.pack_into(skin, 0, 1313426259, n_indices, ofs_indices, n_triangles, ofs_triangles, n_properties, ofs_properties,
+            n_submeshes, ofs_submeshes, n_texture_units, ofs_texture_units, lod)
+        skin[ofs_indices:ofs_triangles] = _array_to_bytes(indices)
+        skin[ofs_triangles:ofs_properties] = _array_to_bytes(triangles)
+        # properties stay 0
+        for i, (vertex_start, vertex_count, index_start, index_count) in enumerate(submeshes):
+            level = index_start >> 16 # index start above 65535 : the high bits go in level
+            submesh_points = [list(map(values.__getitem__, indices[vertex_start:vertex_start + vertex_count])) for values in points]
+            center_mass = [math.fsum(values) / max(len(values), 1) for values in submesh_points]
+            sort_center, sort_radius = _bounding_sphere(submesh_points, minimal_spheres)
+            submesh_block = [i, level, vertex_start, vertex_count, index_start & 0xFFFF, index_count, n_bones, 0, 1, 0] + center_mass + sort_center + [sort_radius]
+            texture_units_block = [16, 0, 0, i, i, -1, 0, 0, 1, 0, 0, 0, 0] # submesh and geoset i
+            struct_submesh.pack_into(skin, ofs_submeshes + i * struct_submesh.size, *submesh_block)
+            struct_texture_unit.pack_into(skin, ofs_texture_units + i * struct_texture_unit.size, *texture_units_block)
+        return skin
 
-            out_file.write(struct_u32.pack(n_textures))
-            out_file.write(struct_u32.pack(ofs_textures))
+""" LOADING INFO FROM FILES
+"""
 
-            out_file.write(struct_u32.pack(n_transparency))
-            out_file.write(struct_u32.pack(ofs_transparency))
+class ConversionError(Exception):
+    # Something in the gltf that the m2 can't do (yet).
+    pass
+
+# image mimeType -> extension of the texture name, for the images embedded in the file (glb bufferView or data uri)
+image_extensions = { "image/png": ".png", "image/jpeg": ".jpg" }
+
+def _get_texture_image(gltf, primitive, mesh_number):
+    # Number of the image of the base color texture of the primitive material, or the image with the mesh number for exports
+    # without materials. Returns it with the material (empty without one).
+    images = gltf.get('images', [])
+    material = gltf.get('materials', [])[primitive['material']] if 'material' in primitive else {}
+    base_color = material.get('pbrMetallicRoughness', {}).get('baseColorTexture')
+    if base_color is not None and 'source' in gltf['textures'][base_color['index']]:
+        image_number = gltf['textures'][base_color['index']]['source']
+    else:
+        image_number = min(mesh_number, len(images) - 1)
+    if not 0 <= image_number < len(images):
+        raise ConversionError("No texture found for mesh " + str(mesh_number) + ".")
+    return image_number, material
+
+def _get_texture_uri(gltf, primitive, mesh_number):
+    # The texture name the m2 refers to (its extension becomes blp) : the uri of an image file. An embedded image has no file name,
+    # it gets the name of the image (or of its material, or of the mesh) with the extension of its mime type.
+    image_number, material = _get_texture_image(gltf, primitive, mesh_number)
+    image = gltf['images'][image_number]
+    uri = image.get('uri')
+    if uri is not None and not uri.startswith("data:"):
+        return uri
+    if uri is None and 'bufferView' not in image:
+        raise ConversionError("Image %d of mesh %d has no uri and no bufferView." % (image_number, mesh_number))
+    name = image.get('name') or material.get('name') or gltf['meshes'][mesh_number].get('name')
+    if not name:
+        raise ConversionError("Image %d of mesh %d is embedded in the file and has no name : name the image, its material or the mesh." % (image_number, mesh_number))
+    mime_type = image.get('mimeType') if uri is None else uri[5:].split(",", 1)[0].split(";", 1)[0] # data:image/png;base64,...
+    name = "".join(c if c.isalnum() or c in "-_." else "_" for c in os.path.splitext(name)[0]) # no folders or uri parts in the m2 path
+    return name + image_extensions.get(mime_type, ".png")
+
+def _image_data(gltf, buffers, image):
+    # The content of an image embedded in the file : its bufferView, or its data uri (base64).
+    if 'bufferView' in image:
+        buffer_view = gltf['bufferViews'][image['bufferView']]
+        start = buffer_view.get('byteOffset', 0)
+        with memoryview(buffers[buffer_view['buffer']]) as data:
+            return bytes(data[start:start + buffer_view['byteLength']])
+    return base64.b64decode(image['uri'].split(",", 1)[1])
+
+# top level gltf entries the converter reads, the others are skipped when streaming
+gltf_keys = set(["accessors", "animations", "bufferViews", "buffers", "images", "materials", "meshes", "nodes", "textures"])
+
+def _read_gltf(path):
+    # The gltf json. With ijson, it's parsed one top level entry at a time and only the entries in gltf_keys are kept.
+    if path.lower().endswith(".glb"):
+        gltf, glb_bin = _read_glb(path)
+        _close_buffers([glb_bin])
+        return gltf
+    with open(path, "rb") as model_file:
+        if ijson is None:
+            return json.load(model_file)
+        return dict((key, value) for key, value in ijson.kvitems(model_file, "", use_float=True) if key in gltf_keys)
+
+def _scene_name(path):
+    # The file name of a scene without its extension, prefix of the names of its unnamed meshes.
+    return os.path.splitext(os.path.basename(path))[0]
+
+class SceneIndex(object):
+    # Lookup tables built once per scene, so loading a mesh doesn't go through every node and animation again :
+    # mesh -> primitives, node -> mesh, mesh -> animation tracks (path -> sampler, with its input / output accessors), mesh -> name.
+    # The m2 files are named after the meshes : unnamed ones get the scene name (scene_mesh_0...), so that they don't collide
+    # with the unnamed meshes of other scenes (mesh_0... without scene_name, for a scene given as bytes).
+    def __init__(self, gltf, scene_name=None):
+        prefix = "mesh_" if scene_name is None else scene_name + "_mesh_"
+        self.mesh_names = [mesh.get('name', prefix + str(mesh_number)) for mesh_number, mesh in enumerate(gltf.get('meshes', []))]
+        self.mesh_primitives = [mesh.get('primitives', []) for mesh in gltf.get('meshes', [])]
+        self.node_mesh = dict((node_number, node['mesh']) for node_number, node in enumerate(gltf.get('nodes', [])) if 'mesh' in node)
+        self.mesh_tracks = collections.defaultdict(dict)
+        for anim in gltf.get('animations', []):
+            for channel in anim.get('channels', []):
+                mesh_number = self.node_mesh.get(channel['target'].get('node'))
+                if mesh_number is not None:
+                    self.mesh_tracks[mesh_number][channel['target']['path']] = anim['samplers'][channel['sampler']]
+
+def load_scene(path, folder=None):
+    # Parses the gltf (or glb), indexes it and maps its bin files, to load the meshes with load_model. Close the buffers once done (_close_buffers).
+    # path can also be the content of a gltf or glb file (bytes) : bin files are then looked for in folder, embedded buffers need none.
+    if isinstance(path, (bytes, bytearray, memoryview)):
+        data = bytes(path) if isinstance(path, memoryview) else path # the views on it get closed with the buffers, not the caller's object
+        path = os.path.join(folder, "") if folder is not None else None # only its folder is used
+        scene_name = None
+        with _stage("read_gltf"):
+            if bytes(data[0:4]) == b"glTF":
+                gltf, glb_bin = _parse_glb(memoryview(data), "The glb data")
+            else:
+                gltf, glb_bin = json.loads(bytes(data)), None
+        _count("gltf_bytes", len(data))
+    else:
+        scene_name = _scene_name(path)
+        with _stage("read_gltf"):
+            if path.lower().endswith(".glb"): # one file : json and BIN chunk from the same mapping
+                gltf, glb_bin = _read_glb(path)
+            else:
+                gltf, glb_bin = _read_gltf(path), None
+        _count("gltf_bytes", os.path.getsize(path))
+    try:
+        with _stage("map_buffers"):
+            buffers = _map_buffers(gltf, path, glb_bin) # every bin file is mapped once and shared by all the meshes
+    except:
+        _close_buffers([glb_bin])
+        raise
+    _count("buffer_bytes", sum(map(len, buffers)))
+    with _stage("index_scene"):
+        return gltf, buffers, SceneIndex(gltf, scene_name)
+
+def load_model(gltf, buffers, mesh_number, index=None):
+    if index is None:
+        index = SceneIndex(gltf)
+    mesh = gltf['meshes'][mesh_number]
+    primitive = index.mesh_primitives[mesh_number][0]
+    mesh_texture = _get_texture_uri(gltf, primitive, mesh_number)
+    accessors = gltf['accessors']
+
+    # copies : make_z_up turns the bounds in place, the gltf may be loaded again (server scene cache)
+    mesh_max_bounds = accessors[primitive['attributes']['POSITION']].get('max')
+    mesh_min_bounds = accessors[primitive['attributes']['POSITION']].get('min')
+    mesh_max_bounds = list(mesh_max_bounds) if mesh_max_bounds is not None else None
+    mesh_min_bounds = list(mesh_min_bounds) if mesh_min_bounds is not None else None
+
+    vertices = _get_float_accessor(gltf, buffers, primitive['attributes']['POSITION'])
+    normals = _get_float_accessor(gltf, buffers, primitive['attributes']['NORMAL'])
+    texture_coords_0 = _get_float_accessor(gltf, buffers, primitive['attributes']['TEXCOORD_0'])
+    triangles = _get_accessor(gltf, buffers, primitive['indices'])
+
+    # translation, rotation and scaling of the node(s) of the mesh : timestamps and values, empty when not animated
+    tracks = []
+    for path, label in (("translation", "Translation"), ("rotation", "Rotations"), ("scale", "Scaling")):
+        sampler = index.mesh_tracks[mesh_number].get(path)
+        if sampler is None:
+            tracks += [array.array("I"), array.array("f")]
+            continue
+        if sampler.get('interpolation', "LINEAR") != "LINEAR":
+            raise ConversionError(label + " interpolation is not linear, please fix that and relaunch the conversion.")
+        tracks += [_get_timestamps(gltf, buffers, sampler['input']), _get_float_accessor(gltf, buffers, sampler['output'])]
+
+    return Model(index.mesh_names[mesh_number], mesh_texture, vertices, normals, triangles, texture_coords_0, mesh_min_bounds, mesh_max_bounds, *tracks)
 
-            out_file.write(struct_u32.pack(n_texture_animations))
-            out_file.write(struct_u32.pack(ofs_texture_animations))
+def load_models(path):
+    gltf, buffers, index = load_scene(path)
+    models_list = []
+    for mesh_number in range(0, len(gltf.get('meshes', []))):
+        models_list.append( load_model(gltf, buffers, mesh_number, index) )
 
-            out_file.write(struct_u32.pack(n_tex_replace))
-            out_file.write(struct_u32.pack(ofs_tex_replace))
+    _close_buffers(buffers)
+    return models_list
 
-            out_file.write(struct_u32.pack(n_render_flags))
-            out_file.write(struct_u32.pack(ofs_render_flags))
+""" TEXTURES
+"""
 
-            out_file.write(struct_u32.pack(n_bone_lookup_table))
-            out_file.write(struct_u32.pack(ofs_bone_lookup_table))
-
-            out_file.write(struct_u32.pack(n_tex_lookup))
-            out_file.write(struct_u32.pack(ofs_tex_lookup))
-
-            out_file.write(struct_u32.pack(n_tex_units))
-            out_file.write(struct_u32.pack(ofs_tex_units))
-
-            out_file.write(struct_u32.pack(n_trans_lookup))
-            out_file.write(struct_u32.pack(ofs_trans_lookup))
-
-            out_file.write(struct_u32.pack(n_tex_anim_lookup))
-            out_file.write(struct_u32.pack(ofs_tex_anim_lookup))
-
-            out_file.write(struct_f.pack(bounding_lower_x))
-            out_file.write(struct_f.pack(bounding_lower_y))
-            out_file.write(struct_f.pack(bounding_lower_z))      
-
-            out_file.write(struct_f.pack(bounding_upper_x))
-            out_file.write(struct_f.pack(bounding_upper_y))
-            out_file.write(struct_f.pack(bounding_upper_z))
-
-            out_file.write(struct_f.pack(bounding_radius))
-
-            out_file.write(struct_f.pack(collisions_lower_x))
-            out_file.write(struct_f.pack(collisions_lower_y))
-            out_file.write(struct_f.pack(collisions_lower_z))      
-
-            out_file.write(struct_f.pack(collisions_upper_x))
-            out_file.write(struct_f.pack(collisions_upper_y))
-            out_file.write(struct_f.pack(collisions_upper_z))
-
-            out_file.write(struct_f.pack(collisions_radius))
-            
-            out_file.write(struct_u32.pack(n_bounding_triangles))
-            out_file.write(struct_u32.pack(ofs_bounding_triangles))
-
-            out_file.write(struct_u32.pack(n_bounding_vertices))
-            out_file.write(struct_u32.pack(ofs_bounding_vertices))
-
-            out_file.write(struct_u32.pack(n_bounding_normals))
-            out_file.write(struct_u32.pack(ofs_bounding_normals))
-
-            out_file.write(struct_u32.pack(n_attachments))
-            out_file.write(struct_u32.pack(ofs_attachments))
-
-            out_file.write(struct_u32.pack(n_attach_lookup))
-            out_file.write(struct_u32.pack(ofs_attach_lookup))
-
-            out_file.write(struct_u32.pack(n_events))
-            out_file.write(struct_u32.pack(ofs_events))
-
-            out_file.write(struct_u32.pack(n_lights))
-            out_file.write(struct_u32.pack(ofs_lights))
-
-            out_file.write(struct_u32.pack(n_cameras))
-            out_file.write(struct_u32.pack(ofs_cameras))
-
-            out_file.write(struct_u32.pack(n_camera_lookup))
-            out_file.write(struct_u32.pack(ofs_camera_lookup))
-
-            out_file.write(struct_u32.pack(n_ribbon_emitters))
-            out_file.write(struct_u32.pack(ofs_ribbon_emitters))      
-
-            out_file.write(struct_u32.pack(n_particle_emitters))
-            out_file.write(struct_u32.pack(ofs_particle_emitters))
-            
-            # After the header
-            
-            out_file.write(self.name)
-            out_file.write(struct_u8.pack(0)) # string null terminated
-
-            out_file.write(struct_u32.pack(global_seq))
-
-            out_file.write(struct_h.pack(fake_anim_block[0]))
-            out_file.write(struct_h.pack(fake_anim_block[1]))
-            out_file.write(struct_u32.pack(fake_anim_block[2]))
-            out_file.write(struct_f.pack(fake_anim_block[3]))
-            out_file.write(struct_u32.pack(fake_anim_block[4]))
-            out_file.write(struct_h.pack(fake_anim_block[5]))
-            out_file.write(struct_h.pack(fake_anim_block[6]))
-            out_file.write(struct_u32.pack(fake_anim_block[7]))
-            out_file.write(struct_u32.pack(fake_anim_block[8]))
-            out_file.write(struct_u32.pack(fake_anim_block[9]))      
-            out_file.write(struct_f.pack(fake_anim_block[10]))
-            out_file.write(struct_f.pack(fake_anim_block[11]))
-            out_file.write(struct_f.pack(fake_anim_block[12]))
-            out_file.write(struct_f.pack(fake_anim_block[13]))
-            out_file.write(struct_f.pack(fake_anim_block[14]))
-            out_file.write(struct_f.pack(fake_anim_block[15]))
-            out_file.write(struct_f.pack(fake_anim_block[16]))
-            out_file.write(struct_h.pack(fake_anim_block[17]))
-            out_file.write(struct_h.pack(fake_anim_block[18]))
-            
-            out_file.write(struct_i.pack(keybone_id))
-            out_file.write(struct_u32.pack(bone_flags))
-            out_file.write(struct_h.pack(parent_bone))
-            out_file.write(struct_H.pack(bone_unk1))
-            out_file.write(struct_H.pack(bone_unk2))
-            out_file.write(struct_H.pack(bone_unk3))
-            
-            out_file.write(struct_h.pack(tr_block[0]))
-            out_file.write(struct_h.pack(tr_block[1]))
-            out_file.write(struct_u32.pack(tr_block[2]))
-            out_file.write(struct_u32.pack(tr_block[3]))
-            out_file.write(struct_u32.pack(tr_block[4]))
-            out_file.write(struct_u32.pack(tr_block[5]))      
-            out_file.write(struct_h.pack(ro_block[0]))
-            out_file.write(struct_h.pack(ro_block[1]))
-            out_file.write(struct_u32.pack(ro_block[2]))
-            out_file.write(struct_u32.pack(ro_block[3]))
-            out_file.write(struct_u32.pack(ro_block[4]))
-            out_file.write(struct_u32.pack(ro_block[5]))       
-            out_file.write(struct_h.pack(sc_block[0]))
-            out_file.write(struct_h.pack(sc_block[1]))
-            out_file.write(struct_u32.pack(sc_block[2]))
-            out_file.write(struct_u32.pack(sc_block[3]))
-            out_file.write(struct_u32.pack(sc_block[4]))
-            out_file.write(struct_u32.pack(sc_block[5]))     
-            out_file.write(struct_f.pack(bone_vector_pivot[0]))
-            out_file.write(struct_f.pack(bone_vector_pivot[1]))
-            out_file.write(struct_f.pack(bone_vector_pivot[2]))
-            
-            out_file.write(struct_u32.pack(t1[0]))
-            out_file.write(struct_u32.pack(t1[1]))
-            out_file.write(struct_u32.pack(t2[0]))
-            out_file.write(struct_u32.pack(t2[1]))
-            out_file.write(struct_u32.pack(r1[0]))
-            out_file.write(struct_u32.pack(r1[1]))
-            out_file.write(struct_u32.pack(r2[0]))
-            out_file.write(struct_u32.pack(r2[1]))
-            out_file.write(struct_u32.pack(s1[0]))
-            out_file.write(struct_u32.pack(s1[1]))
-            out_file.write(struct_u32.pack(s2[0]))
-            out_file.write(struct_u32.pack(s2[1]))
-
-            for i in range (0, len(t1_1)):
-                out_file.write(struct_u32.pack(t1_1[i]))     
-
-            for i in range (0, len(t2_1)):
-                for j in range (0, len(t2_1[i])):
-                    out_file.write(struct_f.pack(t2_1[i][j]))
-
-            for i in range (0, len(r1_1)):
-                out_file.write(struct_u32.pack(r1_1[i]))
-
-            for i in range (0, len(r2_1)):
-                for j in range (0, len(r2_1[i])):
-                    out_file.write(struct_h.pack(r2_1[i][j]))
-
-            for i in range (0, len(s1_1)):
-                out_file.write(struct_u32.pack(s1_1[i]))
-
-            for i in range (0, len(s2_1)):
-                for j in range (0, len(s2_1[i])):
-                    out_file.write(struct_f.pack(s2_1[i][j]))
-            
-            out_file.write(struct_h.pack(keybone_lookup))
-            
-            for v in range (0, (len(self.vertices) / 3)):
-                # 1 vertex : 
-                out_file.write(struct_f.pack(self.vertices[v * 3])) # pos
-                out_file.write(struct_f.pack(self.vertices[v * 3 + 1]))
-                out_file.write(struct_f.pack(self.vertices[v * 3 + 2]))
-                out_file.write(struct_u8.pack(255)) # bone weight
-                out_file.write(struct_u8.pack(0))
-                out_file.write(struct_u8.pack(0))
-                out_file.write(struct_u8.pack(0))
-                out_file.write(struct_u8.pack(0)) # bone indice
-                out_file.write(struct_u8.pack(0))
-                out_file.write(struct_u8.pack(0))
-                out_file.write(struct_u8.pack(0))
-                out_file.write(struct_f.pack(self.normals[v * 3])) # normals (normalize them ?)
-                out_file.write(struct_f.pack(self.normals[v * 3 + 1]))
-                out_file.write(struct_f.pack(self.normals[v * 3 + 2]))
-                out_file.write(struct_f.pack(self.texture_coords_0[v * 2])) # tex coords 0
-                out_file.write(struct_f.pack(self.texture_coords_0[v * 2 + 1]))
-                out_file.write(struct_f.pack(0.0)) # tex coords 1
-                out_file.write(struct_f.pack(0.0))
-            
-            out_file.write(struct_u32.pack(0)) # texture type
-            out_file.write(struct_u32.pack(3)) # texture flags : put 3 to wrap_x and wrap_y if you have multiple UV islands
-            out_file.write(struct_u32.pack(texture_length)) # texture filename length
-            out_file.write(struct_u32.pack(ofs_textures + 4 * 4))
-            out_file.write(texture_full_name)
-            out_file.write(struct_u8.pack(0)) # string null terminated
-
-            out_file.write(struct_h.pack(transparency_block[0]))
-            out_file.write(struct_h.pack(transparency_block[1]))
-            out_file.write(struct_u32.pack(transparency_block[2]))
-            out_file.write(struct_u32.pack(transparency_block[3]))
-            out_file.write(struct_u32.pack(transparency_block[4]))
-            out_file.write(struct_u32.pack(transparency_block[5]))
-            
-            out_file.write(struct_u32.pack(timestamp_block[0]))
-            out_file.write(struct_u32.pack(timestamp_block[1]))
-            
-            out_file.write(struct_u32.pack(subanim_block[0]))
-            out_file.write(struct_u32.pack(subanim_block[1]))
-            
-            out_file.write(struct_u32.pack(fake_timestamp_value))
-            out_file.write(struct_h.pack(fake_subanim_value))
-
-            out_file.write(struct_h.pack(0)) # texreplace short 0
-            out_file.write(struct_h.pack(0)) # renderflags 0
-            out_file.write(struct_h.pack(0)) # blending mode
-
-            out_file.write(struct_h.pack(0)) # bone lookup table
-            out_file.write(struct_h.pack(0)) # bone lookup table      
-            out_file.write(struct_h.pack(0)) # bone lookup table
-            out_file.write(struct_h.pack(0)) # bone lookup table
-            
-            out_file.write(struct_h.pack(0)) # texlookuptable 0
-            out_file.write(struct_h.pack(0)) # texunitlookuptable 0
-            out_file.write(struct_h.pack(0)) # translookuptable 0
-            out_file.write(struct_h.pack(-1)) # texanimlookuptable -1
-        
-            """
-        
-            for i in range (0, len(collisions_triangles)):
-                for j in range (0, len(collisions_triangles[i])):
-                    out_file.write(struct_h.pack(collisions_triangles[i][j]))
-
-            for i in range (0, len(collisions_vertices)):
-                for j in range (0, len(collisions_vertices[i])):
-                    out_file.write(struct_f.pack(collisions_vertices[i][j]))
-
-            for i in range (0, len(collisions_normals)):
-                for j in range (0, len(collisions_normals[i])):
-                    out_file.write(struct_f.pack(collisions_normals[i][j]))
-
-            """
-
-        skinfilename = self.name + "00.skin"
-        with open(skinfilename, "wb") as out_skin_file:
-          
-            submeshes_fake_block_size = 48
-            
-            submeshes_fake_block = [0, 0, 0, len(self.vertices) / 3, min(self.triangles), len(self.triangles), n_bones, 0, 1, 0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, bounding_radius]      
-            
-            texture_units_block = [16, 0, 0, 0, 0, -1, 0, 0, 1, 0, 0, 0, 0]
-            
-            n_indices = len(self.vertices) / 3
-            ofs_indices = 48 # start at skin header size
-            n_triangles = len(self.triangles)
-            ofs_triangles = ofs_indices + n_indices * 2
-            n_properties = n_indices
-            ofs_properties = ofs_triangles + (len(self.triangles) * 2)
-            n_submeshes = 1
-            ofs_submeshes = ofs_properties + n_properties * 4#(len(self.triangles) * 4)
-            n_texture_units = 1
-            ofs_texture_units = ofs_submeshes + submeshes_fake_block_size
-            lod = 0      
-            
-            out_skin_file.write(struct_u32.pack(1313426259))
-            out_skin_file.write(struct_u32.pack(n_indices))
-            out_skin_file.write(struct_u32.pack(ofs_indices))
-            out_skin_file.write(struct_u32.pack(n_triangles))
-            out_skin_file.write(struct_u32.pack(ofs_triangles))
-            out_skin_file.write(struct_u32.pack(n_properties))
-            out_skin_file.write(struct_u32.pack(ofs_properties))
-            out_skin_file.write(struct_u32.pack(n_submeshes))
-            out_skin_file.write(struct_u32.pack(ofs_submeshes))
-            out_skin_file.write(struct_u32.pack(n_texture_units))
-            out_skin_file.write(struct_u32.pack(ofs_texture_units))      
-            out_skin_file.write(struct_u32.pack(lod))
-            
-            for i in range (0, n_indices):
-                out_skin_file.write(struct_H.pack(i))
-            
-            for tri in self.triangles:
-                out_skin_file.write(struct_H.pack(tri))
-            
-            for i in range (0, n_properties):
-                for i in range (0, 4):
-                    out_skin_file.write(struct_u8.pack(0))      
-            
-            out_skin_file.write(struct_h.pack(submeshes_fake_block[0]))
-            out_skin_file.write(struct_h.pack(submeshes_fake_block[1]))
-            out_skin_file.write(struct_h.pack(submeshes_fake_block[2]))
-            out_skin_file.write(struct_h.pack(submeshes_fake_block[3]))
-            out_skin_file.write(struct_h.pack(submeshes_fake_block[4]))      
-            out_skin_file.write(struct_h.pack(submeshes_fake_block[5]))
-            out_skin_file.write(struct_h.pack(submeshes_fake_block[6]))
-            out_skin_file.write(struct_h.pack(submeshes_fake_block[7]))
-            out_skin_file.write(struct_h.pack(submeshes_fake_block[8]))
-            out_skin_file.write(struct_h.pack(submeshes_fake_block[9]))      
-            out_skin_file.write(struct_f.pack(submeshes_fake_block[10]))
-            out_skin_file.write(struct_f.pack(submeshes_fake_block[11]))
-            out_skin_file.write(struct_f.pack(submeshes_fake_block[12]))
-            out_skin_file.write(struct_f.pack(submeshes_fake_block[13]))
-            out_skin_file.write(struct_f.pack(submeshes_fake_block[14]))
-            out_skin_file.write(struct_f.pack(submeshes_fake_block[15]))
-            out_skin_file.write(struct_f.pack(submeshes_fake_block[16]))      
-
-            out_skin_file.write(struct_u8.pack(texture_units_block[0]))
-            out_skin_file.write(struct_u8.pack(texture_units_block[1]))
-            out_skin_file.write(struct_h.pack(texture_units_block[2]))
-            out_skin_file.write(struct_h.pack(texture_units_block[3]))
-            out_skin_file.write(struct_h.pack(texture_units_block[4]))      
-            out_skin_file.write(struct_h.pack(texture_units_block[5]))
-            out_skin_file.write(struct_h.pack(texture_units_block[6]))
-            out_skin_file.write(struct_h.pack(texture_units_block[7]))
-            out_skin_file.write(struct_h.pack(texture_units_block[8]))
-            out_skin_file.write(struct_h.pack(texture_units_block[9]))
-            out_skin_file.write(struct_h.pack(texture_units_block[10]))
-            out_skin_file.write(struct_h.pack(texture_units_block[11]))
-            out_skin_file.write(struct_h.pack(texture_units_block[12]))      
-            
-        print("Files " + self.name + ".m2 and " + self.name + "00.skin saved")
+texture_formats = ["auto", "dxt1", "dxt3", "dxt5", "palette"] # auto : dxt1 for opaque or cut out textures, dxt5 for smooth alpha
+png_signature = b"\x89PNG\r\n\x1a\n"
+blp_header_size = 148 # header up to the mip sizes, the palette (256 BGRA colors) comes right after
+struct_blp_header = struct.Struct("<4sIBBBBII16I16I") # magic, type, compression, alpha depth, alpha type, has mips, width, height, mip offsets, mip sizes
+struct_dxt_color = struct.Struct("<HHI") # 2 colors (565), 16 indices of 2 bits
+struct_png_chunk = struct.Struct(">I4s") # length, type
+struct_png_header = struct.Struct(">IIBBBBB") # width, height, bit depth, color type, compression, filter, interlace
+struct_tga_header = struct.Struct("<BBBHHBHHHHBB") # id length, color map type, image type, color map (first, length, depth), origin, size, depth, descriptor
+shift_3_table = bytes(bytearray(i >> 3 for i in range(256))) # 8 -> 5 bits
+
+def _read_png(data):
+    # 8 / 16 bits png (gray, rgb, palette, gray + alpha, rgba, not interlaced) -> width, height, rgba bytes.
+    if data[0:8] != png_signature:
+        raise ConversionError("Not a png file.")
+    offset = 8
+    palette = b""
+    transparency = b""
+    compressed = []
+    header = None
+    while offset + struct_png_chunk.size <= len(data):
+        length, kind = struct_png_chunk.unpack_from(data, offset)
+        body = data[offset + 8:offset + 8 + length]
+        offset += length + 12 # length, type, data, crc
+        if kind == b"IHDR":
+            header = struct_png_header.unpack(body)
+        elif kind == b"PLTE":
+            palette = body
+        elif kind == b"tRNS":
+            transparency = body
+        elif kind == b"IDAT":
+            compressed.append(body)
+        elif kind == b"IEND":
+            break
+    if header is None:
+        raise ConversionError("Png file without header.")
+    width, height, depth, color_type, compression, filter_method, interlace = header
+    if interlace != 0 or color_type not in (0, 2, 3, 4, 6) or depth not in (1, 2, 4, 8, 16):
+        raise ConversionError("Unsupported png (interlaced, or color type %d with %d bits)." % (color_type, depth))
+
+    channels = { 0: 1, 2: 3, 3: 1, 4: 2, 6: 4 }[color_type]
+    bpp = max(1, channels * depth // 8) # bytes per pixel, for the filters
+    stride = (width * channels * depth + 7) // 8
+    raw = zlib.decompress(b"".join(compressed))
+    pixels = bytearray(stride * height)
+    previous = bytearray(stride)
+    for y in range(0, height):
+        filter_type = raw[y * (stride + 1)]
+        line = bytearray(raw[y * (stride + 1) + 1:(y + 1) * (stride + 1)])
+        if filter_type == 1: # sub
+            for i in range(bpp, stride):
+                line[i] = (line[i] + line[i - bpp]) & 255
+        elif filter_type == 2: # up
+            line = bytearray(map(operator.and_, map(operator.add, line, previous), itertools.repeat(255)))
+        elif filter_type == 3: # average
+            for i in range(0, stride):
+                line[i] = (line[i] + ((line[i - bpp] if i >= bpp else 0) + previous[i]) // 2) & 255
+        elif filter_type == 4: # paeth
+            for i in range(0, stride):
+                a = line[i - bpp] if i >= bpp else 0
+                b = previous[i]
+                c = previous[i - bpp] if i >= bpp else 0
+                p = a + b - c
+                pa, pb, pc = abs(p - a), abs(p - b), abs(p - c)
+                line[i] = (line[i] + (a if pa <= pb and pa <= pc else b if pb <= pc else c)) & 255
+        pixels[y * stride:(y + 1) * stride] = line
+        previous = line
+
+    if depth == 16: # big endian samples : the high byte is enough
+        pixels = pixels[0::2]
+    elif depth < 8: # gray or palette indices packed in bytes, first pixel in the high bits
+        per_byte = 8 // depth
+        mask = (1 << depth) - 1
+        samples = bytearray(width * height)
+        for y in range(0, height):
+            row = pixels[y * stride:(y + 1) * stride]
+            for shift in range(0, per_byte):
+                column = bytes(map(operator.and_, map(operator.rshift, row, itertools.repeat(8 - depth * (shift + 1))), itertools.repeat(mask)))
+                count = len(range(shift, width, per_byte))
+                samples[y * width + shift:(y + 1) * width:per_byte] = column[0:count]
+        if color_type == 0: # stretch the gray levels to 0-255
+            samples = samples.translate(bytes(bytearray(min(255, i * 255 // mask) for i in range(256))))
+        pixels = samples
+
+    n_pixels = width * height
+    rgba = bytearray(b"\xff" * 4 * n_pixels)
+    if color_type == 3:
+        palette = palette + bytes(768 - len(palette))
+        for channel in range(0, 3):
+            rgba[channel::4] = pixels.translate(palette[channel::3])
+        rgba[3::4] = pixels.translate(transparency[0:256] + b"\xff" * (256 - len(transparency[0:256])))
+    else: # gray or rgb, then maybe alpha (the tRNS color key of gray / rgb images isn't used)
+        colors = 3 if color_type in (2, 6) else 1
+        for channel in range(0, 3):
+            rgba[channel::4] = pixels[min(channel, colors - 1)::channels]
+        if color_type in (4, 6):
+            rgba[3::4] = pixels[channels - 1::channels]
+    return width, height, rgba
+
+def _read_tga(data):
+    # 8 (gray), 24 or 32 bits tga, raw or rle -> width, height, rgba bytes.
+    id_length, colormap_type, image_type, colormap_first, colormap_length, colormap_depth, x, y, width, height, depth, descriptor = struct_tga_header.unpack_from(data, 0)
+    if image_type not in (2, 3, 10, 11) or depth not in (8, 24, 32):
+        raise ConversionError("Unsupported tga (type %d with %d bits)." % (image_type, depth))
+    bpp = depth // 8
+    offset = struct_tga_header.size + id_length + colormap_length * ((colormap_depth + 7) // 8) * colormap_type
+    n_pixels = width * height
+    if image_type in (2, 3):
+        pixels = bytes(data[offset:offset + n_pixels * bpp])
+    else: # rle packets : a count byte, then one pixel repeated (high bit set) or count raw pixels
+        chunks = []
+        size = 0
+        while size < n_pixels * bpp:
+            count = (data[offset] & 127) + 1
+            if data[offset] & 128:
+                chunks.append(bytes(data[offset + 1:offset + 1 + bpp]) * count)
+                offset += 1 + bpp
+            else:
+                chunks.append(bytes(data[offset + 1:offset + 1 + bpp * count]))
+                offset += 1 + bpp * count
+            size += bpp * count
+        pixels = b"".join(chunks)[0:n_pixels * bpp]
+    if len(pixels) < n_pixels * bpp:
+        raise ConversionError("Truncated tga file.")
+    if not descriptor & 0x20: # bottom to top
+        row = width * bpp
+        pixels = b"".join([pixels[i * row:(i + 1) * row] for i in range(height - 1, -1, -1)])
+
+    rgba = bytearray(b"\xff" * 4 * n_pixels)
+    if bpp == 1:
+        for channel in range(0, 3):
+            rgba[channel::4] = pixels
+    else: # BGR(A)
+        for channel in range(0, 3):
+            rgba[channel::4] = pixels[2 - channel::bpp]
+        if bpp == 4:
+            rgba[3::4] = pixels[3::4]
+    return width, height, rgba
+
+def _load_image(path, data=None):
+    # data : the content of an image embedded in a scene, path is then only its name
+    if data is None:
+        with open(path, "rb") as image_file:
+            data = image_file.read()
+    if data[0:8] == png_signature:
+        return _read_png(data)
+    if path.lower().endswith(".tga"):
+        return _read_tga(data)
+    raise ConversionError(path + " : only png and tga textures can be converted.")
+
+def _downsample(width, height, rgba):
+    # Next mip : every pixel is the average of a 2x2 block (1x2 or 2x1 on the last levels). All by strided slices and C level maps.
+    new_width = max(1, width // 2)
+    new_height = max(1, height // 2)
+    row = width * 4
+    top = b"".join([rgba[(2 * y) * row:(2 * y + 1) * row] for y in range(0, new_height)])
+    bottom = b"".join([rgba[min(2 * y + 1, height - 1) * row:(min(2 * y + 1, height - 1) + 1) * row] for y in range(0, new_height)])
+    output = bytearray(4 * new_width * new_height)
+    step = 8 if width > 1 else 4
+    right = 4 if width > 1 else 0
+    for channel in range(0, 4):
+        total = map(operator.add, map(operator.add, top[channel::step], top[channel + right::step]), map(operator.add, bottom[channel::step], bottom[channel + right::step]))
+        output[channel::4] = bytes(map(operator.rshift, map(operator.add, total, itertools.repeat(2)), itertools.repeat(2)))
+    return new_width, new_height, output
+
+def _mipmaps(width, height, rgba):
+    # Full chain down to 1x1 (16 levels at most, the blp limit).
+    levels = [(width, height, rgba)]
+    while (width > 1 or height > 1) and len(levels) < 16:
+        width, height, rgba = _downsample(width, height, rgba)
+        levels.append((width, height, rgba))
+    return levels
+
+def _palette(levels):
+    # Up to 256 colors for the palettized blp : the exact colors when there are few enough, else median cut on 5 bits per channel.
+    # Returns the palette (r, g, b list) and a function giving the palette index of every pixel of an rgba level.
+    def keys_of(rgba, shift):
+        r, g, b = [rgba[channel::4] if shift == 0 else rgba[channel::4].translate(shift_3_table) for channel in range(0, 3)]
+        bits = 8 - shift
+        return list(map(operator.or_, map(operator.or_, map(operator.lshift, r, itertools.repeat(2 * bits)), map(operator.lshift, g, itertools.repeat(bits))), b))
+
+    exact = collections.Counter(itertools.chain.from_iterable(keys_of(rgba, 0) for width, height, rgba in levels))
+    if len(exact) <= 256:
+        colors = list(exact)
+        index = dict(zip(colors, range(0, len(colors))))
+        return [(key >> 16, (key >> 8) & 255, key & 255) for key in colors], lambda rgba: bytes(map(index.__getitem__, keys_of(rgba, 0)))
+
+    histogram = collections.Counter(itertools.chain.from_iterable(keys_of(rgba, 3) for width, height, rgba in levels))
+    boxes = [[(key >> 10, (key >> 5) & 31, key & 31, count) for key, count in histogram.items()]]
+    while len(boxes) < 256:
+        # split the box with the most pixels that still has 2 colors, on its widest channel, at the pixel median
+        candidates = [box for box in boxes if len(box) > 1]
+        if not candidates:
+            break
+        box = max(candidates, key=lambda box: sum(color[3] for color in box))
+        ranges = [max(color[channel] for color in box) - min(color[channel] for color in box) for channel in range(0, 3)]
+        box.sort(key=operator.itemgetter(ranges.index(max(ranges))))
+        half = sum(color[3] for color in box) / 2.0
+        total = 0
+        for cut in range(1, len(box)):
+            total += box[cut - 1][3]
+            if total >= half:
+                break
+        boxes.remove(box)
+        boxes += [box[0:cut], box[cut:]]
+
+    palette = []
+    table = bytearray(32768)
+    for number, box in enumerate(boxes):
+        count = sum(color[3] for color in box)
+        palette.append(tuple(min(255, int(round(sum(((color[channel] << 3) | (color[channel] >> 2)) * color[3] for color in box) / count))) for channel in range(0, 3)))
+        for r, g, b, n in box:
+            table[(r << 10) | (g << 5) | b] = number
+    return palette, lambda rgba: bytes(map(table.__getitem__, keys_of(rgba, 3)))
+
+def _pack_alpha_bits(alpha):
+    # 1 bit alpha of the palettized blp : 8 pixels per byte, the first one in the lowest bit.
+    bits = bytes(map(operator.rshift, alpha, itertools.repeat(7))) + bytes(-len(alpha) % 8)
+    packed = bytes(len(bits) // 8)
+    for i in range(0, 8):
+        packed = bytes(map(operator.or_, packed, map(operator.lshift, bits[i::8], itertools.repeat(i))))
+    return packed
+
+def _to_565(color):
+    return ((color[0] >> 3) << 11) | ((color[1] >> 2) << 5) | (color[2] >> 3)
+
+def _from_565(value):
+    r, g, b = value >> 11, (value >> 5) & 63, value & 31
+    return ((r << 3) | (r >> 2), (g << 2) | (g >> 4), (b << 3) | (b >> 2))
+
+def _dxt_color_block(pixels, cut_out):
+    # One 4x4 block (16 r, g, b, a tuples) -> 8 bytes : end points on the bounding box diagonal (oriented like the colors are),
+    # every pixel to the nearest of the 4 colors. cut_out : dxt1 with 1 bit alpha, the 3 colors mode and index 3 for transparent pixels.
+    opaque = [pixel for pixel in pixels if pixel[3] >= 128] if cut_out else pixels
+    if not opaque:
+        return struct_dxt_color.pack(0, 0, 0xFFFFFFFF)
+    low = [min(pixel[channel] for pixel in opaque) for channel in range(0, 3)]
+    high = [max(pixel[channel] for pixel in opaque) for channel in range(0, 3)]
+    # the box diagonal goes low -> high on every channel : flip green / blue when they go against red (or green)
+    mean = [sum(pixel[channel] for pixel in opaque) / len(opaque) for channel in range(0, 3)]
+    reference = 0 if high[0] > low[0] else 1
+    for channel in range(reference + 1, 3):
+        if sum((pixel[reference] - mean[reference]) * (pixel[channel] - mean[channel]) for pixel in opaque) < 0:
+            low[channel], high[channel] = high[channel], low[channel]
+    inset = [(h - l) / 16.0 for l, h in zip(low, high)]
+    c0 = _to_565([int(min(255, max(0, h - i))) for h, i in zip(high, inset)])
+    c1 = _to_565([int(min(255, max(0, l + i))) for l, i in zip(low, inset)])
+    if (c0 < c1) != cut_out: # 4 colors needs c0 > c1, 3 colors + transparent needs c0 <= c1
+        c0, c1 = c1, c0
+    if c0 == c1: # flat block : everything on c0, but the transparent pixels
+        return struct_dxt_color.pack(c0, c1, sum(3 << (2 * i) for i, pixel in enumerate(pixels) if cut_out and pixel[3] < 128))
+    start = _from_565(c0)
+    end = _from_565(c1)
+    axis = [e - s for s, e in zip(start, end)]
+    length = float(sum(value * value for value in axis))
+    steps = 2 if cut_out else 3
+    indices = [0, 2, 1] if cut_out else [0, 2, 3, 1] # palette order : c0, c1, then the blends
+    bits = 0
+    for i, pixel in enumerate(pixels):
+        if cut_out and pixel[3] < 128:
+            bits |= 3 << (2 * i)
+            continue
+        t = sum((pixel[channel] - start[channel]) * axis[channel] for channel in range(0, 3)) / length
+        bits |= indices[min(steps, max(0, int(round(t * steps))))] << (2 * i)
+    return struct_dxt_color.pack(c0, c1, bits)
+
+def _dxt3_alpha_block(pixels):
+    # 4 bits of alpha per pixel, first pixel in the lowest bits.
+    return sum((pixel[3] >> 4) << (4 * i) for i, pixel in enumerate(pixels)).to_bytes(8, "little")
+
+def _dxt5_alpha_block(pixels):
+    # 2 end alphas (max, min) and 16 indices of 3 bits on the 8 levels between them.
+    a0 = max(pixel[3] for pixel in pixels)
+    a1 = min(pixel[3] for pixel in pixels)
+    bits = 0
+    if a0 > a1:
+        indices = [0, 2, 3, 4, 5, 6, 7, 1] # level k (0 = a0, 7 = a1) -> its index
+        for i, pixel in enumerate(pixels):
+            bits |= indices[int(round((a0 - pixel[3]) * 7.0 / (a0 - a1)))] << (3 * i)
+    return bytes((a0, a1)) + bits.to_bytes(6, "little")
+
+def _encode_dxt(width, height, rgba, texture_format, cut_out):
+    # Whole level -> dxt blocks, left to right then top to bottom. Levels under 4x4 are padded by repeating their pixels.
+    blocks = []
+    for block_y in range(0, max(1, (height + 3) // 4)):
+        rows = [min(block_y * 4 + y, height - 1) * width * 4 for y in range(0, 4)]
+        for block_x in range(0, max(1, (width + 3) // 4)):
+            columns = [min(block_x * 4 + x, width - 1) * 4 for x in range(0, 4)]
+            pixels = [tuple(rgba[row + column:row + column + 4]) for row in rows for column in columns]
+            if texture_format == "dxt3":
+                blocks.append(_dxt3_alpha_block(pixels))
+            elif texture_format == "dxt5":
+                blocks.append(_dxt5_alpha_block(pixels))
+            blocks.append(_dxt_color_block(pixels, cut_out))
+    return b"".join(blocks)
+
+def convert_texture(image_path, blp_path, texture_format="auto", data=None):
+    # png / tga -> blp2 with all its mips : dxt1 / dxt3 / dxt5, or 256 colors palette. Sizes must be powers of 2.
+    # data : the content of the image when it's embedded in a scene (image_path is then only its name, for the messages).
+    # Returns a short description of what was written.
+    width, height, rgba = _load_image(image_path, data)
+    if width & (width - 1) or height & (height - 1) or width == 0 or height == 0:
+        raise ConversionError("%s is %dx%d, the client wants powers of 2." % (image_path, width, height))
+    alpha_values = set(rgba[3::4])
+    alpha_depth = 0 if alpha_values <= set([255]) else 1 if alpha_values <= set([0, 255]) else 8
+    if texture_format == "auto":
+        texture_format = "dxt5" if alpha_depth == 8 else "dxt1"
+    levels = _mipmaps(width, height, rgba)
+
+    palette = [(0, 0, 0)] * 256
+    if texture_format == "palette":
+        colors, indexer = _palette(levels)
+        palette[0:len(colors)] = colors
+        compression, alpha_type = 1, 0
+        data = []
+        for level_width, level_height, level in levels:
+            alpha = level[3::4]
+            data.append(indexer(level) + (b"" if alpha_depth == 0 else _pack_alpha_bits(alpha) if alpha_depth == 1 else bytes(alpha)))
+    else:
+        compression = 2
+        alpha_type = { "dxt1": 0, "dxt3": 1, "dxt5": 7 }[texture_format]
+        if texture_format == "dxt1":
+            alpha_depth = min(alpha_depth, 1) # smooth alpha becomes cut out
+        else:
+            alpha_depth = 8
+        data = [_encode_dxt(level_width, level_height, level, texture_format, texture_format == "dxt1" and alpha_depth == 1) for level_width, level_height, level in levels]
+
+    layout = Layout(blp_header_size + 256 * struct_u32.size)
+    offsets = [layout.add(len(level_data)) for level_data in data]
+    sizes = [len(level_data) for level_data in data]
+    blp = bytearray(layout.size)
+    struct_blp_header.pack_into(blp, 0, b"BLP2", 1, compression, alpha_depth, alpha_type, 1 if len(levels) > 1 else 0, width, height,
+        *(offsets + [0] * (16 - len(offsets)) + sizes + [0] * (16 - len(sizes))))
+    for i, (r, g, b) in enumerate(palette):
+        blp[blp_header_size + 4 * i:blp_header_size + 4 * i + 4] = bytes((b, g, r, 255)) # BGRA
+    for offset, level_data in zip(offsets, data):
+        blp[offset:offset + len(level_data)] = level_data
+
+    if os.path.dirname(blp_path):
+        os.makedirs(os.path.dirname(blp_path), exist_ok=True)
+    with open(blp_path, "wb") as blp_file:
+        blp_file.write(blp)
+    return "%s %dx%d, %d mips" % (texture_format, width, height, len(levels))
+
+""" READING M2 FILES
+"""
 
-""" LOADING INFO FROM FILES
+# header of the 3.3.5 m2, in the order of struct_m2_header
+m2_header_fields = ("magic version n_name ofs_name global_flags n_global_seq ofs_global_seq n_anims ofs_anims n_anim_lookup ofs_anim_lookup "
+    "n_bones ofs_bones n_keybone_lookup ofs_keybone_lookup n_vertices ofs_vertices n_views n_colors ofs_colors "
+    "n_textures ofs_textures n_transparency ofs_transparency n_texture_animations ofs_texture_animations n_tex_replace ofs_tex_replace "
+    "n_render_flags ofs_render_flags n_bone_lookup_table ofs_bone_lookup_table n_tex_lookup ofs_tex_lookup n_tex_units ofs_tex_units "
+    "n_trans_lookup ofs_trans_lookup n_tex_anim_lookup ofs_tex_anim_lookup "
+    "bounding_lower_x bounding_lower_y bounding_lower_z bounding_upper_x bounding_upper_y bounding_upper_z bounding_radius "
+    "collisions_lower_x collisions_lower_y collisions_lower_z collisions_upper_x collisions_upper_y collisions_upper_z collisions_radius "
+    "n_bounding_triangles ofs_bounding_triangles n_bounding_vertices ofs_bounding_vertices n_bounding_normals ofs_bounding_normals "
+    "n_attachments ofs_attachments n_attach_lookup ofs_attach_lookup n_events ofs_events n_lights ofs_lights "
+    "n_cameras ofs_cameras n_camera_lookup ofs_camera_lookup n_ribbon_emitters ofs_ribbon_emitters n_particle_emitters ofs_particle_emitters").split()
+skin_header_fields = "magic n_indices ofs_indices n_triangles ofs_triangles n_properties ofs_properties n_submeshes ofs_submeshes n_texture_units ofs_texture_units lod".split()
+texture_unit_fields = ("flags priority shader_id skin_section geoset color material material_layer texture_count texture_combo "
+    "coord_combo weight_combo transform_combo").split()
+
+# n_ / ofs_ pair -> element size in bytes
+m2_array_sizes = { "name": 1, "global_seq": 4, "anims": struct_anim.size, "anim_lookup": 2, "bones": struct_bone.size, "keybone_lookup": 2,
+    "vertices": struct_vertex.size, "colors": 2 * struct_m2track.size, "textures": struct_texture.size, "transparency": struct_m2track.size,
+    "texture_animations": 3 * struct_m2track.size, "tex_replace": 2, "render_flags": 4, "bone_lookup_table": 2, "tex_lookup": 2, "tex_units": 2,
+    "trans_lookup": 2, "tex_anim_lookup": 2, "bounding_triangles": 2, "bounding_vertices": 12, "bounding_normals": 12, "attachments": 40,
+    "attach_lookup": 2, "events": 36, "lights": 156, "cameras": 100, "camera_lookup": 2, "ribbon_emitters": 176, "particle_emitters": 492 }
+skin_array_sizes = { "indices": 2, "triangles": 2, "properties": 4, "submeshes": struct_submesh.size, "texture_units": struct_texture_unit.size }
+
+class M2Reader(object):
+    # Reads an m2 or skin file back : the file is mapped, the header is unpacked at once, arrays are copied out in bulk.
+    # Use it in a with block (or close it).
+    def __init__(self, path, header_struct=struct_m2_header, fields=m2_header_fields):
+        self.path = path
+        with open(path, "rb") as m2_file:
+            self.size = os.fstat(m2_file.fileno()).st_size
+            if self.size < header_struct.size:
+                raise ConversionError(path + " is too small for its header.")
+            self.data = mmap.mmap(m2_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.header = dict(zip(fields, header_struct.unpack_from(self.data, 0)))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.data.close()
+
+    def in_bounds(self, count, offset, element_size):
+        return count == 0 or (offset >= 0 and offset + count * element_size <= self.size)
+
+    def array(self, count, offset, typecode, n_components=1):
+        # count elements of n_components values, from offset -> flat array
+        values = array.array(typecode)
+        values.frombytes(self.data[offset:offset + count * n_components * values.itemsize])
+        if sys.byteorder == "big":
+            values.byteswap()
+        return values
+
+    def records(self, count, offset, record_struct):
+        # count structs from offset -> list of tuples
+        return list(record_struct.iter_unpack(self.data[offset:offset + count * record_struct.size]))
+
+    def named_array(self, name, typecode, n_components=1):
+        # the m2 (or skin) array of the header pair n_<name> / ofs_<name>
+        return self.array(self.header["n_" + name], self.header["ofs_" + name], typecode, n_components)
+
+def read_m2(path):
+    # The header (field -> value) and the main arrays of an m2 : vertex positions, normals, uvs and the collision mesh.
+    with M2Reader(path) as reader:
+        vertices = reader.named_array("vertices", "f", struct_vertex.size // 4)
+        words = struct_vertex.size // 4
+        return {
+            "header": reader.header,
+            "name": bytes(reader.data[reader.header["ofs_name"]:reader.header["ofs_name"] + reader.header["n_name"]]).rstrip(b"\0").decode("utf-8", "replace"),
+            "vertices": array.array("f", itertools.chain.from_iterable(zip(vertices[0::words], vertices[1::words], vertices[2::words]))),
+            "normals": array.array("f", itertools.chain.from_iterable(zip(vertices[5::words], vertices[6::words], vertices[7::words]))),
+            "texture_coords_0": array.array("f", itertools.chain.from_iterable(zip(vertices[8::words], vertices[9::words]))),
+            "bounding_triangles": reader.named_array("bounding_triangles", "H"),
+            "bounding_vertices": reader.named_array("bounding_vertices", "f", 3),
+            "bounding_normals": reader.named_array("bounding_normals", "f", 3),
+        }
+
+def read_skin(path):
+    # The header, vertex lookup, triangles, submeshes and texture units (as dicts) of a skin.
+    with M2Reader(path, struct_skin_header, skin_header_fields) as reader:
+        return {
+            "header": reader.header,
+            "indices": reader.named_array("indices", "H"),
+            "triangles": reader.named_array("triangles", "H"),
+            "submeshes": reader.records(reader.header["n_submeshes"], reader.header["ofs_submeshes"], struct_submesh),
+            "texture_units": [dict(zip(texture_unit_fields, unit)) for unit in reader.records(reader.header["n_texture_units"], reader.header["ofs_texture_units"], struct_texture_unit)],
+        }
+
+def _check_track(reader, track, value_size, n_anims, label, problems):
+    # An M2Track : its timestamps and values are arrays of (count, offset) pairs, one per animation, each pointing to the keys.
+    interpolation, global_sequence, n_timestamps, ofs_timestamps, n_values, ofs_values = track
+    for count, offset, element_size, what in ((n_timestamps, ofs_timestamps, 4, "timestamps"), (n_values, ofs_values, value_size, "values")):
+        if not reader.in_bounds(count, offset, struct_m2array.size):
+            problems.append("%s %s : %d arrays at %d out of the file" % (label, what, count, offset))
+            continue
+        for key_count, key_offset in reader.records(count, offset, struct_m2array):
+            if not reader.in_bounds(key_count, key_offset, element_size):
+                problems.append("%s %s : %d keys at %d out of the file" % (label, what, key_count, key_offset))
+    if n_timestamps != n_values:
+        problems.append("%s : %d timestamp arrays for %d value arrays" % (label, n_timestamps, n_values))
+    # one array per animation, or a single one for a track on a global sequence (none when the track isn't animated)
+    expected = 1 if global_sequence >= 0 else n_anims
+    if n_timestamps not in (0, expected):
+        problems.append("%s : %d timestamp arrays for %d animations" % (label, n_timestamps, expected))
+
+def _check_lookup(values, limit, label, problems, allow_none=False):
+    # every value of a lookup table must be below limit (or -1 when allowed)
+    bad = [value for value in values if value >= limit or (value < 0 and not (allow_none and value == -1))]
+    if bad:
+        problems.append("%s : %d value(s) out of range (first : %d, limit %d)" % (label, len(bad), bad[0], limit))
+
+def validate_skin(path, m2_header):
+    # Problems of a skin file, against the header of its m2.
+    problems = []
+    with M2Reader(path, struct_skin_header, skin_header_fields) as reader:
+        header = reader.header
+        if header["magic"] != 1313426259:
+            return ["not a skin file (magic %08x)" % header["magic"]]
+        broken = [name for name, size in skin_array_sizes.items() if not reader.in_bounds(header["n_" + name], header["ofs_" + name], size)]
+        problems += ["%s : %d elements at %d out of the file" % (name, header["n_" + name], header["ofs_" + name]) for name in broken]
+        if broken:
+            return problems
+        indices = reader.named_array("indices", "H")
+        triangles = reader.named_array("triangles", "H")
+        _check_lookup(indices, m2_header["n_vertices"], "vertex lookup", problems)
+        _check_lookup(triangles, len(indices), "triangles", problems)
+        if len(triangles) % 3:
+            problems.append("%d triangle indices, not a multiple of 3" % len(triangles))
+        if header["n_properties"] not in (0, len(indices)):
+            problems.append("%d vertex properties for %d vertices" % (header["n_properties"], len(indices)))
+        for number, submesh in enumerate(reader.records(header["n_submeshes"], header["ofs_submeshes"], struct_submesh)):
+            vertex_start, vertex_count, index_start, index_count = submesh[2:6]
+            index_start += submesh[1] << 16 # level : high bits of the index start
+            if vertex_start + vertex_count > len(indices) or index_start + index_count > len(triangles):
+                problems.append("submesh %d : vertices %d+%d, indices %d+%d out of the skin" % (number, vertex_start, vertex_count, index_start, index_count))
+            elif any(v < vertex_start or v >= vertex_start + vertex_count for v in (min(triangles[index_start:index_start + index_count], default=vertex_start), max(triangles[index_start:index_start + index_count], default=vertex_start))):
+                problems.append("submesh %d : triangles use vertices outside of its range" % number)
+        for number, record in enumerate(reader.records(header["n_texture_units"], header["ofs_texture_units"], struct_texture_unit)):
+            unit = dict(zip(texture_unit_fields, record))
+            for field, limit in (("skin_section", header["n_submeshes"]), ("material", m2_header["n_render_flags"]), ("weight_combo", m2_header["n_trans_lookup"]),
+                    ("transform_combo", m2_header["n_tex_anim_lookup"])):
+                if unit[field] < 0 or unit[field] >= limit:
+                    problems.append("texture unit %d : %s %d out of range (limit %d)" % (number, field, unit[field], limit))
+            if unit["texture_combo"] < 0 or unit["texture_combo"] + unit["texture_count"] > m2_header["n_tex_lookup"]:
+                problems.append("texture unit %d : textures %d+%d out of the texture lookup" % (number, unit["texture_combo"], unit["texture_count"]))
+            if unit["color"] != -1 and not 0 <= unit["color"] < m2_header["n_colors"]:
+                problems.append("texture unit %d : color %d out of range" % (number, unit["color"]))
+    return problems
+
+def validate_m2(path):
+    # Checks an m2 and its skins : every count / offset pair in the file, nested animation arrays, lookups and indices in range.
+    # Returns the list of problems (empty when the model is fine).
+    problems = []
+    with M2Reader(path) as reader:
+        header = reader.header
+        if header["magic"] != 808600653 or header["version"] != 264:
+            return ["not a 3.3.5 m2 (magic %08x, version %d)" % (header["magic"], header["version"])]
+        broken = [name for name, size in m2_array_sizes.items() if not reader.in_bounds(header["n_" + name], header["ofs_" + name], size)]
+        problems += ["%s : %d elements at %d out of the file" % (name, header["n_" + name], header["ofs_" + name]) for name in broken]
+        if broken:
+            return problems
+
+        n_bones = header["n_bones"]
+        for number, bone in enumerate(reader.records(n_bones, header["ofs_bones"], struct_bone)):
+            if not -1 <= bone[2] < n_bones:
+                problems.append("bone %d : parent %d out of range" % (number, bone[2]))
+            for track, value_size, label in ((bone[6:12], 12, "translation"), (bone[12:18], 8, "rotation"), (bone[18:24], 12, "scaling")):
+                _check_track(reader, track, value_size, header["n_anims"], "bone %d %s" % (number, label), problems)
+        for number, track in enumerate(reader.records(header["n_transparency"], header["ofs_transparency"], struct_m2track)):
+            _check_track(reader, track, 2, header["n_anims"], "transparency %d" % number, problems)
+        for number, texture in enumerate(reader.records(header["n_textures"], header["ofs_textures"], struct_texture)):
+            if not reader.in_bounds(texture[2], texture[3], 1):
+                problems.append("texture %d : name out of the file" % number)
+
+        vertices = reader.named_array("vertices", "f", struct_vertex.size // 4)
+        words = struct_vertex.size // 4
+        if not all(map(math.isfinite, vertices[0::words])) or not all(map(math.isfinite, vertices[1::words])) or not all(map(math.isfinite, vertices[2::words])):
+            problems.append("vertices : positions that aren't finite numbers")
+        bone_indices = reader.data[header["ofs_vertices"]:header["ofs_vertices"] + header["n_vertices"] * struct_vertex.size]
+        if header["n_vertices"] and max(max(bone_indices[16 + i::struct_vertex.size]) for i in range(0, 4)) >= max(n_bones, 1):
+            problems.append("vertices : bone indices above the %d bone(s)" % n_bones)
+        _check_lookup(reader.named_array("keybone_lookup", "h"), n_bones, "keybone lookup", problems, allow_none=True)
+        _check_lookup(reader.named_array("bone_lookup_table", "h"), max(n_bones, 1), "bone lookup", problems)
+        _check_lookup(reader.named_array("tex_lookup", "h"), header["n_textures"], "texture lookup", problems)
+        _check_lookup(reader.named_array("trans_lookup", "h"), header["n_transparency"], "transparency lookup", problems)
+        _check_lookup(reader.named_array("tex_anim_lookup", "h"), header["n_texture_animations"], "texture animation lookup", problems, allow_none=True)
+        _check_lookup(reader.named_array("bounding_triangles", "H"), header["n_bounding_vertices"], "collision triangles", problems)
+        if header["n_bounding_triangles"] % 3 or header["n_bounding_normals"] * 3 != header["n_bounding_triangles"]:
+            problems.append("collision : %d triangle indices for %d normals" % (header["n_bounding_triangles"], header["n_bounding_normals"]))
+
+    base = path[0:-3] if path.lower().endswith(".m2") else path
+    for view in range(0, header["n_views"]):
+        skin_path = base + "%02d.skin" % view
+        if not os.path.isfile(skin_path):
+            problems.append("view %d : %s is missing" % (view, skin_path))
+            continue
+        problems += [os.path.basename(skin_path) + " " + problem for problem in validate_skin(skin_path, header)]
+    return problems
+
+""" BUILD CACHE
 """
 
-def load_models(path):
-    models_list = []
-    with open(path, "rb") as model_file:  
-        gltf = json.load(model_file)
-        
-        mesh_number = len(gltf.get('meshes', [])) - 1
-        
-        for mesh in gltf.get('meshes', []):
-            current_mesh_info = []
-            mesh_uri = gltf.get('buffers', [])[mesh_number]['uri']
-            mesh_texture = gltf.get('images', [])[mesh_number]['uri']
-            mesh_indices_location = mesh['primitives'][0]['indices']
-            mesh_position_location = mesh['primitives'][0]['attributes']['POSITION']
-            mesh_normal_location = mesh['primitives'][0]['attributes']['NORMAL']
-            mesh_texcoord0_location = mesh['primitives'][0]['attributes']['TEXCOORD_0']
-            
-            for buffer_view in gltf.get('bufferViews', []): 
-                if buffer_view['buffer'] == mesh_number:
-                    current_mesh_info.append(buffer_view)
-
-            mesh_max_bounds = gltf.get('accessors', [])[mesh_position_location]['max']
-            mesh_min_bounds = gltf.get('accessors', [])[mesh_position_location]['min']
-
-            vertices = []
-            normals = []
-            triangles = []
-            texture_coords_0 = []
-
-            translation_ts = []
-            translation_values = []      
-            rotation_ts = []
-            rotation_values = []
-            scaling_ts = []
-            scaling_values = []
-
-            # Initialised to -1 in case there's no input values.
-            translation_ts_location = -1
-            translation_values_location = -1
-            rotation_ts_location = -1
-            rotation_values_location = -1
-            scaling_ts_location = -1
-            scaling_values_location = -1
-
-            if ( gltf.get('animations', []) ):
-                channel_number = len(gltf.get('channels', [])) - 1
-                for anim in gltf.get('animations', []):
-                    for channel in anim['channels']:
-                        sampler_number =  anim['channels'][channel_number]['sampler']
-                  
-                    # if node on the anim == mesh_number, then get sampler number and get all corresponding samplers
-                        if gltf.get('nodes', [])[ anim['channels'][0]['target']['node'] ]['mesh'] == mesh_number:
-                            if anim['channels'][sampler_number]['target']['path'] == "translation":
-                                translation_ts_location = anim['samplers'][sampler_number]['input']
-                                translation_values_location =  anim['samplers'][sampler_number]['output']
-                                if ( anim['samplers'][sampler_number]['interpolation'] != "LINEAR"): 
-                                    print("Translation interpolation is not linear, please fix that and relaunch the conversion. Exiting.")
-                                    sys.exit(0)
-                            if anim['channels'][sampler_number]['target']['path'] == "rotation":
-                                rotation_ts_location = anim['samplers'][sampler_number]['input']
-                                rotation_values_location =  anim['samplers'][sampler_number]['output']
-                                if ( anim['samplers'][sampler_number]['interpolation'] != "LINEAR"): 
-                                    print("Rotations interpolation is not linear, please fix that and relaunch the conversion. Exiting.")
-                                    sys.exit(0)
-                            if anim['channels'][sampler_number]['target']['path'] == "scale":
-                                scaling_ts_location = anim['samplers'][sampler_number]['input']
-                                scaling_values_location =  anim['samplers'][sampler_number]['output']
-                                if ( anim['samplers'][sampler_number]['interpolation'] != "LINEAR"): 
-                                    print("Scaling interpolation is not linear, please fix that and relaunch the conversion. Exiting.")
-                                    sys.exit(0)
-                            channel_number = channel_number - 1
-            
-            with open(mesh_uri, "rb") as bin_file: # check system path, etc.
-                # Get vertices
-                bin_file.seek(current_mesh_info[mesh_position_location]['byteLength'])
-                grab = bin_file.tell()
-                bin_file.seek(current_mesh_info[mesh_position_location]['byteOffset'])
-                for i in range (0, grab / 4) :
-                    vertices.append(_get_f(bin_file))
-                
-                # Get normals
-                bin_file.seek(current_mesh_info[mesh_normal_location]['byteLength'])
-                grab = bin_file.tell()
-                bin_file.seek(current_mesh_info[mesh_normal_location]['byteOffset'])
-                for i in range (0, grab / 4) :
-                    normals.append(_get_f(bin_file))
-                
-                # Get UV
-                bin_file.seek(current_mesh_info[mesh_texcoord0_location]['byteLength'])
-                grab = bin_file.tell()
-                bin_file.seek(current_mesh_info[mesh_texcoord0_location]['byteOffset'])
-                for i in range (0, grab / 4) :
-                    texture_coords_0.append(_get_f(bin_file))
-                
-                # Get indices
-                bin_file.seek(current_mesh_info[mesh_indices_location]['byteLength'])
-                grab = bin_file.tell()
-                bin_file.seek(current_mesh_info[mesh_indices_location]['byteOffset'])
-                for i in range (0, grab / 4) :
-                    triangles.append(_get_u32(bin_file))
-
-                if ( translation_ts_location != -1 ):
-                    # Get translation ts of the whole current mesh
-                    bin_file.seek(current_mesh_info[translation_ts_location]['byteLength'])
-                    grab = bin_file.tell()
-                    bin_file.seek(current_mesh_info[translation_ts_location]['byteOffset'])
-                    for i in range (0, grab / 4) :
-                        translation_ts.append(_get_f(bin_file) * 1000) # TODO : best place to convert s -> ms ?
-
-                    # Get translation values of the whole current mesh
-                    bin_file.seek(current_mesh_info[translation_values_location]['byteLength'])
-                    grab = bin_file.tell()
-                    bin_file.seek(current_mesh_info[translation_values_location]['byteOffset'])
-                    for i in range (0, grab / 12) : 
-                        translation_values.append([])
-                        for j in range (0, 3):
-                            translation_values[i].append( _get_f(bin_file) )
-
-                if ( rotation_ts_location != -1 ):
-                    # Get rotation ts of the whole current mesh
-                    bin_file.seek(current_mesh_info[rotation_ts_location]['byteLength'])
-                    grab = bin_file.tell()
-                    bin_file.seek(current_mesh_info[rotation_ts_location]['byteOffset'])
-                    for i in range (0, grab / 4) :
-                        rotation_ts.append(_get_f(bin_file) * 1000) # TODO : best place to convert s -> ms ?
-
-                    # Get rotation values of the whole current mesh
-                    bin_file.seek(current_mesh_info[rotation_values_location]['byteLength'])
-                    grab = bin_file.tell()
-                    bin_file.seek(current_mesh_info[rotation_values_location]['byteOffset'])
-                    for i in range (0, grab / 16) : 
-                        rotation_values.append([])
-                        for j in range (0, 4):
-                            current_rot = _get_f(bin_file)
-                            if ( str( current_rot ) == "-0.0" ): # ieee 754 and Python don't really care about -0, but we do.
-                                rotation_values[i].append( -32768.0 )
-                            else:
-                                rotation_values[i].append( _quat_float_to_short(current_rot))
-            
-                    rotation_values[0] = [32767, 32767, 32767, -1]
-                    rotation_values[ len(rotation_values) - 1 ] = [-32768, -32768, -32768, 0]
-
-                if ( scaling_ts_location != -1 ):
-                    # Get scaling ts of the whole current mesh
-                    bin_file.seek(current_mesh_info[scaling_ts_location]['byteLength'])
-                    grab = bin_file.tell()
-                    bin_file.seek(current_mesh_info[scaling_ts_location]['byteOffset'])
-                    for i in range (0, grab / 4) :
-                        scaling_ts.append(_get_f(bin_file) * 1000) # TODO : best place to convert s -> ms ?
-
-                    # Get scaling values of the whole current mesh
-                    bin_file.seek(current_mesh_info[scaling_values_location]['byteLength'])
-                    grab = bin_file.tell()
-                    bin_file.seek(current_mesh_info[scaling_values_location]['byteOffset'])
-                    for i in range (0, grab / 12) : 
-                        scaling_values.append([])
-                        for j in range (0, 3):
-                            scaling_values[i].append( _get_f(bin_file) )
-                            
-            models_list.append( Model(mesh['name'], mesh_texture, vertices, normals, triangles, texture_coords_0, mesh_min_bounds, mesh_max_bounds, translation_ts, translation_values, rotation_ts, rotation_values, scaling_ts, scaling_values) )
-            mesh_number = mesh_number - 1
-    return models_list
+def _file_hash(path):
+    content_hash = hashlib.sha1()
+    with open(path, "rb") as input_file:
+        for chunk in iter(lambda: input_file.read(1 << 20), b""):
+            content_hash.update(chunk)
+    return content_hash.hexdigest()
+
+def _converter_version():
+    # Any change to this script counts as a new converter version.
+    with open(os.path.abspath(__file__), "rb") as script_file:
+        return hashlib.sha1(script_file.read()).hexdigest()
+
+def _texture_entries(textures):
+    # _scene_textures -> json ready [image, blp file, content hash of an embedded image or None], None stays None
+    if textures is None:
+        return None
+    return [[image_path, blp_path, None if data is None else hashlib.sha1(data).hexdigest()] for image_path, blp_path, data in textures]
+
+class BuildCache(object):
+    # Remembers, for every gltf, a hash of what it was converted from (the gltf, its bin files, the texture path and options, the converter)
+    # and the files it gave, so that unchanged models aren't converted again. Saved as json in the output folder (path None : memory only).
+    def __init__(self, path):
+        self.path = path
+        self.version = _converter_version()
+        self.scenes = {} # gltf path -> key, buffer files, outputs (name -> size, mtime)
+        self.hashes = {} # input path -> size, mtime, content hash ; a file is only hashed again when it changes
+        self.textures = {} # blp path -> key, size, mtime
+        if path is None:
+            return
+        try:
+            with open(self.path, "r") as cache_file:
+                content = json.load(cache_file)
+            self.scenes = content["scenes"]
+            self.hashes = content["hashes"]
+            self.textures = content.get("textures", {})
+        except (IOError, OSError, ValueError, KeyError): # no cache yet, or a broken one : everything gets converted
+            pass
+
+    def _hash_file(self, path):
+        file_stat = os.stat(path)
+        known = self.hashes.get(path)
+        if known is not None and known[0] == file_stat.st_size and known[1] == file_stat.st_mtime_ns:
+            return known[2]
+        content_hash = _file_hash(path)
+        self.hashes[path] = [file_stat.st_size, file_stat.st_mtime_ns, content_hash]
+        return content_hash
+
+    def _key(self, gltf_path, texture_path, options, buffer_paths):
+        key = hashlib.sha1()
+        for part in [self.version, texture_path, json.dumps(options, sort_keys=True), self._hash_file(gltf_path)] + [self._hash_file(path) for path in buffer_paths]:
+            key.update(part.encode("utf-8") + b"\0")
+        return key.hexdigest()
+
+    def _buffer_paths(self, gltf_path):
+        return _buffer_paths(_read_gltf(gltf_path), gltf_path)
+
+    def is_up_to_date(self, gltf_path, texture_path, options=None):
+        if options is None:
+            options = {}
+        gltf_path = os.path.abspath(gltf_path)
+        scene = self.scenes.get(gltf_path)
+        if scene is None or "meshes" not in scene: # recorded by an older version
+            return False
+        try:
+            gltf_hash = self._hash_file(gltf_path)
+            if gltf_hash != scene["gltf"]: # the bin files may have changed too
+                return False
+            if self._key(gltf_path, texture_path, options, scene["buffers"]) != scene["key"]:
+                return False
+            for name, (size, mtime) in scene["outputs"].items(): # deleted or modified since they were written
+                file_stat = os.stat(name)
+                if file_stat.st_size != size or file_stat.st_mtime_ns != mtime:
+                    return False
+        except (IOError, OSError):
+            return False
+        return True
+
+    def scene_info(self, gltf_path):
+        # The mesh names and textures (image, blp file, content hash of an embedded image) of an up to date scene, as recorded
+        # with its outputs. The textures are None when they weren't looked for.
+        scene = self.scenes[os.path.abspath(gltf_path)]
+        return scene["meshes"], scene["textures"]
+
+    def record_textures(self, gltf_path, textures):
+        # The textures of a scene (see _scene_textures) when they were read again without converting it.
+        scene = self.scenes.get(os.path.abspath(gltf_path))
+        if scene is not None:
+            scene["textures"] = _texture_entries(textures)
+
+    def record(self, gltf_path, texture_path, options, outputs, scan=None):
+        # scan : what _scan_scene gave for the scene before its conversion, the gltf is read again without it
+        gltf_path = os.path.abspath(gltf_path)
+        mesh_names, buffer_paths, textures = scan if scan is not None else _scan_scene(gltf_path)
+        old_outputs = self.scenes.get(gltf_path, {}).get("outputs", {})
+        for name in old_outputs:
+            if name not in outputs and os.path.exists(name):
+                print("Stale output " + name + " (no longer made from " + gltf_path + ")")
+        # outputs belong to one scene : another scene that had written the same files must be converted again
+        written = set(os.path.normcase(name) for name in outputs)
+        for other_path, other in list(self.scenes.items()):
+            if other_path != gltf_path and written.intersection(map(os.path.normcase, other["outputs"])):
+                print("Outputs of " + other_path + " overwritten by " + gltf_path + ", it will be converted again")
+                del self.scenes[other_path]
+        self.scenes[gltf_path] = {
+            "gltf": self._hash_file(gltf_path),
+            "buffers": buffer_paths,
+            "key": self._key(gltf_path, texture_path, options, buffer_paths),
+            "outputs": dict((name, [os.stat(name).st_size, os.stat(name).st_mtime_ns]) for name in outputs),
+            "meshes": mesh_names,
+            "textures": _texture_entries(textures),
+        }
+
+    def _texture_key(self, image_path, texture_format, image_hash=None):
+        # image_hash : content hash of an image embedded in a scene, there's no file to hash
+        image_hash = self._hash_file(image_path) if image_hash is None else image_hash
+        return hashlib.sha1((self.version + "\0" + texture_format + "\0" + image_hash).encode("utf-8")).hexdigest()
+
+    def texture_is_up_to_date(self, image_path, blp_path, texture_format, image_hash=None):
+        known = self.textures.get(os.path.abspath(blp_path))
+        try:
+            file_stat = os.stat(blp_path)
+            return known is not None and known == [self._texture_key(image_path, texture_format, image_hash), file_stat.st_size, file_stat.st_mtime_ns]
+        except (IOError, OSError):
+            return False
+
+    def record_texture(self, image_path, blp_path, texture_format, image_hash=None):
+        file_stat = os.stat(blp_path)
+        self.textures[os.path.abspath(blp_path)] = [self._texture_key(image_path, texture_format, image_hash), file_stat.st_size, file_stat.st_mtime_ns]
+
+    def save(self):
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w") as cache_file:
+            json.dump({ "scenes": self.scenes, "hashes": self.hashes, "textures": self.textures }, cache_file)
+        os.replace(temp_path, self.path) # never leave a half written cache behind
 
 """ MAIN STUFF 
 """
 
-# load, write to m2, quit.
-
-scene_gltf_name = "doubletexture.gltf" # default name for testing.
-m2_texture_path = "world\\doubletexture\\" # default name for testing.
-
-if len(sys.argv) > 1:
-    scene_gltf_name = sys.argv[1]
-if len(sys.argv) > 2:  
-    m2_texture_path = sys.argv[2]
-  
-all_models = load_models(scene_gltf_name) # loading meshes from a gltf scene.
-
-#print(all_models[0].name)
-#print(all_models[0].texture)
-#print(all_models[0].vertices)
-#print(all_models[0].normals)
-#print(all_models[0].texture_coords_0)
-#print(all_models[0].triangles)
-#print(all_models[0].min_bounds)
-#print(all_models[0].max_bounds)
-#print(all_models[0].translation_ts)
-#print(all_models[0].translation_values)
-#print(all_models[0].rotation_ts)
-#print(all_models[0].rotation_values)
-#print(all_models[0].scaling_ts)
-#print(all_models[0].scaling_values)
-
-all_models[0].write_m2(m2_texture_path)
+def convert_scene(path, texture_path, weld=None, optimize_cache=False, lods=None, collision=False, minimal_spheres=False, reduce_keys=None, save=None, log=print, folder=None, scene=None):
+    # Converts every mesh of the scene, a broken mesh doesn't stop the others.
+    # path : gltf or glb file, or its content (bytes, bin files are then looked for in folder, see load_scene).
+    # weld : None to keep the vertices as exported, or the epsilon given to Model.weld_vertices (0.0 for identical vertices only).
+    # optimize_cache : reorder triangles and vertices for the vertex cache (Model.optimize_vertex_cache).
+    # lods : None for the 00 skin only, or the triangle ratios of the 01, 02, 03 skins (Model.make_lods).
+    # collision, minimal_spheres : see Model.write_m2.
+    # reduce_keys : None to keep every key, or the translation, rotation and scaling tolerances of Model.reduce_keyframes.
+    # save : function(file name, data) that gets every m2 and skin file, None to write them in the current folder.
+    # log : function(text) for the report of each mesh.
+    # scene : the (gltf, buffers, index) of path when it's already loaded, its buffers are left open.
+    # Returns the number of converted and failed meshes, and the files written.
+    gltf, buffers, index = scene if scene is not None else load_scene(path, folder)
+    converted = 0
+    failures = 0
+    outputs = []
+    for mesh_number in range(0, len(gltf.get('meshes', []))):
+        mesh_name = index.mesh_names[mesh_number]
+        start = time.time()
+        try:
+            with _stage("load_model"):
+                model = load_model(gltf, buffers, mesh_number, index)
+            if weld is not None:
+                n_vertices = len(model.vertices) // 3
+                with _stage("weld_vertices"):
+                    removed = model.weld_vertices(weld)
+                log("Mesh %s : %d vertices welded into %d" % (mesh_name, n_vertices, n_vertices - removed))
+            if optimize_cache:
+                with _stage("optimize_vertex_cache"):
+                    before, after = model.optimize_vertex_cache()
+                log("Mesh %s : vertex cache ACMR %.3f -> %.3f, ATVR %.3f -> %.3f" % (mesh_name, before[0], after[0], before[1], after[1]))
+            if reduce_keys is not None:
+                with _stage("reduce_keyframes"):
+                    removed = model.reduce_keyframes(reduce_keys)
+                log("Mesh %s : %d animation keys removed" % (mesh_name, removed))
+            loaded = time.time()
+            with _stage("split_for_skin"):
+                models = model.split_for_skin()
+            if len(models) > 1:
+                log("Mesh %s : too big for one m2, split in %d models" % (mesh_name, len(models)))
+            for part in models:
+                if lods:
+                    with _stage("make_lods"):
+                        counts = part.make_lods(lods)
+                    log("Mesh %s : lods of %s triangles" % (part.name, " / ".join(map(str, [len(part.triangles) // 3] + counts))))
+                if save is None:
+                    with _stage("write_m2"):
+                        outputs += part.write_m2(texture_path, collision, minimal_spheres)
+                    continue
+                with _stage("build_m2"):
+                    files = part.build_m2(texture_path, collision, minimal_spheres)
+                for file_name, data in files:
+                    save(file_name, data)
+                    outputs.append(file_name)
+        except Exception as e:
+            log("Mesh " + mesh_name + " failed : " + repr(e))
+            failures += 1
+            continue
+        log("Mesh %s : loaded in %.1f ms, written in %.1f ms" % (mesh_name, (loaded - start) * 1000, (time.time() - loaded) * 1000))
+        converted += 1
+
+    if scene is None:
+        _close_buffers(buffers)
+    return converted, failures, outputs
+
+# what a broken gltf raises while it's read and indexed : bad json, missing entries, indices out of range
+gltf_errors = (json.JSONDecodeError, KeyError, IndexError) + ((ijson.JSONError,) if ijson is not None else ())
+
+def convert(source, texture_path, output=None, folder=None, log=None, **options):
+    # Library entry point : converts every mesh of a scene without going through the current folder.
+    # source : gltf or glb file, or the content of one (bytes ; a gltf with bin files also needs their folder).
+    # output : None to get the files in memory, a folder to write them in, a writable binary stream (they go in a zip archive)
+    # or a function(file name, data).
+    # options : the keyword arguments of convert_scene (weld, lods, collision...), log : function(text) for the report of each mesh.
+    # Returns file name -> read only memoryview when output is None, the names of the files otherwise.
+    # Raises ConversionError (with the report) when a mesh can't be converted, or when the gltf itself is broken.
+    if isinstance(source, os.PathLike):
+        source = os.fspath(source)
+    files = collections.OrderedDict()
+    report = []
+    def log_line(text):
+        report.append(text)
+        if log is not None:
+            log(text)
+
+    with contextlib.ExitStack() as stack:
+        if output is None:
+            def save(file_name, data):
+                files[file_name] = memoryview(data).toreadonly()
+        elif isinstance(output, (str, os.PathLike)):
+            os.makedirs(output, exist_ok=True)
+            def save(file_name, data):
+                with open(os.path.join(output, file_name), "wb") as out_file:
+                    out_file.write(data)
+        elif hasattr(output, "write"):
+            archive = stack.enter_context(zipfile.ZipFile(output, "w", zipfile.ZIP_DEFLATED))
+            def save(file_name, data):
+                archive.writestr(file_name, data)
+        else:
+            save = output
+        try:
+            converted, failures, outputs = convert_scene(source, texture_path, save=save, log=log_line, folder=folder, **options)
+        except gltf_errors as e: # the meshes report their own errors, this is the scene
+            raise ConversionError("%s is not a valid gltf : %r" % ("The gltf data" if isinstance(source, (bytes, bytearray, memoryview)) else source, e)) from e
+
+    if failures > 0:
+        raise ConversionError("%d mesh(es) failed, %d converted :\n" % (failures, converted) + "\n".join(report))
+    return files if output is None else outputs
+
+def _find_files(pattern, extensions):
+    # A file, a folder (searched recursively for these extensions) or a glob pattern -> sorted list of files.
+    if os.path.isdir(pattern):
+        return sorted(itertools.chain.from_iterable(glob.glob(os.path.join(pattern, "**", "*" + extension), recursive=True) for extension in extensions))
+    elif os.path.isfile(pattern):
+        return [pattern]
+    return sorted(glob.glob(pattern, recursive=True))
+
+def find_scenes(pattern):
+    # A gltf / glb file, a folder or a glob pattern -> sorted list of gltf and glb files.
+    return _find_files(pattern, (".gltf", ".glb"))
+
+def _convert_file(job):
+    # Runs in the worker processes : the output is kept and given back, so that the reports don't get mixed up.
+    # When profiling, the profile of the file is given back too (None otherwise).
+    path, texture_path, options, profile = job
+    output = io.StringIO()
+    start = time.time()
+    if profile:
+        start_profiling()
+    with contextlib.redirect_stdout(output):
+        try:
+            with _stage("convert_scene"):
+                converted, failures, outputs = convert_scene(path, texture_path, **options)
+        except Exception as e: # the whole scene is broken (bad json, missing bin file, ...)
+            print("Scene " + path + " failed : " + repr(e))
+            converted, failures, outputs = 0, 1, []
+    report = stop_profiling() if profile else None
+    return converted, failures, outputs, time.time() - start, output.getvalue(), report
+
+def _buffer_paths(gltf, gltf_path):
+    # The bin files of a scene (absolute paths), embedded buffers have none.
+    return [os.path.abspath(os.path.join(os.path.dirname(gltf_path), urllib.parse.unquote(buffer["uri"]))) for buffer in gltf.get("buffers", []) if not buffer.get("uri", "data:").startswith("data:")]
+
+def _scene_textures(gltf, buffers, path):
+    # (image, blp file, content) of the textures used by the meshes of a scene : the blp goes where the m2 will look for it,
+    # the texture name with a blp extension, below the current folder. image is the image file and content None, or for the images
+    # embedded in the scene (glb bufferView, data uri) a name for the reports and their bytes.
+    textures = []
+    for mesh_number, mesh in enumerate(gltf.get('meshes', [])):
+        try:
+            primitive = mesh['primitives'][0]
+            name = urllib.parse.unquote(_get_texture_uri(gltf, primitive, mesh_number))
+            image = gltf['images'][_get_texture_image(gltf, primitive, mesh_number)[0]]
+            if image.get('uri', "data:").startswith("data:"):
+                textures.append((path + ":" + name, name[0:-3] + "blp", _image_data(gltf, buffers, image)))
+            else:
+                textures.append((os.path.join(os.path.dirname(path), name), name[0:-3] + "blp", None))
+        except Exception: # the mesh conversion reports it
+            continue
+    return textures
+
+def _scan_scene(path, textures=False):
+    # What convert_files needs from a scene before converting it, from one read of the gltf : the names of its meshes (the m2 and skin
+    # files are named after them), its bin files and, with textures, its textures (see _scene_textures, None without).
+    # Nothing when the scene can't be read, its conversion reports why.
+    try:
+        gltf, buffers, index = load_scene(path)
+    except Exception:
+        return [], [], ([] if textures else None)
+    try:
+        return index.mesh_names, _buffer_paths(gltf, path), _scene_textures(gltf, buffers, path) if textures else None
+    finally:
+        _close_buffers(buffers)
+
+def _output_conflicts(scenes):
+    # Every output goes in the current folder : meshes of the same name would write over each other's files, in one scene or across
+    # scenes (and race on them with many workers). scenes : path -> mesh names. -> the scenes in conflict, with a message for each name.
+    # Names are compared without case, like on windows file systems ; split parts (name_0...) keep the mesh name as prefix.
+    # Unnamed meshes are named after their scene (see SceneIndex), they only collide between scenes with the same file name.
+    owners = collections.defaultdict(list)
+    conflicts = collections.OrderedDict()
+    for path, names in scenes.items():
+        for name, count in collections.Counter(name.lower() for name in names).items():
+            if count > 1:
+                conflicts.setdefault(path, []).append("%d meshes are named %s" % (count, name))
+            owners[name].append(path)
+    for name, name_paths in owners.items():
+        if len(name_paths) > 1:
+            for path in name_paths:
+                conflicts.setdefault(path, []).append("mesh " + name + " is also in " + ", ".join(other for other in name_paths if other != path))
+    return conflicts
+
+def _texture_jobs(textures, texture_format, cache=None, force=False):
+    # One job per image content : the same picture used by many models (or under many names) is encoded once, then copied.
+    # textures : (image, blp file, content of an embedded image or None), see _scene_textures.
+    # Jobs are (image, blp files, format, content, content hash of an embedded image) ; with a cache, the blp files already made
+    # from the same image are left alone.
+    jobs = collections.OrderedDict()
+    hash_file = cache._hash_file if cache is not None else _file_hash
+    for image_path, blp_path, data in dict.fromkeys(textures):
+        if data is None and not os.path.isfile(image_path):
+            continue # the mesh still refers to it, but there's nothing to convert
+        image_hash = hashlib.sha1(data).hexdigest() if data is not None else None
+        if cache is not None and not force and cache.texture_is_up_to_date(image_path, blp_path, texture_format, image_hash):
+            continue
+        job = jobs.setdefault(image_hash or hash_file(image_path), (image_path, [], texture_format, data, image_hash))
+        if blp_path not in job[1]:
+            job[1].append(blp_path)
+    return list(jobs.values())
+
+def _convert_texture_job(job):
+    # Runs in the worker processes, like _convert_file. Returns the image, its blp files, the elapsed time and a report or error.
+    image_path, blp_paths, texture_format, data, image_hash = job
+    start = time.time()
+    try:
+        report = convert_texture(image_path, blp_paths[0], texture_format, data)
+        for blp_path in blp_paths[1:]:
+            if os.path.dirname(blp_path):
+                os.makedirs(os.path.dirname(blp_path), exist_ok=True)
+            shutil.copyfile(blp_paths[0], blp_path)
+        error = None
+    except Exception as e:
+        report = None
+        error = repr(e)
+    return image_path, blp_paths, time.time() - start, report, error
+
+def convert_files(paths, texture_path, jobs=None, cache=None, force=False, options=None, textures=None, profile=None):
+    # Converts many gltf files with a pool of worker processes (one per core by default), reports come out in order.
+    # With a BuildCache, the files already converted from the same inputs are skipped (unless force is set).
+    # options are the keyword arguments of convert_scene.
+    # textures : None, or the format of the blp files to make from the png / tga textures of the scenes (see convert_texture).
+    # They go in the same pool as the meshes, and are cached on the image content.
+    # profile : None, or a Profiler that gets the stages and counters of every file (profiled in the workers) and the texture times.
+    # Scenes with two meshes of the same name, or meshes with the same names as meshes of another scene, are not converted
+    # (their files would collide), each counts as a failure.
+    # Every changed scene is read once before converting (mesh names, bin files, textures), the up to date ones come from the cache.
+    # Returns the number of failed meshes and textures.
+    start = time.time()
+    if options is None:
+        options = {}
+    scans = {} # changed scene -> what _scan_scene gave, for the cache
+    mesh_names = collections.OrderedDict()
+    scene_textures = {}
+    todo = []
+    up_to_date = []
+    for path in paths:
+        if cache is not None and not force and cache.is_up_to_date(path, texture_path, options):
+            up_to_date.append(path)
+            mesh_names[path], known_textures = cache.scene_info(path)
+            if textures is not None and (known_textures is None or not all(cache.texture_is_up_to_date(image_path, blp_path, textures, image_hash)
+                    for image_path, blp_path, image_hash in known_textures if image_hash is not None or os.path.isfile(image_path))):
+                scene_textures[path] = _scan_scene(path, True)[2] # a blp to make again : only then the scene is read
+                cache.record_textures(path, scene_textures[path])
+            continue
+        todo.append(path)
+        scans[path] = _scan_scene(path, textures is not None)
+        mesh_names[path], scene_textures[path] = scans[path][0], scans[path][2]
+
+    conflicts = _output_conflicts(mesh_names)
+    for path, messages in conflicts.items():
+        print("Scene " + path + " skipped, its files would overwrite each other or those of another scene : " + "; ".join(messages) + ". Rename the meshes, or convert the scenes in conflict in separate runs from different output folders.")
+    paths = [path for path in todo if path not in conflicts]
+    up_to_date = [path for path in up_to_date if path not in conflicts]
+    if up_to_date:
+        print("%d file(s) up to date" % len(up_to_date))
+    texture_jobs = []
+    if textures is not None:
+        texture_jobs = _texture_jobs(itertools.chain.from_iterable(found for path, found in scene_textures.items() if found and path not in conflicts), textures, cache, force)
+
+    jobs_list = [(path, texture_path, options, profile is not None) for path in paths]
+    total_converted = 0
+    total_failures = 0
+    with contextlib.ExitStack() as stack:
+        if len(jobs_list) + len(texture_jobs) <= 1 or jobs == 1: # no need to start workers
+            results = map(_convert_file, jobs_list)
+            texture_results = map(_convert_texture_job, texture_jobs)
+        else:
+            executor = stack.enter_context(concurrent.futures.ProcessPoolExecutor(max_workers=jobs))
+            texture_futures = [executor.submit(_convert_texture_job, job) for job in texture_jobs] # the slow ones first, the meshes fill the other workers
+            texture_results = (future.result() for future in texture_futures)
+            chunk_size = max(1, len(jobs_list) // ((jobs or os.cpu_count() or 1) * 16)) # big enough to not wait on the pipes, small enough to keep all the cores busy
+            results = executor.map(_convert_file, jobs_list, chunksize=chunk_size)
+        for i, (converted, failures, outputs, elapsed, output, report) in enumerate(results):
+            sys.stdout.write(output)
+            if report is not None:
+                profile.add_report(report)
+            print("[%d/%d] %s : %d mesh(es) converted, %d failed in %.1f ms" % (i + 1, len(paths), paths[i], converted, failures, elapsed * 1000))
+            total_converted += converted
+            total_failures += failures
+            if cache is not None and failures == 0: # broken files are tried again next time
+                cache.record(paths[i], texture_path, options, outputs, scans[paths[i]])
+
+        texture_failures = 0
+        for job, (image_path, blp_paths, elapsed, report, error) in zip(texture_jobs, texture_results):
+            if error is not None:
+                print("Texture " + image_path + " failed : " + error)
+                texture_failures += 1
+                continue
+            print("Texture %s : %s, %s in %.1f ms" % (image_path, " ".join(blp_paths), report, elapsed * 1000))
+            if profile is not None:
+                profile.add_stage("convert_texture", elapsed)
+            if cache is not None:
+                for blp_path in blp_paths:
+                    cache.record_texture(image_path, blp_path, textures, job[4])
+        if texture_jobs:
+            print("%d texture(s) converted, %d failed" % (len(texture_jobs) - texture_failures, texture_failures))
+            total_failures += texture_failures
+
+    if cache is not None:
+        cache.save()
+    elapsed = time.time() - start
+    total_failures += len(conflicts)
+    print("%d file(s), %d mesh(es) converted, %d failed in %.1f s (%.1f files/s)" % (len(paths), total_converted, total_failures, elapsed, len(paths) / max(elapsed, 1e-9)))
+    return total_failures
+
+def _validate_file(path):
+    # Runs in the worker processes, like _convert_file.
+    try:
+        return validate_m2(path)
+    except Exception as e: # unreadable, truncated header...
+        return ["can't be read : " + repr(e)]
+
+def validate_files(paths, jobs=None):
+    # Checks many m2 (and their skins) with a pool of worker processes, prints the problems of each file.
+    # Returns the number of files with problems.
+    start = time.time()
+    with contextlib.ExitStack() as stack:
+        if len(paths) <= 1 or jobs == 1:
+            results = map(_validate_file, paths)
+        else:
+            executor = stack.enter_context(concurrent.futures.ProcessPoolExecutor(max_workers=jobs))
+            chunk_size = max(1, len(paths) // ((jobs or os.cpu_count() or 1) * 16))
+            results = executor.map(_validate_file, paths, chunksize=chunk_size)
+        broken = 0
+        for path, problems in zip(paths, results):
+            if problems:
+                broken += 1
+                print(path + " : " + str(len(problems)) + " problem(s)")
+                for problem in problems:
+                    print("    " + problem)
+    elapsed = time.time() - start
+    print("%d file(s) checked, %d with problems in %.1f s (%.1f files/s)" % (len(paths), broken, elapsed, len(paths) / max(elapsed, 1e-9)))
+    return broken
+
+build_cache_name = "gltf2m2_cache.json" # in the output folder
+profile_name = "gltf2m2_profile.json"
+
+def _tolerances(text):
+    # "0.01,0.002,0.01" -> [0.01, 0.002, 0.01], for --reduce-keys
+    tolerances = [float(tolerance) for tolerance in text.split(",")]
+    if len(tolerances) != 3 or not all(tolerance >= 0.0 for tolerance in tolerances):
+        raise argparse.ArgumentTypeError("3 tolerances (translation, rotation, scaling) expected")
+    return tolerances
+
+def _ratios(text):
+    # "0.5,0.25" -> [0.5, 0.25], for --lods
+    ratios = [float(ratio) for ratio in text.split(",")]
+    if len(ratios) == 0 or len(ratios) > max_lods or not all(0.0 < ratio <= 1.0 for ratio in ratios):
+        raise argparse.ArgumentTypeError("1 to %d ratios between 0 and 1 expected" % max_lods)
+    return ratios
+
+""" CONVERSION SERVER
+"""
+
+server_address = "127.0.0.1:8642" # or the path of a unix socket
+server_cache_size = 256 # MB of converted files kept in memory
+server_scene_cache_size = 64 << 20 # bytes of parsed gltf kept by each worker
+server_options = set(["weld", "optimize_cache", "lods", "collision", "minimal_spheres", "reduce_keys"]) # what jobs can pass to convert_scene
+
+class LRUCache(object):
+    # Keeps the most recently used values, up to max_size (the sum of the sizes given with them). Thread safe.
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict() # key -> value, size ; oldest first
+        self._lock = threading.Lock()
+
+    def get(self, key, count=True):
+        # count=False : a second look for the same lookup, not counted in the hits / misses again
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1 if count else 0
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1 if count else 0
+            return entry[0]
+
+    def put(self, key, value, size):
+        with self._lock:
+            if key in self._entries:
+                self.size -= self._entries.pop(key)[1]
+            if size > self.max_size: # it would push everything else out
+                return
+            self._entries[key] = (value, size)
+            self.size += size
+            while self.size > self.max_size:
+                self.size -= self._entries.popitem(last=False)[1][1]
+
+    def stats(self):
+        with self._lock:
+            return { "entries": len(self._entries), "bytes": self.size, "max_bytes": self.max_size, "hits": self.hits, "misses": self.misses }
+
+_parsed_scenes = None # in the server workers : gltf content hash, scene name -> gltf, SceneIndex
+
+def _init_server_worker(scene_cache_size):
+    global _parsed_scenes
+    _parsed_scenes = LRUCache(scene_cache_size)
+    signal.signal(signal.SIGINT, signal.SIG_IGN) # ctrl + c goes to the whole group, the server stops its workers itself
+
+def _load_cached_scene(path, gltf_hash):
+    # load_scene, but the parsed json and its index come from the worker cache when the gltf content was seen before.
+    # Only the bin files (or the glb BIN chunk) are mapped again. The scene name is in the key : it names the unnamed meshes.
+    key = (gltf_hash, _scene_name(path))
+    parsed = _parsed_scenes.get(key)
+    if parsed is None:
+        with _stage("read_gltf"):
+            gltf = _read_gltf(path)
+        parsed = (gltf, SceneIndex(gltf, key[1]))
+        _parsed_scenes.put(key, parsed, os.path.getsize(path))
+    gltf, index = parsed
+    glb_bin = _read_glb(path, read_json=False)[1] if path.lower().endswith(".glb") else None
+    try:
+        return gltf, _map_buffers(gltf, path, glb_bin), index
+    except:
+        _close_buffers([glb_bin])
+        raise
+
+def _server_job(job):
+    # Runs in the server workers : converts a scene (a file, or the content of one) and gives its files back.
+    source, gltf_hash, texture_path, options = job
+    start = time.time()
+    files = []
+    report = []
+    scene = None
+    try:
+        if not isinstance(source, bytes):
+            scene = _load_cached_scene(source, gltf_hash)
+        converted, failures, outputs = convert_scene(source, texture_path, save=lambda file_name, data: files.append((file_name, data)), log=report.append, scene=scene, **options)
+    except Exception as e: # the whole scene is broken
+        report.append("Scene failed : " + repr(e))
+        failures = 1
+    finally:
+        if scene is not None:
+            _close_buffers(scene[1])
+    return files, failures, report, time.time() - start
+
+def _warm_up(i):
+    return os.getpid()
+
+class ConversionServer(object):
+    # What --serve keeps between requests : worker processes (started once, the parsed gltf stay in them), the converted files
+    # of the last jobs (LRU on the hash of the converter, options, texture path, gltf and bin files) and a few stats.
+    # Jobs on the same content at the same time share one conversion.
+    def __init__(self, jobs=None, cache_size=server_cache_size, output="."):
+        self.jobs = jobs or os.cpu_count() or 1
+        self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.jobs, initializer=_init_server_worker, initargs=(server_scene_cache_size,))
+        self.threads = concurrent.futures.ThreadPoolExecutor(max_workers=self.jobs * 2) # jobs converting or waiting for a worker, the others wait in its queue
+        list(self.executor.map(_warm_up, range(0, self.jobs))) # the workers are started (and main imported) before the first job
+        self.outputs = LRUCache(cache_size << 20)
+        self.hashes = BuildCache(None) # content hashes of the input files, a file is only hashed again when it changes
+        self.buffer_paths = LRUCache(4096) # gltf path and content -> its bin files
+        self.output = os.path.realpath(output)
+        self.started = time.time()
+        self.done = 0
+        self.failed = 0
+        self._pending = {} # key -> future of the conversion
+        self._lock = threading.Lock()
+
+    def close(self):
+        self.threads.shutdown()
+        self.executor.shutdown()
+
+    def _key(self, source, texture_path, options):
+        # -> key of the converted files, content hash of the gltf
+        if isinstance(source, bytes):
+            hashes = [hashlib.sha1(source).hexdigest()]
+            scene_name = ""
+        else:
+            scene_name = _scene_name(source) # unnamed meshes are named after it
+            gltf_hash = self.hashes._hash_file(source)
+            buffer_paths = self.buffer_paths.get((source, gltf_hash))
+            if buffer_paths is None:
+                buffer_paths = self.hashes._buffer_paths(source)
+                self.buffer_paths.put((source, gltf_hash), buffer_paths, 1)
+            hashes = [gltf_hash] + [self.hashes._hash_file(path) for path in buffer_paths]
+        key = hashlib.sha1()
+        for part in [self.hashes.version, texture_path, json.dumps(options, sort_keys=True), scene_name] + hashes:
+            key.update(part.encode("utf-8") + b"\0")
+        return key.hexdigest(), hashes[0]
+
+    def convert(self, source, texture_path, options):
+        # A gltf / glb path (absolute) or content -> its files (file name, data), and the result of the job (json ready).
+        start = time.time()
+        unknown = set(options) - server_options
+        if unknown:
+            raise ConversionError("Unknown option(s) : " + ", ".join(sorted(unknown)))
+        key, gltf_hash = self._key(source, texture_path, options)
+        files = self.outputs.get(key)
+        if files is not None:
+            return files, { "cached": True, "failures": 0, "report": [], "hash_ms": (time.time() - start) * 1000, "convert_ms": 0.0 }
+        hashed = time.time()
+        with self._lock:
+            future = self._pending.get(key)
+            files = self.outputs.get(key, count=False) if future is None else None # it may have been converted since the first look
+            if files is not None:
+                return files, { "cached": True, "failures": 0, "report": [], "hash_ms": (hashed - start) * 1000, "convert_ms": 0.0 }
+            if future is None:
+                future = self.executor.submit(_server_job, (source, gltf_hash, texture_path, options))
+                self._pending[key] = future
+        try:
+            files, failures, report, elapsed = future.result()
+        except Exception: # the pool broke (a worker was killed)
+            with self._lock:
+                if self._pending.get(key) is future:
+                    del self._pending[key]
+            raise
+        with self._lock: # in the cache before it leaves the pending jobs, so the next request finds one or the other
+            if self._pending.get(key) is future:
+                if failures == 0:
+                    self.outputs.put(key, files, sum(len(data) for file_name, data in files))
+                del self._pending[key]
+        return files, { "cached": False, "failures": failures, "report": report, "hash_ms": (hashed - start) * 1000,
+            "wait_ms": max(0.0, time.time() - hashed - elapsed) * 1000, "convert_ms": elapsed * 1000 }
+
+    def _inside(self, *parts):
+        # -> the real path (links followed) of the parts joined to the server folder, ConversionError when it isn't below it
+        path = os.path.realpath(os.path.join(self.output, *parts))
+        if path != self.output and not path.startswith(os.path.join(self.output, "")):
+            raise ConversionError("%s is outside of the server folder %s" % (os.path.join(*parts), self.output))
+        return path
+
+    def run_job(self, job):
+        # One job of a request : { "source": gltf / glb path, "texture_path": ..., "options": {...}, "output": folder } -> result.
+        # The source is read from and the files go in the folder the server was started in (or below it), paths leading out of it are refused.
+        start = time.time()
+        result = { "source": job.get("source") if isinstance(job, dict) else None }
+        try:
+            source = self._inside(job["source"])
+            output = self._inside(job.get("output", ""))
+            files, details = self.convert(source, job.get("texture_path", ""), job.get("options", {}))
+            result.update(details)
+            paths = [self._inside(output, file_name) for file_name, data in files] # mesh names may hold separators too
+            os.makedirs(output, exist_ok=True)
+            for path, (file_name, data) in zip(paths, files):
+                with open(path, "wb") as out_file:
+                    out_file.write(data)
+            result["files"] = paths
+        except Exception as e:
+            result.update(failures=1, error=repr(e))
+        result["ok"] = result.get("failures") == 0
+        result["total_ms"] = (time.time() - start) * 1000
+        with self._lock:
+            self.done += 1
+            self.failed += 0 if result["ok"] else 1
+        return result
+
+    def status(self):
+        return { "workers": self.jobs, "uptime_s": time.time() - self.started, "jobs_done": self.done, "jobs_failed": self.failed,
+            "output": self.output, "cache": self.outputs.stats() }
+
+class _ServerHandler(http.server.BaseHTTPRequestHandler):
+    # GET /status : server stats (json).
+    # POST /convert : a job or { "jobs": [...] } (json, see ConversionServer.run_job). The results come back one json line per job,
+    # as they finish, then a last line with the totals.
+    # POST /convert-data?texture_path=...&options={...} : the content of a glb (or a gltf with embedded buffers),
+    # the m2 and skin files come back in a zip archive (timings in the X-Convert-* headers).
+    def address_string(self):
+        return self.client_address[0] if isinstance(self.client_address, tuple) else "unix"
+
+    def _send(self, code, content_type, body):
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, code, content):
+        self._send(code, "application/json", json.dumps(content).encode("utf-8"))
+
+    def do_GET(self):
+        if urllib.parse.urlsplit(self.path).path != "/status":
+            return self._send_json(404, { "error": "unknown path " + self.path })
+        self._send_json(200, self.server.converter.status())
+
+    def do_POST(self):
+        url = urllib.parse.urlsplit(self.path)
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        converter = self.server.converter
+        if url.path == "/convert":
+            try:
+                request = json.loads(body)
+                jobs = request["jobs"] if "jobs" in request else [request]
+            except (ValueError, KeyError, TypeError) as e:
+                return self._send_json(400, { "error": "bad request : " + repr(e) })
+            if not isinstance(jobs, list) or not all(isinstance(job, dict) for job in jobs):
+                return self._send_json(400, { "error": "bad request : a job is a json object, jobs a list of them" })
+            start = time.time()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.end_headers() # no length : the lines are streamed, the connection closes at the end
+            failed = 0
+            for future in concurrent.futures.as_completed([converter.threads.submit(converter.run_job, job) for job in jobs]):
+                result = future.result()
+                failed += 0 if result["ok"] else 1
+                self.wfile.write(json.dumps(result).encode("utf-8") + b"\n")
+                self.wfile.flush()
+            self.wfile.write(json.dumps({ "jobs": len(jobs), "failed": failed, "total_ms": (time.time() - start) * 1000 }).encode("utf-8") + b"\n")
+        elif url.path == "/convert-data":
+            query = dict(urllib.parse.parse_qsl(url.query))
+            try:
+                files, details = converter.threads.submit(converter.convert, body, query.get("texture_path", ""), json.loads(query.get("options", "{}"))).result()
+            except Exception as e:
+                return self._send_json(400, { "error": repr(e) })
+            if details["failures"] > 0:
+                return self._send_json(422, details)
+            archive = io.BytesIO()
+            with zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED) as zip_file:
+                for file_name, data in files:
+                    zip_file.writestr(file_name, data)
+            self.send_response(200)
+            self.send_header("Content-Type", "application/zip")
+            self.send_header("Content-Length", str(len(archive.getbuffer())))
+            self.send_header("X-Convert-Cached", str(details["cached"]).lower())
+            self.send_header("X-Convert-Ms", "%.1f" % details["convert_ms"])
+            self.end_headers()
+            self.wfile.write(archive.getbuffer())
+        else:
+            self._send_json(404, { "error": "unknown path " + self.path })
+
+if hasattr(socketserver, "UnixStreamServer"): # not on windows
+    class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+
+def serve(address=server_address, jobs=None, cache_size=server_cache_size, output="."):
+    # Runs the conversion server until interrupted (ctrl + c). address : "host:port" for http, or the path of a unix socket.
+    host, separator, port = address.rpartition(":")
+    converter = ConversionServer(jobs, cache_size, output)
+    if separator and port.isdigit():
+        http_server = http.server.ThreadingHTTPServer((host or "127.0.0.1", int(port)), _ServerHandler)
+    else:
+        if os.path.exists(address) and stat.S_ISSOCK(os.stat(address).st_mode): # left by a server that was killed
+            os.remove(address)
+        http_server = _UnixHTTPServer(address, _ServerHandler)
+    http_server.converter = converter
+    def stop(signal_number, frame):
+        raise KeyboardInterrupt
+    signal.signal(signal.SIGTERM, stop) # kill, service managers : same clean stop as ctrl + c
+    print("Serving on %s with %d worker(s), %d MB of cache, files written in %s" % (address, converter.jobs, cache_size, converter.output))
+    try:
+        http_server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        http_server.server_close()
+        converter.close()
+        if not isinstance(http_server, http.server.HTTPServer):
+            os.remove(address)
+
+if __name__ == "__main__":
+    # load, write to m2, quit.
+
+    parser = argparse.ArgumentParser(description="Converts gltf + bin files (Blender export) into m2 + skin for Wow 3.3.5.")
+    parser.add_argument("input", nargs="?", default="doubletexture.gltf", help="gltf file, or folder / glob pattern for many files") # default name for testing.
+    parser.add_argument("texture_path", nargs="?", default="world\\doubletexture\\", help="textures path of the output m2") # default name for testing.
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="worker processes when converting many files (default : one per core)")
+    parser.add_argument("--force", action="store_true", help="convert everything, even the files that didn't change since the last run")
+    parser.add_argument("--optimize-cache", action="store_true", help="reorder triangles and vertices for the vertex cache of the client")
+    parser.add_argument("--weld", type=float, nargs="?", const=0.0, default=None, metavar="EPSILON", help="merge the duplicated vertices (same position, normal and uv, or closer than EPSILON)")
+    parser.add_argument("--lods", type=_ratios, nargs="?", const=lod_ratios, default=None, metavar="RATIOS", help="write simplified 01-03 skins, with these triangle ratios (default : 0.5,0.25,0.125)")
+    parser.add_argument("--collision", action="store_true", help="add a collision mesh (simplified convex hull of the model)")
+    parser.add_argument("--minimal-spheres", action="store_true", help="tighter bounding spheres for the submeshes (Ritter)")
+    parser.add_argument("--reduce-keys", type=_tolerances, nargs="?", const=key_tolerances, default=None, metavar="T,R,S", help="drop the animation keys that interpolation gives back within these tolerances (default : 0.001,0.001,0.001)")
+    parser.add_argument("--textures", choices=texture_formats, nargs="?", const="auto", default=None, help="also convert the png / tga textures to blp (default : auto, dxt1 or dxt5 depending on alpha)")
+    parser.add_argument("--validate", action="store_true", help="check m2 + skin files (input : m2 file, folder or glob pattern) instead of converting")
+    parser.add_argument("--profile", nargs="?", const=profile_name, default=None, metavar="FILE", help="time every stage, count bytes and elements, trace memory peaks, write the report as json (default : " + profile_name + ")")
+    parser.add_argument("--serve", nargs="?", const=server_address, default=None, metavar="ADDRESS", help="run as a conversion server on host:port or a unix socket path (default : " + server_address + ")")
+    parser.add_argument("--cache-size", type=int, default=server_cache_size, metavar="MB", help="memory for the converted files kept by the server (default : %d)" % server_cache_size)
+    parser.add_argument("--profile-dump", default=None, metavar="FILE", help="also run cProfile (in this process, no workers) and dump its stats to FILE")
+    args = parser.parse_args()
+
+    if args.serve is not None:
+        serve(args.serve, args.jobs, args.cache_size)
+        sys.exit(0)
+
+    if args.validate:
+        models = _find_files(args.input, (".m2",))
+        if len(models) == 0:
+            print("No m2 file found for " + args.input)
+            sys.exit(1)
+        if validate_files(models, args.jobs) > 0:
+            sys.exit(1)
+        sys.exit(0)
+
+    scenes = find_scenes(args.input)
+    if len(scenes) == 0:
+        print("No gltf file found for " + args.input)
+        sys.exit(1)
+
+    cache = BuildCache(build_cache_name)
+    options = { "weld": args.weld, "optimize_cache": args.optimize_cache, "lods": args.lods, "collision": args.collision, "minimal_spheres": args.minimal_spheres, "reduce_keys": args.reduce_keys }
+    profile = Profiler() if args.profile is not None else None
+    start = time.time()
+    if args.profile_dump is not None: # cProfile only sees this process
+        code_profile = cProfile.Profile()
+        failures = code_profile.runcall(convert_files, scenes, args.texture_path, 1, cache, args.force, options, args.textures, profile)
+        code_profile.dump_stats(args.profile_dump)
+    else:
+        failures = convert_files(scenes, args.texture_path, args.jobs, cache, args.force, options, args.textures, profile) # every mesh of every gltf scene gets its m2 + skin
+    if profile is not None:
+        profile.print_summary()
+        with open(args.profile, "w") as profile_file:
+            json.dump(dict(profile.report(), files=len(scenes), seconds=time.time() - start), profile_file, indent=1)
+    if failures > 0:
+        sys.exit(1)
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Round trip of the m2 / skin writer : a small model is built in memory, written with build_m2 and read back with read_m2 / read_skin.
+
+    Commandline : python -m unittest test_main (or pytest).
+
+"""
+
+import array
+import hashlib
+import os
+import struct
+import tempfile
+import unittest
+
+from main import Model, read_m2, read_skin, validate_m2, struct_m2_header, struct_vertex, _compress_rotations
+
+def _make_model():
+    # Two quads side by side (6 vertices, 4 triangles), with 3 translation, rotation and scaling keys.
+    vertices = array.array("f", [0.0, 0.0, 0.0, 1.0, 0.0, 0.0, 2.0, 0.0, 0.0, 0.0, 1.0, 0.5, 1.0, 1.0, 0.5, 2.0, 1.0, 0.5])
+    normals = array.array("f", [0.0, 0.0, 1.0] * 6)
+    texture_coords_0 = array.array("f", [0.0, 0.0, 0.5, 0.0, 1.0, 0.0, 0.0, 1.0, 0.5, 1.0, 1.0, 1.0])
+    triangles = array.array("H", [0, 1, 3, 1, 4, 3, 1, 2, 4, 2, 5, 4])
+    timestamps = array.array("I", [0, 500, 1000])
+    return Model("roundtrip", "roundtrip.png", vertices, normals, triangles, texture_coords_0, [0.0, 0.0, 0.0], [2.0, 1.0, 0.5],
+        timestamps, array.array("f", [0.0, 0.0, 0.0, 0.0, 1.0, 0.0, 0.0, 2.0, 0.0]),
+        array.array("I", timestamps), array.array("f", [0.0, 0.0, 0.0, 1.0, 0.0, 0.70710677, 0.0, 0.70710677, 0.0, 1.0, 0.0, 0.0]),
+        array.array("I", timestamps), array.array("f", [1.0, 1.0, 1.0, 2.0, 2.0, 2.0, 1.0, 1.0, 1.0]))
+
+# sha1 of the files build_m2 gives for _make_model : any change to the writer output shows up here
+expected_hashes = {
+    "roundtrip.m2": "25516788767c21c19d6b2cc6514bef2e49bfde1c",
+    "roundtrip00.skin": "8c7ae094e08f96e001f51f56c708cf610a7ac406",
+}
+
+class RoundTripTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.model = _make_model()
+        self.files = self.model.build_m2("world\\roundtrip\\")
+        for file_name, data in self.files:
+            with open(os.path.join(self.folder.name, file_name), "wb") as out_file:
+                out_file.write(data)
+        self.m2 = read_m2(os.path.join(self.folder.name, "roundtrip.m2"))
+        self.skin = read_skin(os.path.join(self.folder.name, "roundtrip00.skin"))
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_file_names(self):
+        self.assertEqual([file_name for file_name, data in self.files], ["roundtrip.m2", "roundtrip00.skin"])
+
+    def test_header(self):
+        header = self.m2["header"]
+        m2_size = len(self.files[0][1])
+        self.assertEqual((header["magic"], header["version"]), (808600653, 264))
+        self.assertEqual(self.m2["name"], "roundtrip")
+        self.assertEqual((header["n_vertices"], header["n_views"], header["n_bones"], header["n_textures"]), (6, 1, 1, 1))
+        self.assertEqual(header["ofs_name"], struct_m2_header.size) # the first section comes right after the header
+        for field, value in header.items():
+            if field.startswith("ofs_") and header["n_" + field[4:]]:
+                self.assertTrue(struct_m2_header.size <= value < m2_size, field)
+        self.assertLessEqual(header["ofs_vertices"] + header["n_vertices"] * struct_vertex.size, m2_size)
+        self.assertEqual((header["bounding_lower_z"], header["bounding_upper_z"]), (0.0, 1.0)) # Z up : the model Y
+        self.assertEqual(validate_m2(os.path.join(self.folder.name, "roundtrip.m2")), [])
+
+    def test_vertices(self):
+        # positions and normals went Z up in build_m2, the model arrays hold the turned values
+        self.assertEqual(self.m2["vertices"], self.model.vertices)
+        self.assertEqual(self.m2["normals"], self.model.normals)
+        self.assertEqual(self.m2["texture_coords_0"], self.model.texture_coords_0)
+        m2_data = self.files[0][1]
+        record = struct_vertex.unpack_from(m2_data, self.m2["header"]["ofs_vertices"] + struct_vertex.size)
+        self.assertEqual(record[3:11], (255, 0, 0, 0, 0, 0, 0, 0)) # full weight on bone 0
+
+    def test_skin(self):
+        header = self.skin["header"]
+        self.assertEqual(header["magic"], 1313426259)
+        self.assertEqual(self.skin["indices"], array.array("H", range(0, 6)))
+        self.assertEqual(self.skin["triangles"], array.array("H", _make_model().triangles))
+        self.assertEqual([submesh[2:6] for submesh in self.skin["submeshes"]], [(0, 6, 0, 12)])
+        self.assertEqual([(unit["skin_section"], unit["texture_count"]) for unit in self.skin["texture_units"]], [(0, 1)])
+
+    def test_keys(self):
+        data = self.files[0][1]
+        header = self.m2["header"]
+        bone = struct.unpack_from("<iIhHHH" + "hhIIII" * 3, data, header["ofs_bones"])
+        n_timestamps, ofs_timestamps = struct.unpack_from("<II", data, bone[9])
+        self.assertEqual(list(struct.unpack_from("<3I", data, ofs_timestamps)), [0, 500, 1000])
+
+    def test_bytes(self):
+        for file_name, data in self.files:
+            self.assertEqual(hashlib.sha1(data).hexdigest(), expected_hashes[file_name], file_name)
+
+class CompressRotationsTest(unittest.TestCase):
+    def test_out_of_range(self):
+        # slightly unnormalized components must not wrap around to the other sign
+        shorts = _compress_rotations(array.array("f", [1.00002, -1.00002, 1.0, -1.0, 0.0]))
+        decoded = [(s + 32768) / 32767.0 if s < 0 else (s - 32767) / 32767.0 for s in shorts]
+        self.assertEqual(decoded, [1.0, -1.0, 1.0, -1.0, 0.0])
+
+if __name__ == "__main__":
+    unittest.main()